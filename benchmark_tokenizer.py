@@ -0,0 +1,235 @@
+import os
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import importlib
+import subprocess
+import tracemalloc
+import numpy as np
+from datetime import datetime
+from corpus_reader import FORMATS, iter_articles
+
+'''
+tokenizer吞吐量测试
+对cache/下的每个词表分别用tokenization_bert（word piece）和tokenization_bert_without_wordpiece（以及它们的fast_char_mode）编码几份测试语料，
+统计每秒字数、每秒token数、UNK比例和编码时的峰值内存，结果写成json，可以用--baseline和之前的结果对比
+'''
+
+TOKENIZERS = {
+    'wordpiece': ('tokenization_bert', {}),
+    'wordpiece_fast': ('tokenization_bert', {'fast_char_mode': True}),
+    'no_wordpiece': ('tokenization_bert_without_wordpiece', {}),
+    'no_wordpiece_fast': ('tokenization_bert_without_wordpiece', {'fast_char_mode': True}),
+}
+
+_LATIN_WORDS = ['football', 'Messi', 'Barcelona', 'NBA', 'iPhone', 'championship', 'Premier', 'League', 'CBA',
+                'Guardiola', 'unaffable', 'Bundesliga', 'offside', 'VAR', 'MVP', 'Python', 'GPT2', 'transformer']
+_NUMBERS = ['2019', '3:2', '95.5%', '1-0', '23', '7.8', '100m', '12:45', '0.618', '1998']
+_PUNCTUATION = '，，，。。、！？：；“”'
+_CLASSICAL_PUNCTUATION = '，，，。。'
+
+
+def _cjk_chars(vocab_file):
+    with open(vocab_file, 'r', encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f
+                if len(line.rstrip('\n')) == 1 and 0x3400 <= ord(line.rstrip('\n')) <= 0x9FFF]
+
+
+def _sentences(rs, chars, punctuation, min_len, max_len, extra=None, extra_rate=0.0):
+    while True:
+        words = []
+        for _ in range(rs.randint(min_len, max_len)):
+            if extra and rs.random() < extra_rate:
+                words.append(' ' + rs.choice(extra) + ' ')
+            else:
+                words.append(rs.choice(chars))
+        yield ''.join(words) + rs.choice(punctuation)
+
+
+def _documents(sentences, rs, num_chars, doc_chars):
+    """把句子拼成文章，每篇约doc_chars字，段落之间和预处理时一样用[SEP]分隔"""
+    documents = []
+    total = 0
+    while total < num_chars:
+        document = []
+        length = 0
+        while length < doc_chars:
+            paragraph = ''.join(next(sentences) for _ in range(rs.randint(2, 6)))
+            document.append(paragraph)
+            length += len(paragraph)
+        document = ' [SEP] '.join(document)
+        documents.append(document)
+        total += len(document)
+    return documents
+
+
+def build_corpora(cache_dir, num_chars, seed=1, sample_path='', sample_format=None, doc_chars=1000):
+    """生成测试语料，返回{名字: 文章列表}。合成语料用固定种子，每次运行完全相同"""
+    rs = random.Random(seed)
+    modern = _cjk_chars(os.path.join(cache_dir, 'vocab_small.txt'))
+    # 古文语料以古文词表和小词表共有的字为主，再混入约两成只在古文词表里的生僻字
+    guwen = set(_cjk_chars(os.path.join(cache_dir, 'vocab_guwen.txt')))
+    common = sorted(guwen & set(modern)) or modern
+    rare = sorted(guwen - set(modern))
+    classical = common * 4 + rare[:len(common)]
+    corpora = {
+        'chinese': _documents(_sentences(rs, modern, _PUNCTUATION, 5, 30), rs, num_chars, doc_chars),
+        'classical': _documents(_sentences(rs, classical, _CLASSICAL_PUNCTUATION, 4, 7), rs, num_chars,
+                                doc_chars),
+        'mixed': _documents(_sentences(rs, modern, _PUNCTUATION, 5, 30, _LATIN_WORDS + _NUMBERS, 0.25), rs,
+                            num_chars, doc_chars),
+    }
+    if sample_path:
+        documents = []
+        total = 0
+        for article in iter_articles(sample_path, sample_format):
+            if total >= num_chars:
+                break
+            article = article.replace('\n', ' [SEP] ')
+            documents.append(article)
+            total += len(article)
+        corpora['sample'] = documents
+    return corpora
+
+
+def load_tokenizer(kind, vocab_file):
+    module_name, kwargs = TOKENIZERS[kind]
+    module = importlib.import_module(module_name)
+    start = time.perf_counter()
+    tokenizer = module.BertTokenizer(vocab_file=vocab_file, **kwargs)
+    return tokenizer, time.perf_counter() - start
+
+
+def encode_documents(tokenizer, documents):
+    """返回所有文章的id拼成的数组，没有encode_batch的tokenizer（如旧版本）逐篇tokenize再转id"""
+    if hasattr(tokenizer, 'encode_batch'):
+        return tokenizer.encode_batch(documents)[0]
+    ids = []
+    for document in documents:
+        ids.extend(tokenizer.convert_tokens_to_ids(tokenizer.tokenize(document)))
+    return np.array(ids, dtype=np.int64)
+
+
+def run_one(tokenizer, documents, repeat):
+    num_chars = sum(len(document) for document in documents)
+    gc.collect()
+    tracemalloc.start()
+    ids = encode_documents(tokenizer, documents)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        encode_documents(tokenizer, documents)
+        seconds.append(time.perf_counter() - start)
+    best = min(seconds)
+    unk_id = tokenizer.vocab.get(tokenizer.unk_token)
+    return {
+        'documents': len(documents),
+        'chars': num_chars,
+        'tokens': int(ids.size),
+        'seconds': best,
+        'chars_per_sec': num_chars / best,
+        'tokens_per_sec': ids.size / best,
+        'unk_rate': float((ids == unk_id).mean()) if ids.size else 0.0,
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return result['tokenizer'], result['vocab'], result['corpus']
+
+
+def compare(results, baseline_path, threshold):
+    """和之前的结果对比chars_per_sec，返回变慢超过threshold的项"""
+    with open(baseline_path, 'r') as f:
+        baseline = {result_key(result): result for result in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        old = baseline.get(result_key(result))
+        if old is None:
+            continue
+        ratio = result['chars_per_sec'] / old['chars_per_sec']
+        print('{:<17} {:<32} {:<10} {:>7.2f}x'.format(*result_key(result), ratio))
+        if ratio < 1 - threshold:
+            regressions.append(result_key(result))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_dir', default='cache', type=str, required=False, help='词表目录')
+    parser.add_argument('--vocabs', default='', type=str, required=False,
+                        help='要测试的词表文件名，用逗号分开，默认为词表目录下所有的txt')
+    parser.add_argument('--tokenizers', default='wordpiece,wordpiece_fast,no_wordpiece,no_wordpiece_fast', type=str,
+                        required=False, help='要测试的tokenizer，wordpiece、no_wordpiece以及加上fast_char_mode的'
+                                             'wordpiece_fast、no_wordpiece_fast，用逗号分开')
+    parser.add_argument('--num_chars', default=200000, type=int, required=False, help='每份合成语料的字数')
+    parser.add_argument('--sample_path', default='', type=str, required=False,
+                        help='额外测试的真实语料（json或jsonl格式），只取前num_chars字')
+    parser.add_argument('--sample_format', default=None, choices=FORMATS, required=False, help='真实语料的格式')
+    parser.add_argument('--repeat', default=3, type=int, required=False, help='每项重复测几次，取最快的一次')
+    parser.add_argument('--seed', default=1, type=int, required=False, help='生成合成语料的随机种子')
+    parser.add_argument('--output', default='tokenizer_benchmark.json', type=str, required=False,
+                        help='结果输出路径')
+    parser.add_argument('--baseline', default='', type=str, required=False, help='之前的结果，用于对比')
+    parser.add_argument('--regression_threshold', default=0.2, type=float, required=False,
+                        help='和baseline相比变慢超过这个比例时以非零状态退出')
+
+    args = parser.parse_args()
+    print('args:\n' + args.__repr__())
+
+    vocabs = args.vocabs.split(',') if args.vocabs else \
+        sorted(name for name in os.listdir(args.vocab_dir) if name.endswith('.txt'))
+    corpora = build_corpora(args.vocab_dir, args.num_chars, seed=args.seed, sample_path=args.sample_path,
+                            sample_format=args.sample_format)
+
+    results = []
+    for kind in args.tokenizers.split(','):
+        if kind not in TOKENIZERS:
+            raise ValueError('unknown tokenizer {}, expected one of {}'.format(kind, sorted(TOKENIZERS)))
+        for vocab in vocabs:
+            tokenizer, init_seconds = load_tokenizer(kind, os.path.join(args.vocab_dir, vocab))
+            for corpus, documents in sorted(corpora.items()):
+                result = run_one(tokenizer, documents, args.repeat)
+                result.update(tokenizer=kind, vocab=vocab, corpus=corpus, vocab_size=tokenizer.vocab_size,
+                              init_seconds=init_seconds)
+                results.append(result)
+                print('{:<17} {:<32} {:<10} {:>12.0f} chars/s {:>12.0f} tokens/s  unk {:6.2%}  peak {:7.1f}MB'.format(
+                    kind, vocab, corpus, result['chars_per_sec'], result['tokens_per_sec'], result['unk_rate'],
+                    result['peak_memory_bytes'] / 2 ** 20))
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'time': datetime.now().isoformat(),
+            'git_commit': git_commit(),
+            'python': sys.version,
+            'platform': platform.platform(),
+            'args': vars(args),
+            'results': results,
+        }, f, indent=2)
+    print('results written to {}'.format(args.output))
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.regression_threshold)
+        if regressions:
+            print('{} results are more than {:.0%} slower than the baseline: {}'.format(
+                len(regressions), args.regression_threshold, regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,55 +1,106 @@
 import sentencepiece as spm
 from tqdm import tqdm
 import os
+import argparse
+import collections
+from concurrent.futures import ProcessPoolExecutor
+from corpus_reader import iter_line_chunks
+from parallel_utils import imap_in_order
+from tokenized_files import PiecesWriter, dtype_for_vocab_size, file_fingerprint, load_tokenized_file, \
+    piece_chunk_size, tokenized_file_path, write_manifest
 
-g_corpus_name = 'channel'
-# g_corpus_name = 'hongloumeng'
-g_text_file_with_sep_path = 'data-sp/{}/train_sep.txt'.format(g_corpus_name)
-g_tokenized_data_dir_path = 'data-sp/{}/tokenized'.format(g_corpus_name)
-g_vocab_size = 16000
-g_model_prefix = '{}_sp_model_{}'.format(g_corpus_name, g_vocab_size)
-g_model_file = '{}/{}/{}.model'.format('cache-sp', g_corpus_name, g_model_prefix)
-# g_num_pieces = 100
-# g_num_pieces = 10
-g_num_pieces = 1
+'''
+用训练好的SentencePiece模型把train_sep.txt编码成tokenized语料（二进制格式加manifest.json）
+按行流式读取，每个chunk交给进程池编码，每个worker进程只加载一次模型
+'''
 
+_worker_sp = None
 
-def build_files(raw_data_path, tokenized_data_path, model_file, num_pieces):
+
+def init_sp_worker(model_file):
+    global _worker_sp
+    _worker_sp = load_sp_model(model_file)
+
+
+def load_sp_model(model_file):
+    sp = spm.SentencePieceProcessor()
+    sp.load(model_file)
+    return sp
+
+
+def encode_text(text, sp=None):
+    return (sp or _worker_sp).EncodeAsIds(text)
+
+
+def build_files(raw_data_path, tokenized_data_path, model_file, num_pieces, workers=1, chunk_size=1 << 20):
     if not os.path.exists(tokenized_data_path):
-        os.mkdir(tokenized_data_path)
+        os.makedirs(tokenized_data_path)
+    sp = load_sp_model(model_file)
+    file_size = os.path.getsize(raw_data_path)
+    chunk_size = piece_chunk_size(file_size, num_pieces, chunk_size)
+    positions = collections.deque()
 
-    with open(raw_data_path, 'r', encoding='utf8') as f:
-        print('reading lines')
-        lines = f.readlines()
-        single = ''.join(lines)
-        len_single = len(single)
+    def chunks():
+        for text, position in iter_line_chunks(raw_data_path, chunk_size):
+            positions.append(position)
+            yield text
 
-        sp = spm.SentencePieceProcessor()
-        sp.load(model_file)
-        for i in tqdm(range(num_pieces)):
-            single_ids = sp.EncodeAsIds(single[len_single // num_pieces * i: len_single // num_pieces * (i + 1)])
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_sp_worker, initargs=(model_file,))
+        results = imap_in_order(executor, encode_text, chunks(), 2 * workers)
+    else:
+        executor = None
+        results = (encode_text(text, sp) for text in chunks())
 
-            with open(os.path.join(tokenized_data_path, 'tokenized_train_{}.txt'.format(i)), 'w') as ff:
-                for token_id in single_ids[:-1]:
-                    ff.write(str(token_id) + ' ')
-                ff.write(str(single_ids[-1]))
-                ff.write('\n')
+    dtype = dtype_for_vocab_size(sp.get_piece_size())
+    writer = PiecesWriter(tokenized_data_path, num_pieces, file_size, dtype)
+    try:
+        with tqdm(total=file_size, unit='B', unit_scale=True) as pbar:
+            for single_ids in results:
+                position = positions.popleft()
+                writer.write(single_ids, position)
+                pbar.update(position - pbar.n)
+        pieces_info = writer.finish()
+    finally:
+        writer.close()
+        if executor is not None:
+            executor.shutdown()
+    write_manifest(tokenized_data_path, pieces_info, dtype, vocab_size=sp.get_piece_size(),
+                   vocab_fingerprint=file_fingerprint(model_file))
 
     print('finish')
 
 
 def test_take_a_look(tokenized_data_path, model_file, n):
-    sp = spm.SentencePieceProcessor()
-    sp.load(model_file)
-    with open(os.path.join(tokenized_data_path, 'tokenized_train_{}.txt'.format(n)), 'r') as f:
-        line = f.read(1024).strip()
-    tokens = line.split()
-    tokens = [int(token) for token in tokens]
+    sp = load_sp_model(model_file)
+    tokens = [int(token) for token in load_tokenized_file(tokenized_file_path(tokenized_data_path, n))[:256]]
     text = sp.DecodeIds(tokens)
     print(text)
 
 
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--raw_data_path', default='data-sp/channel/train_sep.txt', type=str, required=False,
+                        help='已经在每行末尾加好换行符号的原始语料')
+    parser.add_argument('--tokenized_data_path', default='data-sp/channel/tokenized', type=str, required=False,
+                        help='tokenized语料存放位置')
+    parser.add_argument('--sp_model_file', default='cache-sp/channel/channel_sp_model_16000.model', type=str,
+                        required=False, help='SentencePiece模型文件')
+    parser.add_argument('--num_pieces', default=1, type=int, required=False, help='将训练语料分成多少份')
+    parser.add_argument('--workers', default=1, type=int, required=False, help='编码时使用的进程数')
+    parser.add_argument('--chunk_size', default=1 << 20, type=int, required=False,
+                        help='每次读入并编码的字节数（按整行切分），语料不大时自动减小到每个piece的1/16')
+    parser.add_argument('--take_a_look', action='store_true', help='完成后解码第一个文件的开头看一下')
+
+    args = parser.parse_args()
+    print('args:\n' + args.__repr__())
+
+    build_files(raw_data_path=args.raw_data_path, tokenized_data_path=args.tokenized_data_path,
+                model_file=args.sp_model_file, num_pieces=args.num_pieces, workers=args.workers,
+                chunk_size=args.chunk_size)
+    if args.take_a_look:
+        test_take_a_look(tokenized_data_path=args.tokenized_data_path, model_file=args.sp_model_file, n=0)
+
+
 if __name__ == '__main__':
-    build_files(raw_data_path=g_text_file_with_sep_path, tokenized_data_path=g_tokenized_data_dir_path,
-                model_file=g_model_file, num_pieces=g_num_pieces)
-    test_take_a_look(tokenized_data_path=g_tokenized_data_dir_path, model_file=g_model_file, n=0)
+    main()
@@ -2,34 +2,90 @@
 
 import sentencepiece as spm
 import os
+import random
+import argparse
 
-g_corpus_name = 'channel'
-# g_corpus_name = 'hongloumeng'
-g_text_file_with_sep_path = 'data-sp/{}/train_sep.txt'.format(g_corpus_name)
-g_vocab_size = 16000
-g_return_token = 'Й'
-g_model_prefix = 'cache-sp/{}/{}_sp_model_{}'.format(g_corpus_name, g_corpus_name, g_vocab_size)
+'''
+训练SentencePiece词表模型
+原始语料按行流式读取，在读取的同时给每行末尾加上换行符号，再用蓄水池抽样取固定数量的句子交给trainer，内存占用只和抽样大小有关
+'''
 
 
-def append_each_line_with_sep(text_file_path, text_file_with_seq_path, return_token):
+def iter_lines_with_sep(text_file_path, return_token):
     with open(text_file_path, 'r', encoding='utf-8') as f:
-        with open(text_file_with_seq_path, 'w', encoding='utf-8') as out_file:
-            for line in f:
-                out_file.write(line.strip() + return_token + '\n')
+        for line in f:
+            yield line.strip() + return_token
 
 
-def main(text_file_with_seq_path, model_prefix, vocab_size):
-    # train_args = '--input={} --model_prefix={} --vocab_size={}'.format(text_file_with_seq_path, model_prefix, vocab_size)
-    train_args = '--input={} --model_prefix={} --vocab_size={} --character_coverage=1.0'.format(text_file_with_seq_path, model_prefix, vocab_size)
-    print(train_args)
-    spm.SentencePieceTrainer.train(train_args)
+def append_each_line_with_sep(text_file_path, text_file_with_seq_path, return_token):
+    with open(text_file_with_seq_path, 'w', encoding='utf-8') as out_file:
+        for line in iter_lines_with_sep(text_file_path, return_token):
+            out_file.write(line + '\n')
 
 
-if __name__ == '__main__':
-    dir_name = os.path.dirname(g_model_prefix)
+def reservoir_sample(lines, sample_size, seed=None):
+    """蓄水池抽样，返回(抽到的句子, 总句子数)，句子总数不超过sample_size时全部保留且保持原来的顺序"""
+    rs = random.Random(seed)
+    sample = []
+    total = 0
+    for line in lines:
+        total += 1
+        if len(sample) < sample_size:
+            sample.append(line)
+        else:
+            j = rs.randrange(total)
+            if j < sample_size:
+                sample[j] = line
+    return sample, total
+
+
+def train_model(text_file_path, model_prefix, vocab_size, return_token='Й', sample_size=1000000, seed=None,
+                character_coverage=1.0, num_threads=None, max_sentence_length=4192, model_type='unigram'):
+    dir_name = os.path.dirname(model_prefix)
     if dir_name != '' and not os.path.exists(dir_name):
         os.makedirs(dir_name)
-    # append_each_line_with_sep(g_text_file_path, g_text_file_with_sep_path, g_return_token)
-    main(text_file_with_seq_path=g_text_file_with_sep_path, model_prefix=g_model_prefix, vocab_size=g_vocab_size)
+    print('sampling sentences')
+    sample, total = reservoir_sample(iter_lines_with_sep(text_file_path, return_token), sample_size, seed)
+    print('sampled {} of {} sentences'.format(len(sample), total))
+    # 抽样已经在这里做完了，trainer不再重复抽样
+    spm.SentencePieceTrainer.train(sentence_iterator=iter(sample), model_prefix=model_prefix, vocab_size=vocab_size,
+                                   character_coverage=character_coverage, model_type=model_type,
+                                   num_threads=num_threads or os.cpu_count() or 1,
+                                   max_sentence_length=max_sentence_length, input_sentence_size=0,
+                                   shuffle_input_sentence=False)
 
 
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--raw_data_path', default='data-sp/channel/train.txt', type=str, required=False,
+                        help='原始语料，每行一段')
+    parser.add_argument('--model_prefix', default='cache-sp/channel/channel_sp_model_16000', type=str,
+                        required=False, help='输出的模型文件前缀')
+    parser.add_argument('--vocab_size', default=16000, type=int, required=False, help='词表大小')
+    parser.add_argument('--return_token', default='Й', type=str, required=False,
+                        help='加在每行末尾表示换行的符号，语料已经加过的话设为空字符串')
+    parser.add_argument('--sample_size', default=1000000, type=int, required=False, help='最多抽取多少句用于训练词表')
+    parser.add_argument('--seed', default=None, type=int, required=False, help='抽样的随机种子')
+    parser.add_argument('--character_coverage', default=1.0, type=float, required=False, help='字符覆盖率')
+    parser.add_argument('--num_threads', default=None, type=int, required=False, help='trainer使用的线程数，默认为cpu核数')
+    parser.add_argument('--max_sentence_length', default=4192, type=int, required=False,
+                        help='句子的最大字节数，更长的句子会被trainer跳过')
+    parser.add_argument('--model_type', default='unigram', type=str, required=False,
+                        help='unigram, bpe, char或word')
+    parser.add_argument('--sep_output_path', default='', type=str, required=False,
+                        help='同时写出每行加好换行符号的语料，供build_sp_tokenized_files.py使用')
+
+    args = parser.parse_args()
+    print('args:\n' + args.__repr__())
+
+    train_model(args.raw_data_path, args.model_prefix, args.vocab_size, return_token=args.return_token,
+                sample_size=args.sample_size, seed=args.seed, character_coverage=args.character_coverage,
+                num_threads=args.num_threads, max_sentence_length=args.max_sentence_length,
+                model_type=args.model_type)
+    if args.sep_output_path:
+        append_each_line_with_sep(args.raw_data_path, args.sep_output_path, args.return_token)
+    print('finish')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+import os
+import json
+import shutil
+import argparse
+import collections
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from compiled_vocab import read_vocab_tokens
+from corpus_reader import FORMATS, iter_articles, iter_text_blocks
+from parallel_utils import batched, imap_in_order, init_tokenizer_worker, tokenize_texts
+from tokenized_files import TokenizedFileWriter, document_index_path, dtype_for_vocab_size, file_fingerprint, \
+    load_manifest, load_tokenized_file, piece_info, tokenized_file_path, write_manifest
+
+'''
+根据语料从一个已有的词表里挑出一个更小的词表
+用原词表的tokenizer多进程统计语料里每个token和每个字出现的次数，合并后按次数从高到低保留token，直到达到 --coverage 覆盖率或 --vocab_size 大小
+特殊token总是保留，保留下来的token维持在原词表中的先后顺序；可选地把语料里常见但原词表没有的汉字加在词表末尾
+不做word piece时，或者语料里出现过的token都保留了、也没有加字时，新词表切出的token和原词表相同（去掉的token本来就是[UNK]或没出现过），
+已经tokenize好的语料只需要按id查表换成新的id，不需要重新tokenize；否则word piece会切得不一样，只能用新词表重新tokenize
+'''
+
+_REMAP_BLOCK = 1 << 24
+
+
+def count_texts(texts, vocab_size, full_tokenizer=None):
+    """返回(每个token id出现的次数, 每个字出现的次数)"""
+    ids, _ = tokenize_texts(texts, full_tokenizer)
+    return np.bincount(ids, minlength=vocab_size), collections.Counter(''.join(texts))
+
+
+def iter_corpus(raw_data_path, data_format, full_tokenizer, chunk_size=1 << 20):
+    # 和预处理时一样用[SEP]表示换行
+    if data_format == 'txt':
+        blocks = (text.replace('\n', ' [SEP] ') for text, _ in iter_text_blocks(raw_data_path, chunk_size))
+        return full_tokenizer.iter_chunks(blocks, chunk_size)
+    return (article.replace('\n', ' [SEP] ') for article in iter_articles(raw_data_path, data_format))
+
+
+def count_corpus(raw_data_path, full_tokenizer, data_format=None, tokenizer_path=None, no_wordpiece=False,
+                 workers=1, batch_size=1000):
+    """多进程统计整个语料，返回(每个token id出现的次数, 每个字出现的次数)"""
+    if workers > 1 and tokenizer_path is None:
+        raise ValueError('tokenizer_path is required when workers > 1')
+    # 词表有重复行时id不连续，按最大的id算大小
+    vocab_size = max(full_tokenizer.vocab.values()) + 1
+    texts = batched(iter_corpus(raw_data_path, data_format, full_tokenizer), batch_size)
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_tokenizer_worker,
+                                       initargs=(tokenizer_path, no_wordpiece))
+        results = imap_in_order(executor, count_texts, texts, 2 * workers, vocab_size)
+    else:
+        executor = None
+        results = (count_texts(batch, vocab_size, full_tokenizer) for batch in texts)
+    token_counts = np.zeros(vocab_size, dtype=np.int64)
+    char_counts = collections.Counter()
+    try:
+        for batch_token_counts, batch_char_counts in tqdm(results):
+            token_counts += batch_token_counts
+            char_counts.update(batch_char_counts)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return token_counts, char_counts
+
+
+def new_char_counts(char_counts, full_tokenizer):
+    """语料里出现过、但原词表里没有的汉字及其次数。汉字按tokenizer处理后的形式统计，如兼容区的汉字会归到对应的统一汉字"""
+    counts = collections.Counter()
+    for char, count in char_counts.items():
+        if full_tokenizer.basic_tokenizer._is_chinese_char(ord(char)):
+            token = full_tokenizer.basic_tokenizer.tokenize(char)[0]
+            if token not in full_tokenizer.vocab:
+                counts[token] += count
+    return counts
+
+
+def select_tokens(tokens, token_counts, special_tokens, unk_token, coverage=1.0, vocab_size=0, min_count=1,
+                  new_chars=None):
+    """按出现次数从高到低挑选token，返回(保留的原词表id, 新加的字, 覆盖率)
+
+    tokens是原词表按行排列的token，重复的token和load_vocab一样以最后一行为准
+    覆盖率是语料中除特殊token外、能用新词表表示的token所占的比例，原本就是[UNK]的部分算作没有覆盖
+    """
+    token_ids = {token: i for i, token in enumerate(tokens)}
+    special_ids = sorted(set(token_ids[token] for token in special_tokens if token in token_ids))
+    is_special = np.zeros(len(tokens), dtype=bool)
+    is_special[special_ids] = True
+    unk_count = int(token_counts[token_ids[unk_token]])
+    total = int(token_counts[~is_special].sum()) + unk_count
+    candidates = [(int(count), i) for i, count in enumerate(token_counts.tolist()) if not is_special[i]]
+    candidates += [(count, char) for char, count in (new_chars or {}).items()]
+    candidates.sort(key=lambda candidate: (-candidate[0], isinstance(candidate[1], str), candidate[1]))
+
+    kept_ids = list(special_ids)
+    added_chars = []
+    covered = 0
+    for count, token in candidates:
+        if count < min_count or covered >= coverage * total:
+            break
+        if vocab_size and len(kept_ids) + len(added_chars) >= vocab_size:
+            break
+        if isinstance(token, str):
+            added_chars.append(token)
+        else:
+            kept_ids.append(token)
+        covered += count
+    return sorted(kept_ids), added_chars, covered / total if total else 1.0
+
+
+def write_vocab(path, tokens):
+    dir_name = os.path.dirname(path)
+    if dir_name and not os.path.exists(dir_name):
+        os.makedirs(dir_name)
+    with open(path, 'w', encoding='utf-8') as f:
+        for token in tokens:
+            f.write(token + '\n')
+
+
+def write_model_config(template_path, output_path, vocab_size):
+    """复制模型参数文件，把vocab_size换成新词表的大小"""
+    with open(template_path, 'r') as f:
+        config = json.load(f)
+    config['vocab_size'] = vocab_size
+    with open(output_path, 'w') as f:
+        json.dump(config, f, indent=2)
+
+
+def remap_tokenized_files(tokenized_data_path, output_path, id_map, vocab_size, vocab_fingerprint=None,
+                          old_vocab_fingerprint=None):
+    """把用原词表tokenize好的语料按id_map换成新词表的id，文章边界索引原样复制"""
+    manifest = load_manifest(tokenized_data_path)
+    if old_vocab_fingerprint is not None and manifest['vocab_fingerprint'] not in (None, old_vocab_fingerprint):
+        raise ValueError('{} was not tokenized with the vocab the new vocab was built from'.format(tokenized_data_path))
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+    dtype = dtype_for_vocab_size(vocab_size)
+    pieces = []
+    for i, piece in enumerate(tqdm(manifest['pieces'])):
+        ids = load_tokenized_file(tokenized_file_path(tokenized_data_path, i))
+        with TokenizedFileWriter(tokenized_file_path(output_path, i), dtype) as writer:
+            for start in range(0, len(ids), _REMAP_BLOCK):
+                writer.write(id_map[ids[start:start + _REMAP_BLOCK]])
+        if os.path.exists(document_index_path(tokenized_data_path, i)):
+            shutil.copyfile(document_index_path(tokenized_data_path, i), document_index_path(output_path, i))
+        pieces.append(piece_info(len(ids), piece['num_documents']))
+    write_manifest(output_path, pieces, dtype, vocab_size=vocab_size, vocab_fingerprint=vocab_fingerprint)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--raw_data_path', default='data/train.json', type=str, required=False, help='原始训练语料')
+    parser.add_argument('--raw_data_format', default=None, choices=FORMATS + ('txt',), required=False,
+                        help='原始语料格式，json、jsonl或txt（train_single.py用的纯文本），默认按文件后缀判断')
+    parser.add_argument('--tokenizer_path', default='cache/vocab.txt', type=str, required=False,
+                        help='原词表，新词表从中挑选')
+    parser.add_argument('--no_wordpiece', action='store_true', help='不做word piece切词')
+    parser.add_argument('--workers', default=1, type=int, required=False, help='统计时使用的进程数')
+    parser.add_argument('--batch_size', default=1000, type=int, required=False, help='每个进程每次统计多少篇文章')
+    parser.add_argument('--coverage', default=1.0, type=float, required=False,
+                        help='保留token直到覆盖语料中这个比例的token，1.0为保留所有出现过的token')
+    parser.add_argument('--vocab_size', default=0, type=int, required=False, help='新词表的最大大小，0为不限制')
+    parser.add_argument('--min_count', default=1, type=int, required=False, help='出现次数少于这个值的token不保留')
+    parser.add_argument('--add_new_chars', action='store_true',
+                        help='把语料里出现过但原词表没有的汉字也按出现次数加入新词表')
+    parser.add_argument('--output_vocab', default='cache/vocab_corpus.txt', type=str, required=False,
+                        help='新词表输出路径')
+    parser.add_argument('--model_config', default='config/model_config_small.json', type=str, required=False,
+                        help='模型参数模板')
+    parser.add_argument('--output_config', default='config/model_config_corpus.json', type=str, required=False,
+                        help='vocab_size换成新词表大小后的模型参数输出路径')
+    parser.add_argument('--tokenized_data_path', default='', type=str, required=False,
+                        help='用原词表tokenize好的语料，设置后会换成新词表的id，只用于--no_wordpiece或者语料里出现过的token都保留的情况')
+    parser.add_argument('--output_tokenized_data_path', default='data/tokenized_corpus_vocab/', type=str,
+                        required=False, help='换成新词表id后的tokenized语料存放位置')
+
+    args = parser.parse_args()
+    print('args:\n' + args.__repr__())
+
+    if args.no_wordpiece:
+        import tokenization_bert_without_wordpiece as tokenization_bert
+    else:
+        import tokenization_bert
+    full_tokenizer = tokenization_bert.BertTokenizer(vocab_file=args.tokenizer_path)
+    if full_tokenizer.unk_token not in full_tokenizer.vocab:
+        raise ValueError('{} has no {} token'.format(args.tokenizer_path, full_tokenizer.unk_token))
+    tokens = read_vocab_tokens(args.tokenizer_path)
+
+    print('counting tokens')
+    token_counts, char_counts = count_corpus(args.raw_data_path, full_tokenizer, data_format=args.raw_data_format,
+                                             tokenizer_path=args.tokenizer_path, no_wordpiece=args.no_wordpiece,
+                                             workers=args.workers, batch_size=args.batch_size)
+    new_chars = new_char_counts(char_counts, full_tokenizer)
+    print('{} tokens, {} distinct tokens of {} in the vocab, {} [UNK], {} chars not in the vocab'.format(
+        int(token_counts.sum()), int((token_counts > 0).sum()), len(tokens),
+        int(token_counts[full_tokenizer.vocab[full_tokenizer.unk_token]]), len(new_chars)))
+
+    kept_ids, added_chars, coverage = select_tokens(tokens, token_counts, full_tokenizer.all_special_tokens,
+                                                    full_tokenizer.unk_token, coverage=args.coverage,
+                                                    vocab_size=args.vocab_size, min_count=args.min_count,
+                                                    new_chars=new_chars if args.add_new_chars else None)
+    new_tokens = [tokens[i] for i in kept_ids] + added_chars
+    write_vocab(args.output_vocab, new_tokens)
+    write_model_config(args.model_config, args.output_config, len(new_tokens))
+    print('kept {} of {} tokens and added {} chars, coverage {:.4%}'.format(
+        len(kept_ids), len(tokens), len(added_chars), coverage))
+    print('vocab written to {}, model config written to {}'.format(args.output_vocab, args.output_config))
+
+    if args.tokenized_data_path:
+        kept = np.zeros(len(tokens), dtype=bool)
+        kept[kept_ids] = True
+        dropped = int(((token_counts > 0) & ~kept).sum())
+        if not args.no_wordpiece and (dropped or added_chars):
+            raise ValueError('{} tokens that appear in the corpus were dropped and {} chars were added, word pieces '
+                             'cut with {} differ from the remapped ids, tokenize {} again with it instead'.format(
+                                 dropped, len(added_chars), args.output_vocab, args.raw_data_path))
+        if added_chars:
+            print('warning: the added chars are [UNK] in the tokenized data, tokenize again to make use of them')
+        id_map = np.full(len(tokens), new_tokens.index(full_tokenizer.unk_token), dtype=np.int64)
+        id_map[kept_ids] = np.arange(len(kept_ids))
+        print('remapping tokenized data')
+        remap_tokenized_files(args.tokenized_data_path, args.output_tokenized_data_path, id_map, len(new_tokens),
+                              vocab_fingerprint=file_fingerprint(args.output_vocab),
+                              old_vocab_fingerprint=file_fingerprint(args.tokenizer_path))
+    print('finish')
+
+
+if __name__ == '__main__':
+    main()
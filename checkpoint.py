@@ -0,0 +1,133 @@
+import os
+import re
+import pickle
+import random
+import shutil
+import numpy as np
+import torch
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+训练断点
+每隔固定步数把模型、优化器、学习率调度器、各个随机数生成器的状态以及数据位置（epoch、文件顺序、epoch内已经训练过的batch数）存到 {output_dir}/checkpoints/checkpoint_{步数}/
+保存时先在训练线程里把所有状态复制一份到CPU内存，再由后台线程写盘，训练不用等写盘；写完整个目录后才改成正式的名字，并删掉多余的旧断点
+断点目录里的pytorch_model.bin和config.json可以直接用from_pretrained读取
+'''
+
+CHECKPOINT_DIR_NAME = 'checkpoints'
+_CHECKPOINT_PATTERN = re.compile(r'^checkpoint_(\d+)$')
+_WEIGHTS_NAME = 'pytorch_model.bin'
+_CONFIG_NAME = 'config.json'
+_OPTIMIZER_NAME = 'optimizer.pt'
+_STATE_NAME = 'training_state.pkl'
+
+
+def checkpoint_path(checkpoint_dir, step):
+    return os.path.join(checkpoint_dir, 'checkpoint_{}'.format(step))
+
+
+def list_checkpoints(checkpoint_dir):
+    """返回[(步数, 路径), ...]，按步数从小到大排列，没写完的临时目录不算"""
+    if not os.path.isdir(checkpoint_dir):
+        return []
+    checkpoints = []
+    for name in os.listdir(checkpoint_dir):
+        match = _CHECKPOINT_PATTERN.match(name)
+        if match:
+            checkpoints.append((int(match.group(1)), os.path.join(checkpoint_dir, name)))
+    return sorted(checkpoints)
+
+
+def latest_checkpoint(checkpoint_dir):
+    checkpoints = list_checkpoints(checkpoint_dir)
+    return checkpoints[-1][1] if checkpoints else None
+
+
+def cpu_snapshot(obj):
+    """把state_dict里的tensor都复制到CPU上，之后训练继续更新参数也不会影响快照"""
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((key, cpu_snapshot(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(cpu_snapshot(value) for value in obj)
+    return obj
+
+
+def rng_states():
+    return {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+    }
+
+
+def set_rng_states(states):
+    random.setstate(states['python'])
+    np.random.set_state(states['numpy'])
+    torch.set_rng_state(states['torch'])
+    if states['cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(states['cuda'])
+
+
+def load_checkpoint(path):
+    """返回(模型参数, {'optimizer':..., 'scheduler':...}, 训练状态)，tensor都在CPU上"""
+    model_state = torch.load(os.path.join(path, _WEIGHTS_NAME), map_location='cpu')
+    optimizer_state = torch.load(os.path.join(path, _OPTIMIZER_NAME), map_location='cpu')
+    with open(os.path.join(path, _STATE_NAME), 'rb') as f:
+        state = pickle.load(f)
+    return model_state, optimizer_state, state
+
+
+class CheckpointSaver(object):
+    """在后台线程里写断点，同一时间只有一个断点在写，只保留最新的keep个，keep为0时全部保留"""
+
+    def __init__(self, checkpoint_dir, keep=3):
+        self.checkpoint_dir = checkpoint_dir
+        self.keep = keep
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._future = None
+
+    def save(self, step, model, optimizer, scheduler, state):
+        """state是数据位置等可以pickle的训练状态，随机数状态会自动加上"""
+        self.wait()  # 上一个断点还没写完时先等它，内存里最多只有一份快照
+        model_to_save = model.module if hasattr(model, 'module') else model
+        snapshot = {
+            'model': cpu_snapshot(model_to_save.state_dict()),
+            'config': model_to_save.config.to_json_string(),
+            'optimizer': {'optimizer': cpu_snapshot(optimizer.state_dict()),
+                          'scheduler': cpu_snapshot(scheduler.state_dict())},
+            'state': dict(state, rng=rng_states()),
+        }
+        self._future = self._executor.submit(self._write, step, snapshot)
+
+    def _write(self, step, snapshot):
+        path = checkpoint_path(self.checkpoint_dir, step)
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        torch.save(snapshot['model'], os.path.join(tmp_path, _WEIGHTS_NAME))
+        with open(os.path.join(tmp_path, _CONFIG_NAME), 'w', encoding='utf-8') as f:
+            f.write(snapshot['config'])
+        torch.save(snapshot['optimizer'], os.path.join(tmp_path, _OPTIMIZER_NAME))
+        with open(os.path.join(tmp_path, _STATE_NAME), 'wb') as f:
+            pickle.dump(snapshot['state'], f, protocol=pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+        if self.keep > 0:
+            for _, old_path in list_checkpoints(self.checkpoint_dir)[:-self.keep]:
+                shutil.rmtree(old_path)
+        print('checkpoint saved to {}'.format(path))
+
+    def wait(self):
+        """等正在写的断点写完，写盘出错时在这里抛出"""
+        if self._future is not None:
+            future, self._future = self._future, None
+            future.result()
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
@@ -0,0 +1,106 @@
+import os
+import zlib
+import pickle
+import hashlib
+from io import open
+
+'''
+词表文件的编译缓存，避免每次启动tokenizer都重新构建查找表
+词表本身直接从文本解析（比从pickle加载还快），缓存里只放构建起来慢的部分，如word piece查找表里不是token的前缀
+第一次读取词表时在词表旁边写一个{词表名}.{kind}.compiled文件，文件末尾带crc32校验，缓存文件损坏时会重建并覆盖
+词表文件的大小和修改时间没变就直接用缓存，变了再比较词表内容的sha1，内容也变了才重建
+词表所在目录不可写时只是不写缓存
+'''
+
+COMPILED_VOCAB_VERSION = 3
+
+
+def compiled_vocab_path(vocab_file, kind):
+    return '{}.{}.compiled'.format(os.path.splitext(vocab_file)[0], kind)
+
+
+def _decode_lines(data):
+    # 和文本模式的readlines()一样：\r\n和单独的\r都算换行，最后一行可以没有换行符
+    tokens = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    if tokens[-1] == '':
+        tokens.pop()
+    return tokens
+
+
+def read_vocab_tokens(vocab_file):
+    """和tokenization_bert.load_vocab一样解析词表，返回按行排列的token列表（词表有重复行时id不连续，以行号为准）"""
+    with open(vocab_file, 'rb') as f:
+        return _decode_lines(f.read())
+
+
+def _vocab_dicts(tokens):
+    # 重复的token和load_vocab一样取最后一行的id，ids_to_tokens里没有被覆盖掉的id
+    vocab = dict(zip(tokens, range(len(tokens))))
+    return vocab, dict(zip(vocab.values(), vocab.keys()))
+
+
+def read_vocab(vocab_file):
+    """返回(vocab, ids_to_tokens)，和load_vocab以及由它反过来的id到token的字典相同"""
+    return _vocab_dicts(read_vocab_tokens(vocab_file))
+
+
+def _load(path, kind, stat, data):
+    """返回(extra, 是否要用词表新的大小和修改时间重写缓存)，缓存不存在、已经过期或者损坏时返回None，由调用方重建并覆盖"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            content = f.read()
+        payload, checksum = content[:-4], content[-4:]
+        if zlib.crc32(payload).to_bytes(4, 'little') != checksum:
+            raise ValueError('checksum mismatch')
+        compiled = pickle.loads(payload)
+        if compiled['version'] != COMPILED_VOCAB_VERSION or compiled['kind'] != kind:
+            return None
+        if compiled['vocab_size'] == stat.st_size and compiled['vocab_mtime'] == stat.st_mtime_ns:
+            return compiled['extra'], False
+        if compiled['vocab_hash'] != hashlib.sha1(data).hexdigest():
+            return None
+        return compiled['extra'], True
+    except Exception as e:  # 文件损坏时pickle可能抛出各种异常
+        print('warning: compiled vocab {} is broken, rebuilding: {!r}'.format(path, e))
+        return None
+
+
+def _save(path, kind, stat, data, extra):
+    payload = pickle.dumps({
+        'version': COMPILED_VOCAB_VERSION,
+        'kind': kind,
+        'vocab_size': stat.st_size,
+        'vocab_mtime': stat.st_mtime_ns,
+        'vocab_hash': hashlib.sha1(data).hexdigest(),
+        'extra': extra,
+    }, protocol=pickle.HIGHEST_PROTOCOL)
+    # 多个进程可能同时重建，各自写临时文件再原子替换
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(payload + zlib.crc32(payload).to_bytes(4, 'little'))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print('warning: could not write compiled vocab {}: {}'.format(path, e))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_compiled_vocab(vocab_file, kind, build):
+    """返回(vocab, ids_to_tokens, extra)，前两个和read_vocab相同，extra是build(vocab)的返回值，有缓存时从缓存读"""
+    stat = os.stat(vocab_file)
+    with open(vocab_file, 'rb') as f:
+        data = f.read()
+    vocab, ids_to_tokens = _vocab_dicts(_decode_lines(data))
+    path = compiled_vocab_path(vocab_file, kind)
+    loaded = _load(path, kind, stat, data)
+    if loaded is not None:
+        extra, stale = loaded
+        if stale:
+            _save(path, kind, stat, data, extra)
+        return vocab, ids_to_tokens, extra
+    extra = build(vocab)
+    _save(path, kind, stat, data, extra)
+    return vocab, ids_to_tokens, extra
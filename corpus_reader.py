@@ -0,0 +1,128 @@
+import json
+
+'''
+流式读取原始语料，一次只在内存里保留一篇文章
+支持两种格式：
+json: 整个文件是一个json列表，列表的每个元素是一篇文章（即data/train.json的格式）
+jsonl: 每行一个json字符串，每行是一篇文章
+另外iter_line_chunks按行、iter_text_blocks按块流式读取纯文本文件（train_single.py使用的格式）
+'''
+
+FORMATS = ('json', 'jsonl')
+
+
+def guess_format(path):
+    return 'jsonl' if path.endswith('.jsonl') else 'json'
+
+
+def iter_json_array(path, buffer_size=1 << 20):
+    """逐个返回顶层json列表中的元素，不把整个文件读进内存"""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf8') as f:
+        buf = ''
+        pos = 0
+        eof = False
+        started = False
+        expect_value = True
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos >= len(buf):
+                if eof:
+                    raise ValueError('{}: unexpected end of file'.format(path))
+                chunk = f.read(buffer_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            char = buf[pos]
+            if not started:
+                if char != '[':
+                    raise ValueError('{}: expected a top-level json list'.format(path))
+                started = True
+                pos += 1
+            elif char == ']':
+                return
+            elif not expect_value:
+                if char != ',':
+                    raise ValueError('{}: expected "," between list elements'.format(path))
+                expect_value = True
+                pos += 1
+            else:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    value, end = None, None
+                # 元素可能被截断在buffer的末尾，这时继续读，每次读的量随未解析的长度增长以免反复解析同一个长元素
+                if end is None or (end == len(buf) and not eof):
+                    if eof:
+                        raise ValueError('{}: malformed json list element'.format(path))
+                    chunk = f.read(max(buffer_size, len(buf) - pos))
+                    eof = not chunk
+                    buf = buf[pos:] + chunk
+                    pos = 0
+                    continue
+                yield value
+                pos = end
+                expect_value = False
+                if pos > buffer_size:
+                    buf = buf[pos:]
+                    pos = 0
+
+
+def iter_json_lines(path):
+    with open(path, 'r', encoding='utf8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def iter_articles(path, data_format=None):
+    data_format = data_format or guess_format(path)
+    if data_format == 'json':
+        return iter_json_array(path)
+    if data_format == 'jsonl':
+        return iter_json_lines(path)
+    raise ValueError('unknown data format {}, expected one of {}'.format(data_format, FORMATS))
+
+
+def count_articles(path, data_format=None):
+    return sum(1 for _ in iter_articles(path, data_format))
+
+
+def iter_line_chunks(path, chunk_size=1 << 20):
+    """按行读取纯文本文件，每次返回若干整行拼成的约chunk_size字节的文本，以及读到的字节位置。块的边界总在换行处，不会切断词或[SEP]"""
+    with open(path, 'rb') as f:
+        lines = []
+        size = 0
+        position = 0
+        for raw in f:
+            lines.append(raw.decode('utf8').replace('\r\n', '\n'))
+            size += len(raw)
+            position += len(raw)
+            if size >= chunk_size:
+                yield ''.join(lines), position
+                lines = []
+                size = 0
+        if lines:
+            yield ''.join(lines), position
+
+
+def iter_text_blocks(path, block_size=1 << 20):
+    """按块读取纯文本文件，每次返回约block_size个字的文本以及读到的字节位置。不管有没有换行都只读一块
+    和文本模式的readlines()一样，\r\n和单独的\r都换成\n"""
+    with open(path, 'r', encoding='utf8', newline='') as f:
+        position = 0
+        pending = ''
+        while True:
+            raw = f.read(block_size)
+            position += len(raw.encode('utf8'))
+            text = pending + raw
+            pending = ''
+            if raw and text.endswith('\r'):  # \r\n可能正好被块的边界分开
+                text, pending = text[:-1], '\r'
+            if text:
+                yield text.replace('\r\n', '\n').replace('\r', '\n'), position
+            if not raw:
+                return
@@ -0,0 +1,133 @@
+import os
+import json
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from corpus_reader import iter_articles
+from parallel_utils import batched, imap_in_order
+
+'''
+预处理前的文章去重，在tokenize之前完成，去掉的文章不会再花任何预处理和训练的时间
+完全重复: 去掉空白后的全文sha1相同
+近似重复: 字符shingle的MinHash签名，用LSH分桶找候选，再用签名估计的Jaccard相似度确认
+总是保留第一次出现的文章
+去重发生在tokenize之前，所以报告里统计的是去掉的字数，对中文语料基本等于token数
+'''
+
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+NUM_BANDS = 8  # 每个band 8行，相似度约0.77以上的文章对大概率落进同一个桶
+_SHINGLE_BLOCK = 8192
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+_rs = np.random.RandomState(seed=1234)  # 固定种子，保证每个worker进程的哈希函数相同
+_PERM_A = _rs.randint(1, 1 << 62, size=NUM_PERM, dtype=np.int64).astype(np.uint64) | np.uint64(1)
+_PERM_B = _rs.randint(0, 1 << 62, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+_BAND_MIX = _rs.randint(1, 1 << 62, size=NUM_PERM // NUM_BANDS, dtype=np.int64).astype(np.uint64) | np.uint64(1)
+
+
+def normalize(text):
+    return ''.join(text.split())
+
+
+def _shingle_hashes(text):
+    codepoints = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    if len(codepoints) < SHINGLE_SIZE:
+        codepoints = np.concatenate([codepoints, np.zeros(SHINGLE_SIZE - len(codepoints), dtype=np.uint64)])
+    n = len(codepoints) - SHINGLE_SIZE + 1
+    hashes = np.zeros(n, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for j in range(SHINGLE_SIZE):
+            hashes = hashes * np.uint64(1000003) + codepoints[j: j + n]
+        # splitmix64的finalizer，把多项式哈希打散
+        hashes ^= hashes >> np.uint64(30)
+        hashes *= np.uint64(0xBF58476D1CE4E5B9)
+        hashes ^= hashes >> np.uint64(27)
+        hashes *= np.uint64(0x94D049BB133111EB)
+        hashes ^= hashes >> np.uint64(31)
+    return hashes
+
+
+def minhash(text):
+    hashes = _shingle_hashes(text)
+    signature = np.full(NUM_PERM, _MASK64, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for start in range(0, len(hashes), _SHINGLE_BLOCK):
+            block = hashes[start: start + _SHINGLE_BLOCK, None] * _PERM_A + _PERM_B
+            np.minimum(signature, block.min(axis=0), out=signature)
+    return signature
+
+
+def band_keys(signature):
+    with np.errstate(over='ignore'):
+        return (signature.reshape(NUM_BANDS, -1) * _BAND_MIX).sum(axis=1)
+
+
+def fingerprint_articles(articles):
+    """worker里执行: 返回每篇文章的(全文sha1, minhash签名, LSH桶key, 字数)"""
+    results = []
+    for article in articles:
+        text = normalize(article)
+        signature = minhash(text)
+        results.append((hashlib.sha1(text.encode('utf8')).digest(), signature, band_keys(signature), len(article)))
+    return results
+
+
+def find_duplicates(data_path, data_format=None, threshold=0.8, workers=1, batch_size=1000):
+    """返回(每篇文章是否保留的bool数组, 去重报告)"""
+    articles = batched(iter_articles(data_path, data_format), batch_size)
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = imap_in_order(executor, fingerprint_articles, articles, 2 * workers)
+    else:
+        executor = None
+        results = (fingerprint_articles(batch) for batch in articles)
+
+    keep = []
+    seen = set()
+    buckets = [dict() for _ in range(NUM_BANDS)]  # 每个band里桶key对应的所有已保留文章
+    signatures = []  # 已保留文章的签名，按保留顺序排列
+    report = {'articles': 0, 'exact_duplicates': 0, 'near_duplicates': 0, 'removed_chars': 0}
+    try:
+        for batch in tqdm(results):
+            for digest, signature, keys, length in batch:
+                report['articles'] += 1
+                duplicate = None
+                if digest in seen:
+                    duplicate = 'exact_duplicates'
+                else:
+                    seen.add(digest)
+                    candidates = set()
+                    for band, key in enumerate(keys.tolist()):
+                        candidates.update(buckets[band].get(key, ()))
+                    if candidates:
+                        similarity = np.mean(np.stack([signatures[c] for c in candidates]) == signature, axis=1)
+                        if similarity.max() >= threshold:
+                            duplicate = 'near_duplicates'
+                if duplicate is not None:
+                    report[duplicate] += 1
+                    report['removed_chars'] += length
+                    keep.append(False)
+                    continue
+                for band, key in enumerate(keys.tolist()):
+                    buckets[band].setdefault(key, []).append(len(signatures))
+                signatures.append(signature)
+                keep.append(True)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    report['kept_articles'] = len(signatures)
+    return np.array(keep, dtype=bool), report
+
+
+def write_report(path, report):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('dedup: {} of {} articles removed ({} exact, {} near duplicates, {} characters)'.format(
+        report['exact_duplicates'] + report['near_duplicates'], report['articles'], report['exact_duplicates'],
+        report['near_duplicates'], report['removed_chars']))
+
+
+def dedup_report_path(tokenized_data_path):
+    return os.path.join(tokenized_data_path, 'dedup_report.json')
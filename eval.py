@@ -1,40 +1,15 @@
 import pytorch_transformers
 import torch
 import os
-import json
 import random
 import numpy as np
 import argparse
 from torch.utils.tensorboard import SummaryWriter
 from datetime import datetime
-from tqdm import tqdm
 from torch.nn import DataParallel
-
-
-def build_files(data_path, tokenized_data_path, num_pieces, full_tokenizer, min_length):
-    if not os.path.exists(tokenized_data_path):
-        os.mkdir(tokenized_data_path)
-    with open(data_path, 'r', encoding='utf8') as f:
-        print('reading lines')
-        lines = json.load(f)
-        lines = [line.replace('\n', ' [SEP] ') for line in lines]  # 用[SEP]表示换行, 段落之间使用SEP表示段落结束
-        all_len = len(lines)
-    for i in tqdm(range(num_pieces)):
-        sublines = lines[all_len // num_pieces * i: all_len // num_pieces * (i + 1)]
-        if i == num_pieces - 1:
-            sublines.extend(lines[all_len // num_pieces * (i + 1):])  # 把尾部例子添加到最后一个piece
-        sublines = [full_tokenizer.tokenize(line) for line in sublines if
-                    len(line) > min_length]  # 只考虑长度超过min_length的句子
-        sublines = [full_tokenizer.convert_tokens_to_ids(line) for line in sublines]
-        full_line = []
-        for subline in sublines:
-            full_line.append(full_tokenizer.convert_tokens_to_ids('[MASK]'))  # 文章开头添加MASK表示文章开始
-            full_line.extend(subline)
-            full_line.append(full_tokenizer.convert_tokens_to_ids('[CLS]'))  # 文章之间添加CLS表示文章结束
-        with open(tokenized_data_path + 'tokenized_train_{}.txt'.format(i), 'w') as f:
-            for id in full_line:
-                f.write(str(id) + ' ')
-    print('finish')
+from corpus_reader import FORMATS
+from tokenized_files import check_manifest, file_fingerprint, load_manifest, load_tokenized_file, tokenized_file_path
+from train import build_files
 
 
 def main():
@@ -46,6 +21,8 @@ def main():
     parser.add_argument('--raw_data_path', default='data/eval.json', type=str, required=False, help='原始语料')
     parser.add_argument('--tokenized_data_path', default='data/tokenized_eval/', type=str, required=False,
                         help='tokenized语料存放位置')
+    parser.add_argument('--raw_data_format', default=None, choices=FORMATS, required=False,
+                        help='原始语料格式，json为一个文章列表，jsonl为每行一篇文章，默认按文件后缀判断')
     parser.add_argument('--raw', action='store_true', help='是否先做tokenize')
     parser.add_argument('--batch_size', default=8, type=int, required=False, help='batch size')
     parser.add_argument('--log_step', default=1, type=int, required=False, help='多少步汇报一次')
@@ -54,6 +31,13 @@ def main():
     parser.add_argument('--min_length', default=128, type=int, required=False, help='最短收录文章长度')
     parser.add_argument('--pretrained_model', default='', type=str, required=False, help='模型起点路径')
     parser.add_argument('--no_wordpiece', action='store_true', help='不做word piece切词')
+    parser.add_argument('--workers', default=1, type=int, required=False, help='预处理语料时使用的进程数')
+    parser.add_argument('--wordpiece_cache_size', default=0, type=int, required=False,
+                        help='预处理时用LRU缓存多少个词的word piece切分结果，0为不缓存')
+    parser.add_argument('--fast_char_mode', action='store_true',
+                        help='预处理时汉字、数字和标点按字直接查表转成id，结果与不加时完全相同')
+    parser.add_argument('--tokenize_cache_dir', default='', type=str, required=False,
+                        help='tokenize缓存目录，设置后重新预处理时只tokenize新增或改动的文章')
     parser.add_argument('--output_dir', default='eval_result/', type=str, required=False, help='结果输出路径')
 
     args = parser.parse_args()
@@ -70,7 +54,9 @@ def main():
     print('config:\n' + model_config.to_json_string())
 
     n_ctx = model_config.n_ctx
-    full_tokenizer = tokenization_bert.BertTokenizer(vocab_file=args.tokenizer_path)
+    full_tokenizer = tokenization_bert.BertTokenizer(vocab_file=args.tokenizer_path,
+                                                     wordpiece_cache_size=args.wordpiece_cache_size,
+                                                     fast_char_mode=args.fast_char_mode)
     full_tokenizer.max_len = n_ctx
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
     print('using device:', device)
@@ -91,7 +77,10 @@ def main():
     if raw:
         print('building files')
         build_files(data_path=raw_data_path, tokenized_data_path=tokenized_data_path, num_pieces=num_pieces,
-                    full_tokenizer=full_tokenizer, min_length=min_length)
+                    full_tokenizer=full_tokenizer, min_length=min_length, workers=args.workers,
+                    tokenizer_path=args.tokenizer_path, no_wordpiece=args.no_wordpiece,
+                    data_format=args.raw_data_format, cache_dir=args.tokenize_cache_dir,
+                    wordpiece_cache_size=args.wordpiece_cache_size, fast_char_mode=args.fast_char_mode)
         print('files built')
 
     if not args.pretrained_model:
@@ -109,11 +98,10 @@ def main():
     print('number of parameters: {}'.format(num_parameters))
 
     multi_gpu = False
-    full_len = 0
     print('calculating total steps')
-    for i in tqdm(range(num_pieces)):
-        with open(tokenized_data_path + 'tokenized_train_{}.txt'.format(i), 'r') as f:
-            full_len += len([int(item) for item in f.read().strip().split()])
+    manifest = load_manifest(tokenized_data_path, num_pieces)
+    full_len = check_manifest(manifest, num_pieces, n_ctx, stride, vocab_size=model_config.vocab_size,
+                              vocab_fingerprint=file_fingerprint(args.tokenizer_path))
 
     if torch.cuda.device_count() > 1:
         print("Let's use", torch.cuda.device_count(), "GPUs!")
@@ -129,18 +117,12 @@ def main():
     print('time: {}'.format(now))
     piece_num = 0
     for i in range(num_pieces):
-        with open(tokenized_data_path + 'tokenized_train_{}.txt'.format(i), 'r') as f:
-            line = f.read().strip()
-        tokens = line.split()
-        tokens = [int(token) for token in tokens]
+        tokens = load_tokenized_file(tokenized_file_path(tokenized_data_path, i))
         start_point = 0
         samples = []
         while start_point < len(tokens) - n_ctx:
             samples.append(tokens[start_point: start_point + n_ctx])
             start_point += stride
-        start_point -= stride
-        last = tokens[start_point + n_ctx:]
-        last.extend([full_tokenizer.convert_tokens_to_ids(['[PAD]']) * (n_ctx - len(last))])
         random.shuffle(samples)
         for step in range(len(samples) // batch_size):  # drop last
 
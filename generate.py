@@ -8,13 +8,6 @@ from tqdm import trange
 from pytorch_transformers import GPT2LMHeadModel
 
 
-def is_word(word):
-    for item in list(word):
-        if item not in 'qwertyuiopasdfghjklzxcvbnm':
-            return False
-    return True
-
-
 def _is_chinese_char(char):
     """Checks whether CP is the codepoint of a CJK character."""
     # This defines a "chinese character" as anything in the CJK Unicode block:
@@ -138,7 +131,7 @@ def main():
 
     while True:
         raw_text = args.prefix
-        context_tokens = tokenizer.convert_tokens_to_ids(tokenizer.tokenize(raw_text))
+        context_tokens, _ = tokenizer.encode_batch([raw_text])
         generated = 0
         for _ in range(nsamples // batch_size):
             out = sample_sequence(
@@ -150,19 +143,8 @@ def main():
 
             for i in range(batch_size):
                 generated += 1
-                text = tokenizer.convert_ids_to_tokens(out[0])
-
-                for i, item in enumerate(text[:-1]):  # 确保英文前后有空格
-                    if is_word(item) and is_word(text[i + 1]):
-                        text[i] = item + ' '
-
-                for i, item in enumerate(text):
-                    if item == '[MASK]':
-                        text[i] = ''
-                    if item == '[CLS]' or item == '[SEP]':
-                        text[i] = '\n'
                 print("=" * 40 + " SAMPLE " + str(generated) + " " + "=" * 40)
-                text = ''.join(text).replace('##', '').strip()
+                text = tokenizer.decode(out[0])
                 print(text)
         print("=" * 80)
 
@@ -2,6 +2,7 @@ import torch
 import torch.nn.functional as F
 import pytorch_transformers
 import os
+import numpy as np
 import tokenization_bert
 import argparse
 from tqdm import trange
@@ -10,13 +11,6 @@ from pytorch_transformers import GPT2LMHeadModel
 os.environ["CUDA_VISIBLE_DEVICES"] = "0,1,2,3"  # 此处设置程序使用哪些显卡
 
 
-def is_word(word):
-    for item in list(word):
-        if item not in 'qwertyuiopasdfghjklzxcvbnm':
-            return False
-    return True
-
-
 def _is_chinese_char(char):
     """Checks whether CP is the codepoint of a CJK character."""
     # This defines a "chinese character" as anything in the CJK Unicode block:
@@ -147,10 +141,10 @@ def main():
     elif length > model.config.n_ctx:
         raise ValueError("Can't get samples longer than window size: %s" % model.config.n_ctx)
 
-    for i, title in enumerate(titles):
+    title_ids, title_offsets = tokenizer.encode_batch(titles)
+    for i, context_tokens in enumerate(np.split(title_ids, title_offsets[1:-1])):
         for j in range(articles_per_title):
             with open(save_path + str(i * j), 'w') as f:
-                context_tokens = tokenizer.convert_tokens_to_ids(tokenizer.tokenize(title))
                 generated = 0
                 out = sample_sequence(
                     model=model, length=length,
@@ -160,20 +154,8 @@ def main():
                 out = out.tolist()
 
                 generated += 1
-                text = tokenizer.convert_ids_to_tokens(out[0])
-
-                for i, item in enumerate(text[:-1]):  # 确保英文前后有空格
-                    if is_word(item) and is_word(text[i + 1]):
-                        text[i] = item + ' '
-
-                for i, item in enumerate(text):
-                    if item == '[MASK]':
-                        text[i] = ''
-                    if item == '[CLS]' or item == '[SEP]':
-                        text[i] = '\n'
-
                 print("=" * 40 + " SAMPLE " + str(generated) + " " + "=" * 40)
-                text = ''.join(text).replace('##', '').strip()
+                text = tokenizer.decode(out[0])
                 # text = ''.join(text.split('\n')[:-1])
                 print(text)
                 f.write(text)
@@ -0,0 +1,47 @@
+import collections
+import itertools
+
+'''
+预处理脚本共用的多进程小工具
+'''
+
+_worker_tokenizer = None
+
+
+def init_tokenizer_worker(tokenizer_path, no_wordpiece, wordpiece_cache_size=0, fast_char_mode=False):
+    """每个worker进程只从词表文件构建一次tokenizer"""
+    global _worker_tokenizer
+    if no_wordpiece:
+        import tokenization_bert_without_wordpiece as tokenization_bert
+    else:
+        import tokenization_bert
+    _worker_tokenizer = tokenization_bert.BertTokenizer(vocab_file=tokenizer_path, wordpiece_cache_size=wordpiece_cache_size,
+                                                        fast_char_mode=fast_char_mode)
+
+
+def tokenize_texts(texts, full_tokenizer=None):
+    """返回encode_batch的(ids, offsets)，不传full_tokenizer时使用init_tokenizer_worker在worker进程里建好的tokenizer"""
+    if full_tokenizer is None:
+        full_tokenizer = _worker_tokenizer
+    return full_tokenizer.encode_batch(texts)
+
+
+def imap_in_order(executor, fn, iterable, max_pending, *args):
+    """和executor.map一样按顺序返回结果，但最多只提前提交max_pending个任务，避免一次性把输入全部读进内存"""
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item, *args))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def batched(iterable, batch_size):
+    """把iterable切成长度为batch_size的list，最后一个可能不足batch_size"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
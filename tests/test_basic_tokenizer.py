@@ -0,0 +1,144 @@
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tokenization_bert
+import tokenization_bert_without_wordpiece
+import tokenization_common
+
+'''
+检查BasicTokenizer.tokenize（查表 + str.translate的实现）和原来逐字处理的实现切出的token完全一样
+原来的实现由BasicTokenizer里保留的_clean_text、_tokenize_chinese_chars、_run_strip_accents、_run_split_on_punc拼出来
+预先算好的BMP字符类别表要和逐字判断的结果一样
+运行：python -m pytest tests/
+'''
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache')
+MODULES = [tokenization_bert, tokenization_bert_without_wordpiece]
+SPECIAL_TOKENS = ['[UNK]', '[SEP]', '[PAD]', '[CLS]', '[MASK]']
+
+# 随机文本用到的字符：ASCII、带重音的拉丁字母、组合附加符号、大小写转换后长度会变的字母、汉字和全角标点、
+# 其他文字的数字、控制字符和各种空白、BMP以外的字（数学字母、emoji、扩展B区汉字）
+CHAR_POOLS = [
+    [chr(cp) for cp in range(0x20, 0x7f)],
+    [chr(cp) for cp in range(0xc0, 0x250)],
+    [chr(cp) for cp in range(0x300, 0x370)],
+    ['İ', 'ß', 'ŉ', 'ǰ', 'ΐ', 'ﬁ', 'Ⅻ', 'Ω', 'K', 'Å'],
+    [chr(cp) for cp in range(0x4e00, 0x4f00)] + ['，', '。', '！', '？', '“', '”', '《', '》', '、', '…'],
+    ['٣', '४', '๓', '１', '²', '½', '①'],
+    ['\x00', '�', '\t', '\n', '\r', '\x7f', '\x0b', '​', '　', '\xa0', ' '],
+    ['\U0001d7d8', '\U0001f600', '\U00020000', '\U0002a700', '\U000e0001'],
+]
+
+
+def reference_tokenize(basic_tokenizer, text, never_split=None):
+    """原来逐字处理的BasicTokenizer.tokenize"""
+    module = sys.modules[type(basic_tokenizer).__module__]
+    never_split = basic_tokenizer.never_split + (never_split if never_split is not None else [])
+    text = basic_tokenizer._clean_text(text)
+    if basic_tokenizer.tokenize_chinese_chars:
+        text = basic_tokenizer._tokenize_chinese_chars(text)
+    orig_tokens = module.whitespace_tokenize(text)
+    split_tokens = []
+    for token in orig_tokens:
+        if basic_tokenizer.do_lower_case and token not in never_split:
+            token = token.lower()
+            token = basic_tokenizer._run_strip_accents(token)
+        split_tokens.extend(basic_tokenizer._run_split_on_punc(token))
+    return module.whitespace_tokenize(" ".join(split_tokens))
+
+
+def random_text(rng, length):
+    pieces = []
+    while len(pieces) < length:
+        if rng.random() < 0.05:
+            pieces.append(rng.choice([' ', ' ']) + rng.choice(SPECIAL_TOKENS) + ' ')
+        elif rng.random() < 0.2:
+            pieces.append(' ')
+        else:
+            pieces.append(rng.choice(rng.choice(CHAR_POOLS)))
+    return ''.join(pieces)
+
+
+def bundled_vocabs():
+    """[(词表路径, 对应的tokenization模块), ...]，名字里有no_word_piece的词表用不带wordpiece的模块"""
+    vocabs = []
+    for name in sorted(os.listdir(CACHE_DIR)):
+        if name.startswith('vocab') and name.endswith('.txt'):
+            module = tokenization_bert_without_wordpiece if 'no_word_piece' in name else tokenization_bert
+            vocabs.append((os.path.join(CACHE_DIR, name), module))
+    return vocabs
+
+
+class BasicTokenizerEquivalenceTest(unittest.TestCase):
+
+    def test_bmp_flags(self):
+        for cp in range(0x10000):
+            self.assertEqual(tokenization_common._BMP_FLAGS[cp], tokenization_common._classify(cp), msg=hex(cp))
+
+    def assert_same_tokens(self, basic_tokenizer, text, never_split=None):
+        self.assertEqual(basic_tokenizer.tokenize(text, never_split=never_split),
+                         reference_tokenize(basic_tokenizer, text, never_split=never_split),
+                         msg=repr(text))
+
+    def test_every_bmp_char(self):
+        # 每个BMP字符单独出现，以及夹在字母中间出现
+        text = ' '.join(chr(cp) for cp in range(0x10000) if not 0xd800 <= cp < 0xe000)
+        glued = 'a'.join(chr(cp) for cp in range(0x10000) if not 0xd800 <= cp < 0xe000)
+        for module in MODULES:
+            for do_lower_case in (True, False):
+                for tokenize_chinese_chars in (True, False):
+                    basic_tokenizer = module.BasicTokenizer(do_lower_case=do_lower_case,
+                                                            tokenize_chinese_chars=tokenize_chinese_chars)
+                    self.assert_same_tokens(basic_tokenizer, text)
+                    self.assert_same_tokens(basic_tokenizer, glued)
+
+    def test_random_text(self):
+        rng = random.Random(0)
+        texts = [random_text(rng, rng.randint(0, 200)) for _ in range(500)]
+        for module in MODULES:
+            for do_lower_case in (True, False):
+                for tokenize_chinese_chars in (True, False):
+                    for never_split in (None, SPECIAL_TOKENS):
+                        basic_tokenizer = module.BasicTokenizer(do_lower_case=do_lower_case,
+                                                                never_split=['[UNK]'],
+                                                                tokenize_chinese_chars=tokenize_chinese_chars)
+                        for text in texts:
+                            self.assert_same_tokens(basic_tokenizer, text, never_split=never_split)
+
+    def test_lower_splits(self):
+        # 先切标点再转小写结果不一样的文本：大写Σ、小写后分解出标点的字符、小写后会变的never_split
+        texts = ['ΣΑΣ', 'ΟΔΟΣ.', 'a.Σb', 'a\u1fefb', 'x≠y', '≮≯', 'A[UNK]B', 'A [UNK] B', 'x [Unk]', 'ΣΑΣ [UNK]\U0001d400']
+        for module in MODULES:
+            for tokenize_chinese_chars in (True, False):
+                basic_tokenizer = module.BasicTokenizer(never_split=['[UNK]', '[Unk]'],
+                                                        tokenize_chinese_chars=tokenize_chinese_chars)
+                for text in texts:
+                    self.assert_same_tokens(basic_tokenizer, text)
+                    self.assert_same_tokens(basic_tokenizer, text, never_split=SPECIAL_TOKENS)
+
+    def test_bundled_vocabs(self):
+        # 用每个词表自己的内容当作文本，同时检查完整的BertTokenizer得到的token和id不变
+        rng = random.Random(1)
+        for vocab_path, module in bundled_vocabs():
+            with open(vocab_path, encoding='utf8') as f:
+                lines = f.read().split('\n')
+            rng.shuffle(lines)
+            texts = [''.join(rng.choice(['', ' ', '\n']) + line for line in lines[i:i + 64])
+                     for i in range(0, len(lines), 64)]
+            tokenizer = module.BertTokenizer(vocab_file=vocab_path)
+            reference = module.BertTokenizer(vocab_file=vocab_path)
+            reference.basic_tokenizer.tokenize = lambda text, never_split=None: \
+                reference_tokenize(reference.basic_tokenizer, text, never_split=never_split)
+            for text in texts:
+                tokens = tokenizer.tokenize(text)
+                expected = reference.tokenize(text)
+                self.assertEqual(tokens, expected, msg='{}: {!r}'.format(vocab_path, text))
+                self.assertEqual(tokenizer.convert_tokens_to_ids(tokens), reference.convert_tokens_to_ids(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
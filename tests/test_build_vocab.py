@@ -0,0 +1,113 @@
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import build_vocab
+import tokenization_bert_without_wordpiece
+from compiled_vocab import read_vocab_tokens
+from tokenized_files import TokenizedFileWriter, dtype_for_vocab_size, file_fingerprint, load_manifest, piece_info, \
+    read_tokenized_file, tokenized_file_path, write_manifest
+from test_basic_tokenizer import bundled_vocabs, random_text
+from test_encode_batch import vocab_texts
+
+'''
+对每个自带的词表跑一遍build_vocab.py：统计语料、挑出新词表，再把用原词表tokenize好的语料换成新词表的id
+换出来的id要和直接用新词表tokenize的结果完全一样；词表里有重复行（id不连续）时也不能出错
+运行：python -m pytest tests/
+'''
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config')
+
+
+class BuildVocabTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def tokenize_corpus(self, tokenizer, raw_data_path, vocab_path, output_path, num_pieces=2):
+        """和预处理一样把每篇文章tokenize后分成几个piece写入output_path，返回每个piece的id"""
+        articles = list(build_vocab.iter_corpus(raw_data_path, 'json', tokenizer))
+        ids, offsets = tokenizer.encode_batch(articles)
+        os.makedirs(output_path)
+        dtype = dtype_for_vocab_size(len(tokenizer.vocab))
+        pieces = []
+        expected = []
+        step = len(articles) // num_pieces + 1
+        for i in range(num_pieces):
+            piece_ids = ids[offsets[min(i * step, len(articles))]:offsets[min((i + 1) * step, len(articles))]]
+            with TokenizedFileWriter(tokenized_file_path(output_path, i), dtype) as writer:
+                writer.write(piece_ids)
+            pieces.append(piece_info(len(piece_ids)))
+            expected.append(piece_ids.tolist())
+        write_manifest(output_path, pieces, dtype, vocab_size=len(tokenizer.vocab),
+                       vocab_fingerprint=file_fingerprint(vocab_path))
+        return expected
+
+    def test_bundled_vocabs(self):
+        rng = random.Random(0)
+        for vocab_path, module in bundled_vocabs():
+            msg = vocab_path
+            work_dir = os.path.join(self.tmp_dir, os.path.basename(vocab_path))
+            os.makedirs(work_dir)
+            raw_data_path = os.path.join(work_dir, 'train.json')
+            texts = vocab_texts(rng, vocab_path, 50) + [random_text(rng, rng.randint(0, 200)) for _ in range(50)]
+            with open(raw_data_path, 'w', encoding='utf8') as f:
+                json.dump(texts, f, ensure_ascii=False)
+            tokenizer = module.BertTokenizer(vocab_file=vocab_path)
+            tokenized_data_path = os.path.join(work_dir, 'tokenized')
+            self.tokenize_corpus(tokenizer, raw_data_path, vocab_path, tokenized_data_path)
+
+            output_vocab = os.path.join(work_dir, 'vocab_corpus.txt')
+            output_tokenized_data_path = os.path.join(work_dir, 'tokenized_corpus')
+            argv = ['build_vocab.py', '--raw_data_path', raw_data_path, '--tokenizer_path', vocab_path,
+                    '--output_vocab', output_vocab,
+                    '--model_config', os.path.join(CONFIG_DIR, 'model_config_small.json'),
+                    '--output_config', os.path.join(work_dir, 'model_config_corpus.json'),
+                    '--tokenized_data_path', tokenized_data_path,
+                    '--output_tokenized_data_path', output_tokenized_data_path]
+            if module is tokenization_bert_without_wordpiece:
+                argv.append('--no_wordpiece')
+            with mock.patch.object(sys, 'argv', argv):
+                build_vocab.main()
+
+            new_tokenizer = module.BertTokenizer(vocab_file=output_vocab)
+            expected = self.tokenize_corpus(new_tokenizer, raw_data_path, output_vocab,
+                                           os.path.join(work_dir, 'expected'))
+            manifest = load_manifest(output_tokenized_data_path)
+            self.assertEqual(manifest['vocab_size'], len(new_tokenizer.vocab), msg=msg)
+            self.assertEqual(manifest['vocab_fingerprint'], file_fingerprint(output_vocab), msg=msg)
+            for i, piece_ids in enumerate(expected):
+                remapped = read_tokenized_file(tokenized_file_path(output_tokenized_data_path, i)).tolist()
+                self.assertEqual(remapped, piece_ids, msg='{} piece {}'.format(msg, i))
+
+    def test_duplicate_lines(self):
+        # 重复行之后的id比token数大，重复的token以最后一行为准，前面那一行的id不会出现
+        vocab_path = os.path.join(self.tmp_dir, 'vocab.txt')
+        with open(vocab_path, 'w', encoding='utf8') as f:
+            f.write('\n'.join(['[PAD]', '[UNK]', '中', '', '', '[CLS]', '文', '中', '[SEP]', '[MASK]']) + '\n')
+        tokens = read_vocab_tokens(vocab_path)
+        tokenizer = tokenization_bert_without_wordpiece.BertTokenizer(vocab_file=vocab_path)
+        raw_data_path = os.path.join(self.tmp_dir, 'train.json')
+        with open(raw_data_path, 'w', encoding='utf8') as f:
+            json.dump(['中文中\n字', '[CLS]中'], f, ensure_ascii=False)
+        token_counts, _ = build_vocab.count_corpus(raw_data_path, tokenizer, data_format='json')
+        self.assertEqual(len(token_counts), len(tokens))
+        self.assertEqual(token_counts.tolist(), [0, 1, 0, 0, 0, 1, 1, 3, 1, 0])
+        kept_ids, _, coverage = build_vocab.select_tokens(tokens, token_counts, tokenizer.all_special_tokens,
+                                                          tokenizer.unk_token)
+        self.assertEqual(kept_ids, [0, 1, 5, 6, 7, 8, 9])
+        self.assertEqual(coverage, 0.8)
+
+
+if __name__ == '__main__':
+    unittest.main()
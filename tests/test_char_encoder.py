@@ -0,0 +1,92 @@
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tokenization_bert
+import tokenization_bert_without_wordpiece
+from test_basic_tokenizer import CHAR_POOLS, bundled_vocabs, random_text
+from test_encode_batch import vocab_texts
+
+'''
+检查fast_char_mode（CharEncoder按码位查表）得到的id和不加fast_char_mode时完全一样，带word piece和不带word piece的tokenizer都检查
+运行：python -m pytest tests/
+'''
+
+
+class CharEncoderTest(unittest.TestCase):
+
+    def assert_same_ids(self, tokenizer, fast_tokenizer, texts, msg):
+        ids, offsets = tokenizer.encode_batch(texts)
+        fast_ids, fast_offsets = fast_tokenizer.encode_batch(texts)
+        for i, text in enumerate(texts):
+            self.assertEqual(fast_ids[fast_offsets[i]:fast_offsets[i + 1]].tolist(),
+                             ids[offsets[i]:offsets[i + 1]].tolist(), msg='{}: {!r}'.format(msg, text))
+
+    def test_bundled_vocabs(self):
+        rng = random.Random(0)
+        for vocab_path, module in bundled_vocabs():
+            texts = vocab_texts(rng, vocab_path, 100) + [random_text(rng, rng.randint(0, 200)) for _ in range(300)]
+            for kwargs in ({}, {'do_lower_case': False}, {'tokenize_chinese_chars': False}):
+                tokenizer = module.BertTokenizer(vocab_file=vocab_path, **kwargs)
+                fast_tokenizer = module.BertTokenizer(vocab_file=vocab_path, fast_char_mode=True, **kwargs)
+                self.assertIsNotNone(fast_tokenizer.char_encoder)
+                self.assert_same_ids(tokenizer, fast_tokenizer, texts, msg='{} {}'.format(vocab_path, kwargs))
+
+    def test_every_bmp_char(self):
+        # 每个BMP字符单独出现，以及夹在字母和汉字中间出现
+        chars = [chr(cp) for cp in range(0x10000) if not 0xd800 <= cp < 0xe000]
+        texts = [' '.join(chars[i:i + 500]) for i in range(0, len(chars), 500)]
+        texts += ['a'.join(chars[i:i + 500]) for i in range(0, len(chars), 500)]
+        texts += ['中'.join(chars[i:i + 500]) for i in range(0, len(chars), 500)]
+        texts += [''.join(pool) for pool in CHAR_POOLS]
+        for vocab_path, module in bundled_vocabs():
+            if 'small' not in vocab_path:
+                continue
+            for do_lower_case in (True, False):
+                tokenizer = module.BertTokenizer(vocab_file=vocab_path, do_lower_case=do_lower_case)
+                fast_tokenizer = module.BertTokenizer(vocab_file=vocab_path, do_lower_case=do_lower_case,
+                                                      fast_char_mode=True)
+                self.assert_same_ids(tokenizer, fast_tokenizer, texts, msg=vocab_path)
+
+    def test_added_tokens(self):
+        rng = random.Random(1)
+        for vocab_path, module in bundled_vocabs():
+            tokenizer = module.BertTokenizer(vocab_file=vocab_path)
+            fast_tokenizer = module.BertTokenizer(vocab_file=vocab_path, fast_char_mode=True)
+            for t in (tokenizer, fast_tokenizer):
+                t.add_tokens(['<新词>', 'xyz'])
+            texts = [random_text(rng, 100) for _ in range(20)] + ['a<新词>b xyz', '<新词><新词>中', 'xyzxyz[SEP]']
+            self.assert_same_ids(tokenizer, fast_tokenizer, texts, msg=vocab_path)
+
+    def test_final_sigma(self):
+        # 大写Σ转小写时是ς还是σ要看它后面（跳过标点）有没有字母，不能只看查表切开的一段
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            vocab_path = os.path.join(tmp_dir, 'vocab.txt')
+            with open(vocab_path, 'w', encoding='utf8') as f:
+                f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'ας', 'ασ', 'α', '##ς', '##σ',
+                                   '.', '中']) + '\n')
+            texts = ['ΑΣ.Α', 'ΑΣ.', 'ΑΣ. Α', 'ΑΣ中Α', 'ΑΣ\'Α', 'Α.Σ.Α']
+            for module in (tokenization_bert, tokenization_bert_without_wordpiece):
+                tokenizer = module.BertTokenizer(vocab_file=vocab_path)
+                fast_tokenizer = module.BertTokenizer(vocab_file=vocab_path, fast_char_mode=True)
+                self.assert_same_ids(tokenizer, fast_tokenizer, texts, msg=module.__name__)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_needs_basic_tokenize(self):
+        vocab_path = bundled_vocabs()[0][0]
+        for module in (tokenization_bert, tokenization_bert_without_wordpiece):
+            with self.assertRaises(ValueError):
+                module.BertTokenizer(vocab_file=vocab_path, fast_char_mode=True, do_basic_tokenize=False)
+            with self.assertRaises(ValueError):
+                module.BertTokenizer(vocab_file=vocab_path, fast_char_mode=True, never_split=['[X]'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import corpus_reader
+
+'''
+检查iter_text_blocks读出的文本和原来train_single.py用readlines()读出的完全一样：\r\n、单独的\r和\n都是换行
+块的边界正好落在\r\n中间时也一样
+运行：python -m pytest tests/
+'''
+
+
+class IterTextBlocksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'train.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_newlines(self):
+        rng = random.Random(0)
+        texts = ['', '\r', '\r\r\n', 'a\rb\r\nc\nd\r', '\n\r',
+                 ''.join(rng.choice(['中', '文', 'a', ' ', '\r', '\n', '\r\n']) for _ in range(3000))]
+        for text in texts:
+            with open(self.path, 'w', encoding='utf8', newline='') as f:
+                f.write(text)
+            with open(self.path, 'r', encoding='utf8') as f:
+                expected = ''.join(f.readlines())
+            for block_size in (1, 2, 3, 100, 1 << 20):
+                blocks = list(corpus_reader.iter_text_blocks(self.path, block_size))
+                self.assertEqual(''.join(block for block, _ in blocks), expected, msg=(text[:20], block_size))
+                if blocks:
+                    self.assertEqual(blocks[-1][1], os.path.getsize(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import sys
+import random
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from test_basic_tokenizer import bundled_vocabs
+
+'''
+检查decode和decode_batch与generate.py原来逐个token拼接的结果完全一样
+原来的做法最后对整段文本replace('##', '')，会连文本里本来就有的##一起去掉，decode只去掉word piece开头的##，这一处不同单独检查
+运行：python -m pytest tests/
+'''
+
+
+def is_word(word):
+    for item in list(word):
+        if item not in 'qwertyuiopasdfghjklzxcvbnm':
+            return False
+    return True
+
+
+def reference_decode(tokenizer, ids):
+    """generate.py原来把id转成文本的做法"""
+    text = tokenizer.convert_ids_to_tokens(ids)
+
+    for i, item in enumerate(text[:-1]):  # 确保英文前后有空格
+        if is_word(item) and is_word(text[i + 1]):
+            text[i] = item + ' '
+
+    for i, item in enumerate(text):
+        if item == '[MASK]':
+            text[i] = ''
+        if item == '[CLS]' or item == '[SEP]':
+            text[i] = '\n'
+    return ''.join(text).replace('##', '').strip()
+
+
+def random_ids(rng, tokenizer, count):
+    """随机id序列：普通token、英文词、特殊token、新加的token和超出词表范围的id，不含带#的token"""
+    size = len(tokenizer.vocab) + len(tokenizer.added_tokens_decoder)
+    candidates = []
+    for index in range(size):
+        token = tokenizer.convert_ids_to_tokens(index)
+        if '#' not in (token[2:] if token.startswith('##') and len(token) > 2 else token):
+            candidates.append(index)
+    words = [index for index in candidates if is_word(tokenizer.convert_ids_to_tokens(index))]
+    specials = tokenizer.convert_tokens_to_ids(['[MASK]', '[CLS]', '[SEP]', '[UNK]', '[PAD]'])
+    sequences = []
+    for _ in range(count):
+        ids = []
+        for _ in range(rng.randint(0, 60)):
+            r = rng.random()
+            if r < 0.3:
+                ids.append(rng.choice(words))
+            elif r < 0.4:
+                ids.append(rng.choice(specials))
+            elif r < 0.42:
+                ids.append(rng.choice([-1, size, size + 100]))
+            else:
+                ids.append(rng.choice(candidates))
+        sequences.append(ids)
+    return sequences
+
+
+class DecodeTest(unittest.TestCase):
+
+    def test_bundled_vocabs(self):
+        rng = random.Random(0)
+        for vocab_path, module in bundled_vocabs():
+            tokenizer = module.BertTokenizer(vocab_file=vocab_path)
+            for added in ([], ['<新词>', 'xyz']):
+                tokenizer.add_tokens(added)
+                sequences = random_ids(rng, tokenizer, 300)
+                for ids in sequences:
+                    expected = reference_decode(tokenizer, ids)
+                    self.assertEqual(tokenizer.decode(ids), expected, msg='{}: {}'.format(vocab_path, ids))
+                    self.assertEqual(tokenizer.decode(np.array(ids, dtype=np.int64)), expected)
+                self.assertEqual(tokenizer.decode_batch(sequences),
+                                 [reference_decode(tokenizer, ids) for ids in sequences])
+
+    def test_literal_hashes_are_kept(self):
+        checked = 0
+        for vocab_path, module in bundled_vocabs():
+            tokenizer = module.BertTokenizer(vocab_file=vocab_path)
+            if not {'#', 'a', 'b'} <= set(tokenizer.vocab):
+                continue
+            checked += 1
+            ids = tokenizer.convert_tokens_to_ids(['a', '#', '#', 'b'])
+            self.assertEqual(tokenizer.decode(ids), 'a##b')
+            if '##b' in tokenizer.vocab:
+                self.assertEqual(tokenizer.decode(tokenizer.convert_tokens_to_ids(['a', '##b'])), 'ab')
+        self.assertGreater(checked, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dedup
+
+'''
+检查dedup.find_duplicates：完全重复和近似重复的文章去掉，不同的文章保留
+同一个桶里的所有已保留文章都要比较，签名要整个比较
+运行：python -m pytest tests/
+'''
+
+
+def random_article(rng, length=400):
+    return ''.join(chr(rng.randint(0x4e00, 0x4fff)) for _ in range(length))
+
+
+def edit(rng, text, changes=3):
+    chars = list(text)
+    for _ in range(changes):
+        chars[rng.randrange(len(chars))] = chr(rng.randint(0x4e00, 0x4fff))
+    return ''.join(chars)
+
+
+class FindDuplicatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'train.json')
+        self._band_keys = dedup.band_keys
+        self._minhash = dedup.minhash
+
+    def tearDown(self):
+        dedup.band_keys = self._band_keys
+        dedup.minhash = self._minhash
+        shutil.rmtree(self.tmp_dir)
+
+    def find_duplicates(self, articles, workers=1):
+        with open(self.path, 'w', encoding='utf8') as f:
+            json.dump(articles, f, ensure_ascii=False)
+        keep, report = dedup.find_duplicates(self.path, threshold=0.8, workers=workers, batch_size=7)
+        return keep.tolist(), report
+
+    def test_exact_and_near_duplicates(self):
+        rng = random.Random(0)
+        originals = [random_article(rng) for _ in range(20)]
+        articles, expected = [], []
+        for text in originals:
+            articles.append(text)
+            expected.append(True)
+            articles.append(' ' + text[:100] + '\n' + text[100:])  # 只差空白，算完全重复
+            expected.append(False)
+            articles.append(edit(rng, text))
+            expected.append(False)
+        for workers in (1, 3):
+            keep, report = self.find_duplicates(articles, workers=workers)
+            self.assertEqual(keep, expected)
+            self.assertEqual(report['exact_duplicates'], 20)
+            self.assertEqual(report['near_duplicates'], 20)
+            self.assertEqual(report['kept_articles'], 20)
+
+    def test_every_bucket_member_is_compared(self):
+        # 所有文章都落进同一个桶，第三篇只和桶里的第二篇相似
+        dedup.band_keys = lambda signature: np.zeros(dedup.NUM_BANDS, dtype=np.uint64)
+        rng = random.Random(1)
+        first, second = random_article(rng), random_article(rng)
+        keep, _ = self.find_duplicates([first, second, edit(rng, second)])
+        self.assertEqual(keep, [True, True, False])
+
+    def test_full_signature_is_compared(self):
+        # 两篇文章的签名只有低32位相同，不算重复
+        signatures = {'a': np.arange(dedup.NUM_PERM, dtype=np.uint64),
+                      'b': np.arange(dedup.NUM_PERM, dtype=np.uint64) + np.uint64(1 << 32)}
+        dedup.minhash = lambda text: signatures[text]
+        dedup.band_keys = lambda signature: np.zeros(dedup.NUM_BANDS, dtype=np.uint64)
+        keep, _ = self.find_duplicates(['a', 'b'])
+        self.assertEqual(keep, [True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import sys
+import random
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from test_basic_tokenizer import bundled_vocabs, random_text
+
+'''
+检查encode_batch得到的id和offsets与逐条convert_tokens_to_ids(tokenize(text))完全一样
+每个词表都用对应的tokenization模块，也检查不做basic tokenize、不转小写和加了新token的情况
+运行：python -m pytest tests/
+'''
+
+
+def vocab_texts(rng, vocab_path, count):
+    """词表里的词拼成的文本，夹着空白、换行和特殊token"""
+    with open(vocab_path, encoding='utf8') as f:
+        tokens = f.read().split('\n')
+    texts = []
+    for _ in range(count):
+        words = [rng.choice(tokens) for _ in range(rng.randint(0, 40))]
+        texts.append(''.join(rng.choice(['', '', ' ', '\n', '[SEP]', ' [CLS] ']) + word for word in words))
+    return texts
+
+
+class EncodeBatchTest(unittest.TestCase):
+
+    def assert_same_ids(self, tokenizer, texts, msg):
+        ids, offsets = tokenizer.encode_batch(texts)
+        self.assertEqual(ids.dtype, np.int64)
+        self.assertEqual(offsets.dtype, np.int64)
+        self.assertEqual(len(offsets), len(texts) + 1)
+        self.assertEqual(offsets[0], 0)
+        self.assertEqual(offsets[-1], len(ids))
+        for i, text in enumerate(texts):
+            expected = tokenizer.convert_tokens_to_ids(tokenizer.tokenize(text))
+            self.assertEqual(ids[offsets[i]:offsets[i + 1]].tolist(), expected, msg='{}: {!r}'.format(msg, text))
+
+    def test_bundled_vocabs(self):
+        rng = random.Random(0)
+        for vocab_path, module in bundled_vocabs():
+            texts = vocab_texts(rng, vocab_path, 100) + [random_text(rng, rng.randint(0, 200)) for _ in range(100)]
+            texts += ['', ' ', '[UNK]', '[SEP][SEP]']
+            for kwargs in ({}, {'do_lower_case': False}, {'do_basic_tokenize': False},
+                           {'tokenize_chinese_chars': False}):
+                tokenizer = module.BertTokenizer(vocab_file=vocab_path, **kwargs)
+                self.assert_same_ids(tokenizer, texts, msg='{} {}'.format(vocab_path, kwargs))
+
+    def test_added_tokens(self):
+        rng = random.Random(1)
+        for vocab_path, module in bundled_vocabs():
+            tokenizer = module.BertTokenizer(vocab_file=vocab_path)
+            texts = [random_text(rng, 100) for _ in range(20)]
+            self.assert_same_ids(tokenizer, texts, msg=vocab_path)
+            # 加了新token以后，encode_batch要重新识别它们
+            tokenizer.add_tokens(['<新词>', 'xyz'])
+            texts += ['a<新词>b xyz', '<新词><新词>', 'xyzxyz']
+            self.assert_same_ids(tokenizer, texts, msg=vocab_path)
+
+    def test_empty_batch(self):
+        vocab_path, module = bundled_vocabs()[0]
+        ids, offsets = module.BertTokenizer(vocab_file=vocab_path).encode_batch([])
+        self.assertEqual(ids.tolist(), [])
+        self.assertEqual(offsets.tolist(), [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from test_basic_tokenizer import bundled_vocabs, random_text
+from test_encode_batch import vocab_texts
+
+'''
+检查encode_stream、tokenize_file按块编码的结果和整段文本一起encode_batch完全一样
+iter_chunks切出的块拼起来就是原文，除了找不到切点的时候，每块都不超过chunk_chars太多
+运行：python -m pytest tests/
+'''
+
+
+def random_pieces(rng, text):
+    """把文本切成长短不一的若干段，模拟按行或按块读入"""
+    pieces = []
+    position = 0
+    while position < len(text):
+        end = position + rng.randint(0, 300)
+        pieces.append(text[position:end])
+        position = end
+    return pieces
+
+
+class EncodeStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def corpus(self, rng, vocab_path):
+        texts = vocab_texts(rng, vocab_path, 60) + [random_text(rng, rng.randint(0, 200)) for _ in range(60)]
+        return ''.join(rng.choice(['', ' ', '\n']) + text for text in texts)
+
+    def assert_same_ids(self, tokenizer, text, chunk_chars, msg):
+        expected = tokenizer.encode_batch([text])[0].tolist()
+        rng = random.Random(chunk_chars)
+        pieces = random_pieces(rng, text)
+        chunks = list(tokenizer.iter_chunks(pieces, chunk_chars))
+        self.assertEqual(''.join(chunks), text, msg=msg)
+        self.assertTrue(all(chunks), msg=msg)
+        ids = [i for array in tokenizer.encode_stream(pieces, chunk_chars) for i in array.tolist()]
+        self.assertEqual(ids, expected, msg=msg)
+        path = os.path.join(self.tmp_dir, 'corpus.txt')
+        with open(path, 'w', encoding='utf8', newline='') as f:
+            f.write(text)
+        ids = [i for array in tokenizer.tokenize_file(path, chunk_chars) for i in array.tolist()]
+        self.assertEqual(ids, expected, msg=msg)
+        return chunks
+
+    def test_bundled_vocabs(self):
+        rng = random.Random(0)
+        for vocab_path, module in bundled_vocabs():
+            text = self.corpus(rng, vocab_path)
+            for kwargs in ({}, {'tokenize_chinese_chars': False}, {'do_basic_tokenize': False}):
+                tokenizer = module.BertTokenizer(vocab_file=vocab_path, **kwargs)
+                for chunk_chars in (1, 7, 100, 1000):
+                    self.assert_same_ids(tokenizer, text, chunk_chars, msg='{} {} {}'.format(vocab_path, kwargs,
+                                                                                             chunk_chars))
+
+    def test_special_and_added_tokens_are_not_cut(self):
+        for vocab_path, module in bundled_vocabs():
+            tokenizer = module.BertTokenizer(vocab_file=vocab_path)
+            tokenizer.add_tokens(['<新 词>'])
+            text = ' '.join(['[SEP]', 'a [CLS] b', '<新 词>', '中[MASK]文', '<新 词><新 词>'] * 50)
+            for chunk_chars in (1, 3, 8, 50):
+                self.assert_same_ids(tokenizer, text, chunk_chars, msg='{} {}'.format(vocab_path, chunk_chars))
+
+    def test_chunk_size(self):
+        vocab_path, module = bundled_vocabs()[0]
+        tokenizer = module.BertTokenizer(vocab_file=vocab_path)
+        text = '中文 english ' * 2000
+        chunks = self.assert_same_ids(tokenizer, text, 1000, msg=vocab_path)
+        self.assertGreater(len(chunks), 10)
+        self.assertTrue(all(len(chunk) <= 1300 for chunk in chunks))
+        # 没有空白也没有汉字的长文本找不到切点，只能整段编码
+        text = 'a' * 5000
+        self.assertEqual(len(self.assert_same_ids(tokenizer, text, 100, msg=vocab_path)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tokenization_bert
+from test_basic_tokenizer import bundled_vocabs
+
+'''
+检查WordpieceTokenizer（前缀表实现）的tokenize和encode和原来的贪心最长匹配完全一样
+包括超过max_input_chars_per_word的词、切不开的词变成[UNK]，以及打开LRU缓存的情况
+运行：python -m pytest tests/
+'''
+
+
+def reference_tokenize(vocab, unk_token, text, max_input_chars_per_word=100):
+    """原来的WordpieceTokenizer.tokenize"""
+    output_tokens = []
+    for token in tokenization_bert.whitespace_tokenize(text):
+        chars = list(token)
+        if len(chars) > max_input_chars_per_word:
+            output_tokens.append(unk_token)
+            continue
+
+        is_bad = False
+        start = 0
+        sub_tokens = []
+        while start < len(chars):
+            end = len(chars)
+            cur_substr = None
+            while start < end:
+                substr = "".join(chars[start:end])
+                if start > 0:
+                    substr = "##" + substr
+                if substr in vocab:
+                    cur_substr = substr
+                    break
+                end -= 1
+            if cur_substr is None:
+                is_bad = True
+                break
+            sub_tokens.append(cur_substr)
+            start = end
+
+        if is_bad:
+            output_tokens.append(unk_token)
+        else:
+            output_tokens.extend(sub_tokens)
+    return output_tokens
+
+
+def random_words(rng, vocab, count):
+    """由词表里的词、去掉##的后缀和随机字符拼成的词，有的能切开，有的只能变成[UNK]"""
+    tokens = [token for token in vocab if token]
+    pieces = [token[2:] if token.startswith('##') and len(token) > 2 else token for token in tokens]
+    words = []
+    for _ in range(count):
+        parts = [rng.choice(pieces) for _ in range(rng.randint(1, 6))]
+        if rng.random() < 0.2:
+            parts.insert(rng.randint(0, len(parts)), rng.choice(['#', '##', 'x', 'é', '一', '\U0001f600']))
+        words.append(''.join(parts))
+    # 刚好在长度上限和超过上限的词
+    words.append('a' * 100)
+    words.append('a' * 101)
+    words.extend(rng.sample(tokens, min(len(tokens), 200)))
+    return words
+
+
+def wordpiece_vocabs():
+    return [vocab_path for vocab_path, module in bundled_vocabs() if module is tokenization_bert]
+
+
+class WordpieceTokenizerEquivalenceTest(unittest.TestCase):
+
+    def test_bundled_vocabs(self):
+        rng = random.Random(0)
+        for vocab_path in wordpiece_vocabs():
+            vocab = tokenization_bert.load_vocab(vocab_path)
+            words = random_words(rng, vocab, 3000)
+            for cache_size in (0, 64):
+                wordpiece_tokenizer = tokenization_bert.WordpieceTokenizer(vocab, '[UNK]', cache_size=cache_size)
+                for _ in range(2):  # 第二遍用到缓存
+                    for word in words:
+                        expected = reference_tokenize(vocab, '[UNK]', word)
+                        self.assertEqual(wordpiece_tokenizer.tokenize(word), expected,
+                                         msg='{}: {!r}'.format(vocab_path, word))
+                        ids = []
+                        wordpiece_tokenizer.encode(word, ids)
+                        self.assertEqual(ids, [vocab[token] for token in expected],
+                                         msg='{}: {!r}'.format(vocab_path, word))
+                if cache_size:
+                    self.assertGreater(wordpiece_tokenizer.cache_hits, 0)
+
+    def test_text_and_max_input_chars(self):
+        vocab = {'[UNK]': 0, 'un': 1, '##aff': 2, '##able': 3, 'a': 4, '##a': 5, '##': 6, '#': 7, 'abc': 8}
+        rng = random.Random(1)
+        texts = [' '.join(''.join(rng.choice(['un', 'aff', 'able', 'a', '#', 'b', 'c', 'abc'])
+                                  for _ in range(rng.randint(1, 5)))
+                          for _ in range(rng.randint(0, 8)))
+                 for _ in range(2000)]
+        texts += ['unaffable', '\tun  aff\n', '', 'a###', '##a']
+        for max_input_chars_per_word in (1, 3, 100):
+            wordpiece_tokenizer = tokenization_bert.WordpieceTokenizer(
+                vocab, '[UNK]', max_input_chars_per_word=max_input_chars_per_word)
+            for text in texts:
+                expected = reference_tokenize(vocab, '[UNK]', text, max_input_chars_per_word)
+                self.assertEqual(wordpiece_tokenizer.tokenize(text), expected, msg=repr(text))
+                ids = []
+                wordpiece_tokenizer.encode(text, ids)
+                self.assertEqual(ids, [vocab[token] for token in expected], msg=repr(text))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -24,6 +24,10 @@ from io import open
 
 from pytorch_transformers.tokenization_utils import PreTrainedTokenizer, clean_up_tokenization
 
+from compiled_vocab import load_compiled_vocab
+from tokenization_common import (CharEncoder, EncodeDecodeMixin, basic_tokenize, _is_whitespace, _is_control,
+                                 _is_punctuation, _is_chinese_char)
+
 logger = logging.getLogger(__name__)
 
 VOCAB_FILES_NAMES = {'vocab_file': 'vocab.txt'}
@@ -83,7 +87,7 @@ def whitespace_tokenize(text):
     return tokens
 
 
-class BertTokenizer(PreTrainedTokenizer):
+class BertTokenizer(EncodeDecodeMixin, PreTrainedTokenizer):
     r"""
     Constructs a BertTokenizer.
     :class:`~pytorch_pretrained_bert.BertTokenizer` runs end-to-end tokenization: punctuation splitting + wordpiece
@@ -104,7 +108,8 @@ class BertTokenizer(PreTrainedTokenizer):
 
     def __init__(self, vocab_file, do_lower_case=True, do_basic_tokenize=True, never_split=None,
                  unk_token="[UNK]", sep_token="[SEP]", pad_token="[PAD]", cls_token="[CLS]",
-                 mask_token="[MASK]", tokenize_chinese_chars=True, **kwargs):
+                 mask_token="[MASK]", tokenize_chinese_chars=True, wordpiece_cache_size=0, fast_char_mode=False,
+                 **kwargs):
         """Constructs a BertTokenizer.
 
         Args:
@@ -121,6 +126,12 @@ class BertTokenizer(PreTrainedTokenizer):
                 Whether to tokenize Chinese characters.
                 This should likely be desactivated for Japanese:
                 see: https://github.com/huggingface/pytorch-pretrained-BERT/issues/328
+            **wordpiece_cache_size**: (`optional`) int (default 0)
+                Number of words whose word pieces are kept in an LRU cache, 0 disables the cache.
+                See :class:`WordpieceTokenizer`.
+            **fast_char_mode**: (`optional`) boolean (default False)
+                Let `encode_batch` map text to ids with a codepoint-to-id table (see `CharEncoder`).
+                The ids are the same as without it. Needs do_basic_tokenize=True and no never_split.
         """
         super(BertTokenizer, self).__init__(unk_token=unk_token, sep_token=sep_token,
                                             pad_token=pad_token, cls_token=cls_token,
@@ -129,15 +140,22 @@ class BertTokenizer(PreTrainedTokenizer):
             raise ValueError(
                 "Can't find a vocabulary file at path '{}'. To load the vocabulary from a Google pretrained "
                 "model use `tokenizer = BertTokenizer.from_pretrained(PRETRAINED_MODEL_NAME)`".format(vocab_file))
-        self.vocab = load_vocab(vocab_file)
-        self.ids_to_tokens = collections.OrderedDict(
-            [(ids, tok) for tok, ids in self.vocab.items()])
+        self.vocab, self.ids_to_tokens, prefixes = load_compiled_vocab(vocab_file, "wordpiece", vocab_prefixes)
+        prefix_tables = build_prefix_tables(self.vocab, prefixes)
         self.do_basic_tokenize = do_basic_tokenize
         if do_basic_tokenize:
             self.basic_tokenizer = BasicTokenizer(do_lower_case=do_lower_case,
                                                   never_split=never_split,
                                                   tokenize_chinese_chars=tokenize_chinese_chars)
-        self.wordpiece_tokenizer = WordpieceTokenizer(vocab=self.vocab, unk_token=self.unk_token)
+        self.wordpiece_tokenizer = WordpieceTokenizer(vocab=self.vocab, unk_token=self.unk_token,
+                                                      cache_size=wordpiece_cache_size, prefix_tables=prefix_tables)
+        self.char_encoder = None
+        if fast_char_mode:
+            if not do_basic_tokenize or never_split:
+                raise ValueError("fast_char_mode needs do_basic_tokenize=True and no never_split")
+            self.char_encoder = CharEncoder(self.basic_tokenizer, self.wordpiece_tokenizer)
+        self._added_tokens_pattern = None
+        self._decode_cache = None
 
     @property
     def vocab_size(self):
@@ -234,25 +252,7 @@ class BasicTokenizer(object):
                 List of token not to split.
         """
         never_split = self.never_split + (never_split if never_split is not None else [])
-        text = self._clean_text(text)
-        # This was added on November 1st, 2018 for the multilingual and Chinese
-        # models. This is also applied to the English models now, but it doesn't
-        # matter since the English models were not trained on any Chinese data
-        # and generally don't have any Chinese data in them (there are Chinese
-        # characters in the vocabulary because Wikipedia does have some Chinese
-        # words in the English Wikipedia.).
-        if self.tokenize_chinese_chars:
-            text = self._tokenize_chinese_chars(text)
-        orig_tokens = whitespace_tokenize(text)
-        split_tokens = []
-        for token in orig_tokens:
-            if self.do_lower_case and token not in never_split:
-                token = token.lower()
-                token = self._run_strip_accents(token)
-            split_tokens.extend(self._run_split_on_punc(token))
-
-        output_tokens = whitespace_tokenize(" ".join(split_tokens))
-        return output_tokens
+        return basic_tokenize(text, never_split, self.do_lower_case, self.tokenize_chinese_chars)
 
     def _run_strip_accents(self, text):
         """Strips accents from a piece of text."""
@@ -302,25 +302,7 @@ class BasicTokenizer(object):
 
     def _is_chinese_char(self, cp):
         """Checks whether CP is the codepoint of a CJK character."""
-        # This defines a "chinese character" as anything in the CJK Unicode block:
-        #   https://en.wikipedia.org/wiki/CJK_Unified_Ideographs_(Unicode_block)
-        #
-        # Note that the CJK Unicode block is NOT all Japanese and Korean characters,
-        # despite its name. The modern Korean Hangul alphabet is a different block,
-        # as is Japanese Hiragana and Katakana. Those alphabets are used to write
-        # space-separated words, so they are not treated specially and handled
-        # like the all of the other languages.
-        if ((cp >= 0x4E00 and cp <= 0x9FFF) or  #
-                (cp >= 0x3400 and cp <= 0x4DBF) or  #
-                (cp >= 0x20000 and cp <= 0x2A6DF) or  #
-                (cp >= 0x2A700 and cp <= 0x2B73F) or  #
-                (cp >= 0x2B740 and cp <= 0x2B81F) or  #
-                (cp >= 0x2B820 and cp <= 0x2CEAF) or
-                (cp >= 0xF900 and cp <= 0xFAFF) or  #
-                (cp >= 0x2F800 and cp <= 0x2FA1F)):  #
-            return True
-
-        return False
+        return _is_chinese_char(cp)
 
     def _clean_text(self, text):
         """Performs invalid character removal and whitespace cleanup on text."""
@@ -339,10 +321,21 @@ class BasicTokenizer(object):
 class WordpieceTokenizer(object):
     """Runs WordPiece tokenization."""
 
-    def __init__(self, vocab, unk_token, max_input_chars_per_word=100):
+    def __init__(self, vocab, unk_token, max_input_chars_per_word=100, cache_size=0, prefix_tables=None):
         self.vocab = vocab
         self.unk_token = unk_token
         self.max_input_chars_per_word = max_input_chars_per_word
+        # Optional LRU cache of the words that had to be split, most recently used last.
+        # It lives in the tokenizer object, so every worker process has its own.
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache = collections.OrderedDict()
+        # One prefix table for the pieces that can start a word and one for the "##" continuations,
+        # keyed without the "##" so both are looked up with substrings of the word itself.
+        if prefix_tables is None:
+            prefix_tables = build_prefix_tables(vocab)
+        self._word_prefixes, self._subword_prefixes = prefix_tables
 
     def tokenize(self, text):
         """Tokenizes a piece of text into its word pieces.
@@ -364,73 +357,106 @@ class WordpieceTokenizer(object):
 
         output_tokens = []
         for token in whitespace_tokenize(text):
-            chars = list(token)
-            if len(chars) > self.max_input_chars_per_word:
+            sub_tokens = self._split_word(token)
+            if sub_tokens is None:
                 output_tokens.append(self.unk_token)
-                continue
+            else:
+                output_tokens.extend(sub_token for sub_token, _ in sub_tokens)
+        return output_tokens
 
-            is_bad = False
-            start = 0
-            sub_tokens = []
-            while start < len(chars):
-                end = len(chars)
-                cur_substr = None
-                while start < end:
-                    substr = "".join(chars[start:end])
-                    if start > 0:
-                        substr = "##" + substr
-                    if substr in self.vocab:
-                        cur_substr = substr
-                        break
-                    end -= 1
-                if cur_substr is None:
-                    is_bad = True
+    def encode(self, text, ids):
+        """Same as `tokenize`, but appends the vocab ids of the word pieces to `ids`."""
+        unk_id = self.vocab.get(self.unk_token)
+        for token in whitespace_tokenize(text):
+            index = self.vocab.get(token)
+            if index is not None and len(token) <= self.max_input_chars_per_word:
+                ids.append(index)
+                continue
+            sub_tokens = self._split_word(token)
+            if sub_tokens is None:
+                ids.append(unk_id)
+            else:
+                ids.extend(index for _, index in sub_tokens)
+
+    def _split_word(self, token):
+        """Returns the (word piece, id) pairs of a single word, or None if it has to become the unk token."""
+        if len(token) > self.max_input_chars_per_word:
+            return None
+        # A word that is in the vocab as a whole is its own longest match, which covers most Chinese text
+        index = self.vocab.get(token)
+        if index is not None:
+            return [(token, index)]
+        if not self.cache_size:
+            return self._longest_match_first(token)
+
+        try:
+            sub_tokens = self._cache[token]
+        except KeyError:
+            self.cache_misses += 1
+            sub_tokens = self._longest_match_first(token)
+            self._cache[token] = sub_tokens
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self.cache_hits += 1
+            self._cache.move_to_end(token)
+        return sub_tokens
+
+    def _longest_match_first(self, token):
+        start = 0
+        sub_tokens = []
+        prefixes = self._word_prefixes
+        while start < len(token):
+            # Extend the piece one character at a time while it is still a prefix of some vocab entry,
+            # remembering the last complete piece seen: that is the longest piece starting at `start`.
+            cur_index = None
+            for end in range(start + 1, len(token) + 1):
+                index = prefixes.get(token[start:end], _NOT_A_PREFIX)
+                if index is _NOT_A_PREFIX:
                     break
-                sub_tokens.append(cur_substr)
-                start = end
+                if index is not None:
+                    cur_index = index
+                    next_start = end
+            if cur_index is None:
+                return None
+            cur_substr = token[start:next_start]
+            sub_tokens.append((cur_substr if start == 0 else "##" + cur_substr, cur_index))
+            start = next_start
+            prefixes = self._subword_prefixes
+        return sub_tokens
 
-            if is_bad:
-                output_tokens.append(self.unk_token)
-            else:
-                output_tokens.extend(sub_tokens)
-        return output_tokens
+
+_NOT_A_PREFIX = object()
+
+
+def _build_prefix_table(ids, prefixes):
+    """Builds a trie flattened into one dict from a key-to-id dict.
+
+    Every prefix of every key is in the dict. A complete key maps to its id,
+    a prefix that is not itself a key maps to None.
+    """
+    table = dict.fromkeys(prefixes)
+    table.update(ids)
+    table.pop("", None)
+    return table
+
+
+def _proper_prefixes(keys):
+    return list({key[:end] for key in keys for end in range(1, len(key))}.difference(keys))
+
+
+def vocab_prefixes(vocab):
+    """Returns the prefixes of the word-initial and "##" continuation keys that are not keys themselves.
+
+    They are the slow part of `build_prefix_tables`, so BertTokenizer keeps them in the compiled vocab.
+    """
+    return (_proper_prefixes(vocab),
+            _proper_prefixes([token[2:] for token in vocab if token.startswith("##")]))
 
 
-def _is_whitespace(char):
-    """Checks whether `chars` is a whitespace character."""
-    # \t, \n, and \r are technically contorl characters but we treat them
-    # as whitespace since they are generally considered as such.
-    if char == " " or char == "\t" or char == "\n" or char == "\r":
-        return True
-    cat = unicodedata.category(char)
-    if cat == "Zs":
-        return True
-    return False
-
-
-def _is_control(char):
-    """Checks whether `chars` is a control character."""
-    # These are technically control characters but we count them as whitespace
-    # characters.
-    if char == "\t" or char == "\n" or char == "\r":
-        return False
-    cat = unicodedata.category(char)
-    if cat.startswith("C"):
-        return True
-    return False
-
-
-def _is_punctuation(char):
-    """Checks whether `chars` is a punctuation character."""
-    cp = ord(char)
-    # We treat all non-letter/number ASCII as punctuation.
-    # Characters such as "^", "$", and "`" are not in the Unicode
-    # Punctuation class but we treat them as punctuation anyways, for
-    # consistency.
-    if ((cp >= 33 and cp <= 47) or (cp >= 58 and cp <= 64) or
-            (cp >= 91 and cp <= 96) or (cp >= 123 and cp <= 126)):
-        return True
-    cat = unicodedata.category(char)
-    if cat.startswith("P"):
-        return True
-    return False
+def build_prefix_tables(vocab, prefixes=None):
+    """Builds the word-initial and "##" continuation prefix tables used by `WordpieceTokenizer`."""
+    if prefixes is None:
+        prefixes = vocab_prefixes(vocab)
+    continuations = {token[2:]: index for token, index in vocab.items() if token.startswith("##")}
+    return _build_prefix_table(vocab, prefixes[0]), _build_prefix_table(continuations, prefixes[1])
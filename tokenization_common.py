@@ -0,0 +1,522 @@
+# coding=utf-8
+"""Pieces shared by tokenization_bert and tokenization_bert_without_wordpiece.
+
+The character predicates come from the original tokenization_bert. On top of them sit a per-codepoint
+class table, the fused BasicTokenizer pass that reads it, and `EncodeDecodeMixin`, the encode and decode
+methods of both BertTokenizer classes.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import bisect
+import re
+import unicodedata
+from io import open
+
+import numpy as np
+
+
+def _is_whitespace(char):
+    """Checks whether `chars` is a whitespace character."""
+    # \t, \n, and \r are technically contorl characters but we treat them
+    # as whitespace since they are generally considered as such.
+    if char == " " or char == "\t" or char == "\n" or char == "\r":
+        return True
+    cat = unicodedata.category(char)
+    if cat == "Zs":
+        return True
+    return False
+
+
+def _is_control(char):
+    """Checks whether `chars` is a control character."""
+    # These are technically control characters but we count them as whitespace
+    # characters.
+    if char == "\t" or char == "\n" or char == "\r":
+        return False
+    cat = unicodedata.category(char)
+    if cat.startswith("C"):
+        return True
+    return False
+
+
+def _is_punctuation(char):
+    """Checks whether `chars` is a punctuation character."""
+    cp = ord(char)
+    # We treat all non-letter/number ASCII as punctuation.
+    # Characters such as "^", "$", and "`" are not in the Unicode
+    # Punctuation class but we treat them as punctuation anyways, for
+    # consistency.
+    if ((cp >= 33 and cp <= 47) or (cp >= 58 and cp <= 64) or
+            (cp >= 91 and cp <= 96) or (cp >= 123 and cp <= 126)):
+        return True
+    cat = unicodedata.category(char)
+    if cat.startswith("P"):
+        return True
+    return False
+
+
+def _is_chinese_char(cp):
+    """Checks whether CP is the codepoint of a CJK character."""
+    # This defines a "chinese character" as anything in the CJK Unicode block:
+    #   https://en.wikipedia.org/wiki/CJK_Unified_Ideographs_(Unicode_block)
+    #
+    # Note that the CJK Unicode block is NOT all Japanese and Korean characters,
+    # despite its name. The modern Korean Hangul alphabet is a different block,
+    # as is Japanese Hiragana and Katakana. Those alphabets are used to write
+    # space-separated words, so they are not treated specially and handled
+    # like the all of the other languages.
+    if ((cp >= 0x4E00 and cp <= 0x9FFF) or  #
+            (cp >= 0x3400 and cp <= 0x4DBF) or  #
+            (cp >= 0x20000 and cp <= 0x2A6DF) or  #
+            (cp >= 0x2A700 and cp <= 0x2B73F) or  #
+            (cp >= 0x2B740 and cp <= 0x2B81F) or  #
+            (cp >= 0x2B820 and cp <= 0x2CEAF) or
+            (cp >= 0xF900 and cp <= 0xFAFF) or  #
+            (cp >= 0x2F800 and cp <= 0x2FA1F)):  #
+        return True
+
+    return False
+
+
+# Per-codepoint character classes used by BasicTokenizer.
+_REMOVED = 1  # dropped by _clean_text
+_WHITESPACE = 2  # turned into " " by _clean_text
+_ISOLATED = 4  # surrounded by spaces by _tokenize_chinese_chars
+_PUNCTUATION = 8  # split off by _run_split_on_punc
+_NONSPACING_MARK = 16  # dropped by _run_strip_accents
+_LOWER_SPLITS = 32  # lower casing and stripping accents change where it is split on punctuation
+
+_BMP_SIZE = 0x10000
+_CHINESE_BMP_RANGES = ((0x4E00, 0x9FFF), (0x3400, 0x4DBF), (0xF900, 0xFAFF))
+_ASCII_PUNCTUATION_RANGES = ((33, 47), (58, 64), (91, 96), (123, 126))
+
+
+def _lowered_and_stripped(char):
+    return "".join(c for c in unicodedata.normalize("NFD", char.lower()) if unicodedata.category(c) != "Mn")
+
+
+def _lower_splits(char, flags):
+    """Whether splitting `char` on punctuation before lower casing it gives other tokens than after."""
+    lowered = _lowered_and_stripped(char)
+    if lowered == char:
+        return False
+    punctuation = [_is_punctuation(c) for c in lowered]
+    if flags & _PUNCTUATION:
+        return punctuation not in ([], [True])
+    return any(punctuation)
+
+
+def _classify(cp):
+    """The classes of one codepoint, straight from the character predicates."""
+    char = chr(cp)
+    if cp == 0 or cp == 0xfffd or _is_control(char):
+        flags = _REMOVED
+    elif _is_whitespace(char):
+        flags = _WHITESPACE
+    elif _is_chinese_char(cp) or char.isdigit():
+        flags = _ISOLATED
+    else:
+        flags = 0
+    if _is_punctuation(char):
+        flags |= _PUNCTUATION
+    if unicodedata.category(char) == "Mn":
+        flags |= _NONSPACING_MARK
+    if not flags & (_REMOVED | _WHITESPACE) and _lower_splits(char, flags):
+        flags |= _LOWER_SPLITS
+    return flags
+
+
+def _build_bmp_flags():
+    # Same values as _classify for every BMP codepoint, but with one C-level pass over all of them
+    # per property, so building the whole table only takes a few tens of milliseconds.
+    category_flags = {"Zs": _WHITESPACE, "Mn": _NONSPACING_MARK}
+    category_flags.update((category, _REMOVED) for category in ("Cc", "Cf", "Cn", "Co", "Cs"))
+    category_flags.update((category, _PUNCTUATION) for category in ("Pc", "Pd", "Pe", "Pf", "Pi", "Po", "Ps"))
+    chars = list(map(chr, range(_BMP_SIZE)))
+    flags = np.frombuffer(bytes(map(category_flags.get, map(unicodedata.category, chars), [0] * _BMP_SIZE)),
+                          dtype=np.uint8).copy()
+    flags[[ord("\t"), ord("\n"), ord("\r")]] = _WHITESPACE
+    flags[0xfffd] = _REMOVED
+    for start, end in _ASCII_PUNCTUATION_RANGES:
+        flags[start:end + 1] |= _PUNCTUATION
+    isolated = np.fromiter(map(str.isdigit, chars), dtype=bool, count=_BMP_SIZE)
+    for start, end in _CHINESE_BMP_RANGES:
+        isolated[start:end + 1] = True
+    isolated &= (flags & (_REMOVED | _WHITESPACE)) == 0
+    flags[isolated] |= _ISOLATED
+    # Only a codepoint that lower casing or NFD changes can be _LOWER_SPLITS
+    text = "".join(chars)
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        changed = _codepoints(lowered) != _codepoints(text)
+    else:
+        changed = np.fromiter((char.lower() != char for char in chars), dtype=bool, count=_BMP_SIZE)
+    changed |= np.fromiter(map(bool, map(unicodedata.decomposition, chars)), dtype=bool, count=_BMP_SIZE)
+    changed &= (flags & (_REMOVED | _WHITESPACE)) == 0
+    for cp in np.flatnonzero(changed).tolist():
+        if _lower_splits(chars[cp], flags[cp]):
+            flags[cp] |= _LOWER_SPLITS
+    return bytearray(flags.tobytes())
+
+
+def _codepoints(text):
+    return np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+
+
+# The classes of every BMP codepoint, computed once at import; codepoints above the BMP are
+# classified the first time they show up and kept in _ASTRAL_FLAGS.
+_BMP_FLAGS = _build_bmp_flags()
+_ASTRAL_FLAGS = {}
+
+
+def _char_flags(cp):
+    if cp < _BMP_SIZE:
+        return _BMP_FLAGS[cp]
+    flags = _ASTRAL_FLAGS.get(cp)
+    if flags is None:
+        flags = _ASTRAL_FLAGS[cp] = _classify(cp)
+        if flags & _LOWER_SPLITS:
+            _update_lower_splits_regex(chr(cp))
+    return flags
+
+
+class _TranslateTable(dict):
+    """A str.translate table filled in from the character classes.
+
+    str.translate needs a mapping, and a dict with an entry for each of the 65536 BMP codepoints
+    would take megabytes in every process, so an entry is only made the first time a codepoint
+    shows up, from _char_flags.
+    """
+
+    def __init__(self, replace):
+        super(_TranslateTable, self).__init__()
+        self._replace = replace
+
+    def __missing__(self, cp):
+        value = self._replace(cp, _char_flags(cp))
+        self[cp] = value
+        return value
+
+
+def _clean(cp, flags, tokenize_chinese_chars):
+    if flags & _REMOVED:
+        return None
+    if flags & _WHITESPACE:
+        return " "
+    if tokenize_chinese_chars and flags & _ISOLATED:
+        return " " + chr(cp) + " "
+    return cp
+
+
+def _clean_and_split(cp, flags, tokenize_chinese_chars):
+    if flags & _PUNCTUATION and not flags & (_REMOVED | _WHITESPACE):
+        return " " + chr(cp) + " "
+    return _clean(cp, flags, tokenize_chinese_chars)
+
+
+# The steps of BasicTokenizer.tokenize, one table each, for text the fused pass cannot handle
+_CLEAN_TABLE = _TranslateTable(lambda cp, flags: _clean(cp, flags, False))
+_CLEAN_AND_CHINESE_TABLE = _TranslateTable(lambda cp, flags: _clean(cp, flags, True))
+_PUNCTUATION_TABLE = _TranslateTable(lambda cp, flags: " " + chr(cp) + " " if flags & _PUNCTUATION else cp)
+_STRIP_ACCENTS_TABLE = _TranslateTable(lambda cp, flags: None if flags & _NONSPACING_MARK else cp)
+# _clean_text, _tokenize_chinese_chars and _run_split_on_punc in one table
+_FUSED_TABLE = _TranslateTable(lambda cp, flags: _clean_and_split(cp, flags, False))
+_FUSED_AND_CHINESE_TABLE = _TranslateTable(lambda cp, flags: _clean_and_split(cp, flags, True))
+
+# A capital sigma lower cases to a final or a medial sigma depending on the letters around it, which
+# the spaces put around punctuation by the fused table would change.
+_LOWER_SPLITS_CHARS = ["Σ"] + [chr(cp) for cp in range(_BMP_SIZE) if _BMP_FLAGS[cp] & _LOWER_SPLITS]
+_LOWER_SPLITS_REGEX = None
+
+
+def _update_lower_splits_regex(char=None):
+    global _LOWER_SPLITS_REGEX
+    if char is not None:
+        _LOWER_SPLITS_CHARS.append(char)
+    _LOWER_SPLITS_REGEX = re.compile("[" + "".join(re.escape(c) for c in _LOWER_SPLITS_CHARS) + "]")
+
+
+_update_lower_splits_regex()
+
+
+def _lower_and_strip_accents(text):
+    text = text.lower()
+    if text.isascii():
+        return text
+    return unicodedata.normalize("NFD", text).translate(_STRIP_ACCENTS_TABLE)
+
+
+_fused_never_split_cache = {}
+
+
+def _fused_never_split(never_split, tokenize_chinese_chars):
+    # The never_split tokens that lower casing would change, as they look after the fused table
+    key = (tuple(never_split), tokenize_chinese_chars)
+    fused = _fused_never_split_cache.get(key)
+    if fused is None:
+        table = _FUSED_AND_CHINESE_TABLE if tokenize_chinese_chars else _FUSED_TABLE
+        fused = [token.translate(table) for token in never_split if _lower_and_strip_accents(token) != token]
+        _fused_never_split_cache[key] = fused
+    return fused
+
+
+def basic_tokenize(text, never_split, do_lower_case, tokenize_chinese_chars):
+    """ The tokens of BasicTokenizer.tokenize.
+
+    They are the same as running _clean_text, _tokenize_chinese_chars, lower casing, _run_strip_accents
+    and _run_split_on_punc one after another, but the per-character steps are a single str.translate
+    over the whole text, followed by str.lower and NFD, instead of Python loops over the characters.
+
+    Splitting on punctuation before lower casing gives the same tokens unless the text has a character
+    marked _LOWER_SPLITS or a capital sigma, or has a never_split token that lower casing would change;
+    such text goes through the steps one at a time.
+    """
+    fused = text.translate(_FUSED_AND_CHINESE_TABLE if tokenize_chinese_chars else _FUSED_TABLE)
+    if not do_lower_case:
+        return fused.split()
+    if (fused.isascii() or not _LOWER_SPLITS_REGEX.search(fused)) and \
+            not any(token in fused for token in _fused_never_split(never_split, tokenize_chinese_chars)):
+        return _lower_and_strip_accents(fused).split()
+    text = text.translate(_CLEAN_AND_CHINESE_TABLE if tokenize_chinese_chars else _CLEAN_TABLE)
+    text = " ".join(token if token in never_split else _lower_and_strip_accents(token) for token in text.split())
+    return text.translate(_PUNCTUATION_TABLE).split()
+
+
+# Values of CharEncoder.table that are not vocab ids.
+_CHAR_UNKNOWN = -4  # not classified yet
+_CHAR_SPACE = -3  # a token boundary that gives no id
+_CHAR_COMPLEX = -2  # part of a word that goes through BasicTokenizer
+_CHAR_REMOVED = -1  # dropped by _clean_text, so it may glue its neighbours into one word
+
+
+class CharEncoder(object):
+    """Maps text straight to ids with a codepoint-to-id table.
+
+    A CJK character, digit or punctuation mark always becomes a word of its own in BasicTokenizer,
+    whatever its neighbours are, so its ids only depend on the codepoint. When such a word gives a
+    single id, with or without word pieces, that id is looked up for a whole text at once with numpy.
+    Only the runs of other characters (latin words and the like) go through BasicTokenizer and the
+    wordpiece tokenizer, so mostly-Chinese text barely touches Python code.
+
+    The table is filled in lazily, the first time a codepoint shows up.
+    """
+
+    def __init__(self, basic_tokenizer, wordpiece_tokenizer):
+        self.basic_tokenizer = basic_tokenizer
+        self.wordpiece_tokenizer = wordpiece_tokenizer
+        self.table = np.full(0x110000, _CHAR_UNKNOWN, dtype=np.int32)
+
+    def encode(self, text, ids, specials=(), never_split=None):
+        """Appends the ids of `text` to `ids`, the same as BasicTokenizer followed by the wordpiece tokenizer.
+
+        `specials` lists the ``(start, end, id)`` of the special tokens in `text`; each of them gives its id
+        and splits the text around it, as in PreTrainedTokenizer.tokenize.
+
+        Returns False, leaving `ids` untouched, for the rare text that has to go through the regular
+        path: text with characters removed by _clean_text, or with a capital sigma, whose lower case
+        depends on its neighbours.
+        """
+        if "\u03a3" in text:
+            return False
+        cps = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+        classes = self.table[cps]
+        unknown = classes == _CHAR_UNKNOWN
+        if unknown.any():
+            for cp in np.unique(cps[unknown]).tolist():
+                self.table[cp] = self._classify(cp)
+            classes = self.table[cps]
+        if (classes == _CHAR_REMOVED).any():
+            return False
+        for start, end, token_id in specials:
+            classes[start] = token_id
+            classes[start + 1:end] = _CHAR_SPACE
+        kept = np.flatnonzero(classes != _CHAR_SPACE)
+        classes = classes[kept]
+        is_complex = classes == _CHAR_COMPLEX
+        if not is_complex.any():
+            ids.extend(classes.tolist())
+            return True
+        # Each run of other characters, spaces in between included, is tokenized as a piece of text.
+        is_complex = np.concatenate(([False], is_complex, [False]))
+        edges = np.flatnonzero(is_complex[1:] != is_complex[:-1]).tolist()
+        position = 0
+        for start, end in zip(edges[::2], edges[1::2]):
+            ids.extend(classes[position:start].tolist())
+            piece = text[kept[start]:kept[end - 1] + 1]
+            tokens = self.basic_tokenizer.tokenize(piece, never_split=never_split)
+            self.wordpiece_tokenizer.encode(" ".join(tokens), ids)
+            position = end
+        ids.extend(classes[position:].tolist())
+        return True
+
+    def _classify(self, cp):
+        flags = _char_flags(cp)
+        if flags & _REMOVED:
+            return _CHAR_REMOVED
+        char = chr(cp)
+        if flags & _WHITESPACE or char.isspace():
+            return _CHAR_SPACE
+        if flags & _PUNCTUATION or (flags & _ISOLATED and self.basic_tokenizer.tokenize_chinese_chars):
+            # Combining marks in its decomposition could be reordered with the characters after it.
+            lowered = char.lower() if self.basic_tokenizer.do_lower_case else char
+            if not any(unicodedata.combining(c) for c in unicodedata.normalize("NFD", lowered)):
+                char_ids = []
+                self.wordpiece_tokenizer.encode(" ".join(self.basic_tokenizer.tokenize(char)), char_ids)
+                if len(char_ids) == 1:
+                    return char_ids[0]
+        return _CHAR_COMPLEX
+
+
+class EncodeDecodeMixin(object):
+    """ Encoding and decoding methods shared by both BertTokenizer classes.
+
+    The class needs `vocab`, `ids_to_tokens`, `do_basic_tokenize`, `basic_tokenizer`, a
+    `wordpiece_tokenizer` with an `encode(text, ids)` method and a `char_encoder` (a `CharEncoder`,
+    or None to always take the regular path), and sets `_added_tokens_pattern` and `_decode_cache`
+    to None in its __init__.
+    """
+
+    def encode_batch(self, texts):
+        """ Converts a batch of texts straight to ids, without building the intermediate token strings.
+
+        For each text the ids are the same as ``convert_tokens_to_ids(tokenize(text))``.
+
+        Returns:
+            A tuple ``(ids, offsets)`` of int64 arrays: the ids of ``texts[i]`` are ``ids[offsets[i]:offsets[i + 1]]``.
+        """
+        ids = []
+        offsets = [0]
+        for text in texts:
+            self._encode(text, ids)
+            offsets.append(len(ids))
+        return np.array(ids, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+    def encode_stream(self, texts, chunk_chars=1 << 20):
+        """ Encodes a stream of text a chunk at a time, holding about `chunk_chars` characters in memory.
+
+        `texts` is any iterable of strings, e.g. the lines of a file, and is read as if the strings were
+        joined without a separator. Yields int64 id arrays; together they are the ids of the joined text.
+        See `iter_chunks` for where the text is cut.
+        """
+        for chunk in self.iter_chunks(texts, chunk_chars):
+            yield self.encode_batch([chunk])[0]
+
+    def tokenize_file(self, path, chunk_chars=1 << 20):
+        """ Encodes a utf-8 text file with `encode_stream`, reading `chunk_chars` characters at a time,
+        so that a file without line breaks does not have to fit in memory either.
+        """
+        with open(path, "r", encoding="utf-8") as reader:
+            for ids in self.encode_stream(iter(lambda: reader.read(chunk_chars), ""), chunk_chars):
+                yield ids
+
+    def iter_chunks(self, texts, chunk_chars=1 << 20):
+        """ Joins the strings in `texts` and cuts the result into chunks of about `chunk_chars` characters
+        that can be encoded independently.
+
+        A chunk only ends after a whitespace character or, when Chinese characters are tokenized, after a
+        CJK character or digit, and never inside an added or special token, so encoding the chunks one by
+        one gives the same ids as encoding the whole text. A chunk keeps growing until such a place shows up.
+        """
+        pieces = []
+        size = 0
+        limit = chunk_chars
+        for text in texts:
+            pieces.append(text)
+            size += len(text)
+            if size < limit:
+                continue
+            buffer = "".join(pieces)
+            cut = self._chunk_cut(buffer)
+            if cut:
+                yield buffer[:cut]
+                buffer = buffer[cut:]
+            pieces = [buffer]
+            size = len(buffer)
+            # Without a place to cut, wait for another chunk_chars characters before looking again
+            limit = chunk_chars if cut else size + chunk_chars
+        buffer = "".join(pieces)
+        if buffer:
+            yield buffer
+
+    def _chunk_cut(self, text):
+        # The last position where text can be cut in two without changing its ids, 0 if there is none
+        pattern = self._added_tokens_regex()
+        spans = [match.span() for match in pattern.finditer(text)] if pattern is not None else []
+        starts = [start for start, _ in spans]
+        # An added token that starts before the cut has to be seen whole to be found
+        position = len(text) - max([len(token) for token in self._added_tokens_pattern[0]] + [0])
+        boundary = _WHITESPACE
+        if self.do_basic_tokenize and self.basic_tokenizer.tokenize_chinese_chars:
+            boundary |= _ISOLATED
+        while position > 0:
+            if _char_flags(ord(text[position - 1])) & boundary:
+                i = bisect.bisect_left(starts, position) - 1
+                if i < 0 or spans[i][1] <= position:
+                    return position
+            position -= 1
+        return 0
+
+    def _added_tokens_regex(self):
+        # Added and special tokens are split off first, as in PreTrainedTokenizer.tokenize
+        added_tokens = list(self.added_tokens_encoder.keys()) + self.all_special_tokens
+        if self._added_tokens_pattern is None or self._added_tokens_pattern[0] != added_tokens:
+            pattern = re.compile("(" + "|".join(re.escape(token) for token in added_tokens) + ")") \
+                if added_tokens else None
+            self._added_tokens_pattern = (added_tokens, pattern)
+        return self._added_tokens_pattern[1]
+
+    def _encode(self, text, ids):
+        pattern = self._added_tokens_regex()
+        if self.char_encoder is not None:
+            # The whole text goes through the table in one go, with the special tokens put in by position
+            specials = [(match.start(), match.end(), self._convert_token_to_id_with_added_voc(match.group()))
+                        for match in pattern.finditer(text)] if pattern is not None else []
+            if self.char_encoder.encode(text, ids, specials, never_split=self.all_special_tokens):
+                return
+        for i, sub_text in enumerate(pattern.split(text) if pattern is not None else [text]):
+            if i % 2:
+                ids.append(self._convert_token_to_id_with_added_voc(sub_text))
+            elif not self.do_basic_tokenize:
+                self.wordpiece_tokenizer.encode(sub_text, ids)
+            else:
+                tokens = self.basic_tokenizer.tokenize(sub_text, never_split=self.all_special_tokens)
+                self.wordpiece_tokenizer.encode(" ".join(tokens), ids)
+
+    def decode(self, ids):
+        """ Converts ids back to text the way generate.py prints samples.
+
+        Word pieces are joined with their "##" prefix removed, a space is kept between two
+        consecutive all-lowercase-ASCII tokens, [MASK] is dropped, [CLS] and [SEP] become
+        newlines and the result is stripped. A literal "##" in the text is left alone.
+        """
+        surfaces, spaced_surfaces, is_word, unk_id = self._decode_tables()
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        if ids.size == 0:
+            return ""
+        ids = np.where((ids >= 0) & (ids < len(surfaces)), ids, unk_id)
+        pieces = surfaces[ids]
+        words = is_word[ids]
+        spaced = np.flatnonzero(words[:-1] & words[1:])
+        pieces[spaced] = spaced_surfaces[ids[spaced]]
+        return "".join(pieces.tolist()).strip()
+
+    def decode_batch(self, batch_ids):
+        """ Applies `decode` to every sequence of ids in `batch_ids`. """
+        return [self.decode(ids) for ids in batch_ids]
+
+    def _decode_tables(self):
+        # Per-id tables, rebuilt only when tokens were added to the tokenizer
+        if self._decode_cache is not None and self._decode_cache[0] == len(self.added_tokens_decoder):
+            return self._decode_cache[1]
+        size = max(list(self.ids_to_tokens) + list(self.added_tokens_decoder)) + 1
+        tokens = [self.convert_ids_to_tokens(index) for index in range(size)]
+        special = {self.mask_token: "", self.cls_token: "\n", self.sep_token: "\n"}
+        surfaces = np.array([special[token] if token in special else
+                             token[2:] if token.startswith("##") and len(token) > 2 else token
+                             for token in tokens], dtype=object)
+        spaced_surfaces = np.array([surface + " " for surface in surfaces], dtype=object)
+        is_word = np.array([all("a" <= char <= "z" for char in token) for token in tokens], dtype=bool)
+        tables = (surfaces, spaced_surfaces, is_word, self.vocab.get(self.unk_token, 0))
+        self._decode_cache = (len(self.added_tokens_decoder), tables)
+        return tables
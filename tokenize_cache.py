@@ -0,0 +1,131 @@
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+import numpy as np
+from tokenized_files import file_fingerprint
+
+'''
+按文章内容做key的tokenize缓存，语料只追加了少量文章时重新预处理只需要tokenize新增或改动的文章
+缓存目录里有三个文件：
+meta.json: 词表文件的hash、是否做word piece等，任何一项变化都会清空缓存
+ids_{n}.bin: 所有缓存文章的token id，首尾相接，压缩后n会变化
+index.sqlite: 文章内容的sha1 -> (在ids文件里的起点, 长度)，以及当前使用的ids文件
+'''
+
+CACHE_VERSION = 1
+
+
+def article_key(text):
+    return hashlib.sha1(text.encode('utf8')).digest()
+
+
+class TokenizeCache(object):
+
+    def __init__(self, cache_dir, vocab_file, no_wordpiece, dtype):
+        self.cache_dir = cache_dir
+        self.dtype = np.dtype(dtype)
+        meta = {
+            'version': CACHE_VERSION,
+            'vocab_fingerprint': file_fingerprint(vocab_file),
+            'no_wordpiece': bool(no_wordpiece),
+            'dtype': self.dtype.name,
+        }
+        meta_path = os.path.join(cache_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                old_meta = json.load(f)
+            if old_meta != meta:
+                print('tokenize cache at {} is stale, rebuilding'.format(cache_dir))
+                shutil.rmtree(cache_dir)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+
+        self._db = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'))
+        self._db.execute('CREATE TABLE IF NOT EXISTS articles '
+                         '(key BLOB PRIMARY KEY, offset INTEGER, length INTEGER, generation INTEGER)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value INTEGER)')
+        # 每次build是一个新的generation，build结束时删掉本次没有用到的文章
+        self.generation = self._get_state('generation', 0) + 1
+        self._set_state('generation', self.generation)
+        self._ids_file_number = self._get_state('ids_file', 0)
+        self._set_state('ids_file', self._ids_file_number)
+        self._db.commit()
+
+        ids_path = self._ids_path(self._ids_file_number)
+        if not os.path.exists(ids_path):
+            open(ids_path, 'wb').close()
+        self._ids_file = open(ids_path, 'r+b')
+        self._ids_file.seek(0, os.SEEK_END)
+        self._size = self._ids_file.tell() // self.dtype.itemsize
+        self.hits = 0
+        self.misses = 0
+
+    def _get_state(self, name, default):
+        row = self._db.execute('SELECT value FROM state WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else default
+
+    def _set_state(self, name, value):
+        self._db.execute('INSERT OR REPLACE INTO state VALUES (?, ?)', (name, value))
+
+    def _ids_path(self, number):
+        return os.path.join(self.cache_dir, 'ids_{}.bin'.format(number))
+
+    def _read(self, offset, length):
+        self._ids_file.seek(offset * self.dtype.itemsize)
+        return np.frombuffer(self._ids_file.read(length * self.dtype.itemsize), dtype=self.dtype)
+
+    def get(self, key):
+        row = self._db.execute('SELECT offset, length FROM articles WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._db.execute('UPDATE articles SET generation = ? WHERE key = ?', (self.generation, key))
+        return self._read(*row)
+
+    def put(self, key, ids):
+        ids = np.asarray(ids, dtype=self.dtype)
+        self._ids_file.seek(self._size * self.dtype.itemsize)
+        self._ids_file.write(ids.tobytes())
+        self._db.execute('INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?)',
+                         (key, self._size, ids.size, self.generation))
+        self._size += ids.size
+
+    def close(self, prune=True):
+        """prune为True时删掉本次build没有用到的文章，失效数据超过一半时压缩ids文件"""
+        if self._db is None:
+            return
+        if prune:
+            self._db.execute('DELETE FROM articles WHERE generation < ?', (self.generation,))
+            live = self._db.execute('SELECT COALESCE(SUM(length), 0) FROM articles').fetchone()[0]
+            if live * 2 < self._size:
+                self._compact()
+        self._db.commit()
+        self._db.close()
+        self._db = None
+        self._ids_file.close()
+
+    def _compact(self):
+        # 先写新的ids文件，和新的offset一起提交后再删旧文件，中途退出也不会让索引和ids文件对不上
+        new_number = self._ids_file_number + 1
+        new_path = self._ids_path(new_number)
+        offset = 0
+        moves = []
+        with open(new_path, 'wb') as f:
+            for key, old_offset, length in self._db.execute(
+                    'SELECT key, offset, length FROM articles ORDER BY offset').fetchall():
+                f.write(self._read(old_offset, length).tobytes())
+                moves.append((offset, key))
+                offset += length
+        self._db.executemany('UPDATE articles SET offset = ? WHERE key = ?', moves)
+        self._set_state('ids_file', new_number)
+        self._db.commit()
+        self._ids_file.close()
+        os.remove(self._ids_path(self._ids_file_number))
+        self._ids_file_number = new_number
+        self._ids_file = open(new_path, 'r+b')
+        self._size = offset
@@ -0,0 +1,312 @@
+import os
+import json
+import struct
+import hashlib
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+'''
+tokenized语料的二进制存储格式
+每个文件由一个定长的文件头和一段连续的token id数组组成，可以直接用np.memmap打开，不需要再做split和int转换
+同一目录下的manifest.json记录每个文件的token数、文章数以及词表信息，训练前计算总步数时不需要打开任何语料文件
+'''
+
+MAGIC = b'GPT2CNTK'
+VERSION = 1
+HEADER_FORMAT = '<8sIIQ'  # magic, version, 每个id占用的字节数, token个数
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+_DTYPES = {2: np.uint16, 4: np.uint32, 8: np.uint64}
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+CHUNKS_PER_PIECE = 16  # 流式预处理时每个piece至少分成这么多块读入
+
+
+def file_fingerprint(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def dtype_for_vocab_size(vocab_size):
+    """词表能放进uint16就用uint16，否则用uint32"""
+    return np.uint16 if vocab_size <= np.iinfo(np.uint16).max + 1 else np.uint32
+
+
+def tokenized_file_path(tokenized_data_path, i):
+    return os.path.join(tokenized_data_path, 'tokenized_train_{}.bin'.format(i))
+
+
+def document_index_path(tokenized_data_path, i):
+    return os.path.join(tokenized_data_path, 'tokenized_train_{}.idx'.format(i))
+
+
+def tokenized_txt_file_path(tokenized_data_path, i):
+    return os.path.join(tokenized_data_path, 'tokenized_train_{}.txt'.format(i))
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) != HEADER_SIZE:
+        raise ValueError('{} is not a tokenized file: header too short'.format(path))
+    magic, version, itemsize, length = struct.unpack(HEADER_FORMAT, header)
+    if magic != MAGIC:
+        raise ValueError('{} is not a tokenized file: bad magic {!r}'.format(path, magic))
+    if version != VERSION:
+        raise ValueError('{}: unsupported tokenized file version {}'.format(path, version))
+    if itemsize not in _DTYPES:
+        raise ValueError('{}: unsupported item size {}'.format(path, itemsize))
+    return np.dtype(_DTYPES[itemsize]), length
+
+
+def num_tokens(path):
+    """只读文件头，返回文件中的token个数"""
+    return read_header(path)[1]
+
+
+def load_tokenized_file(path):
+    """以只读memmap的方式打开一个tokenized文件，返回一维的id数组"""
+    dtype, length = read_header(path)
+    if length == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(length,))
+
+
+def read_tokenized_file(path):
+    """把整个tokenized文件顺序读进内存，返回一维的id数组"""
+    dtype, length = read_header(path)
+    return np.fromfile(path, dtype=dtype, count=length, offset=HEADER_SIZE)
+
+
+class TokenizedFileWriter(object):
+    """边写边追加id的writer，关闭时回填文件头里的token个数"""
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        if self.dtype.itemsize not in _DTYPES:
+            raise ValueError('unsupported dtype {}'.format(self.dtype))
+        self.length = 0
+        self._f = open(path, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        self._f.seek(0)
+        self._f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, self.dtype.itemsize, self.length))
+
+    def write(self, ids):
+        ids = np.asarray(ids)
+        if ids.size == 0:
+            return
+        if ids.min() < 0 or ids.max() > np.iinfo(self.dtype).max:
+            raise ValueError('token id out of range for {}'.format(self.dtype))
+        self._f.write(ids.astype(self.dtype, copy=False).tobytes())
+        self.length += ids.size
+
+    def close(self):
+        if self._f is None:
+            return
+        self._write_header()
+        self._f.close()
+        self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def piece_chunk_size(total_size, num_pieces, chunk_size):
+    """配合PiecesWriter使用时每次读入的大小：不超过一个piece的1/CHUNKS_PER_PIECE，否则语料不大时块的边界太粗，很多piece会是空的"""
+    return max(1, min(chunk_size, total_size // (num_pieces * CHUNKS_PER_PIECE)))
+
+
+class PiecesWriter(object):
+    """把按顺序到来的id流按原始语料的字节位置平均写进num_pieces个tokenized文件，关闭时返回每个文件的piece_info"""
+
+    def __init__(self, tokenized_data_path, num_pieces, total_size, dtype):
+        self.tokenized_data_path = tokenized_data_path
+        self.num_pieces = num_pieces
+        self.total_size = total_size
+        self.dtype = dtype
+        self.pieces_info = []
+        self._position = 0
+        self._writer = TokenizedFileWriter(tokenized_file_path(tokenized_data_path, 0), dtype)
+
+    def _piece_start(self, i):
+        return self.total_size * i // self.num_pieces
+
+    def _next_piece(self):
+        self._writer.close()
+        self.pieces_info.append(piece_info(self._writer.length))
+        self._writer = TokenizedFileWriter(tokenized_file_path(self.tokenized_data_path, len(self.pieces_info)),
+                                           self.dtype)
+
+    def write(self, ids, position):
+        """position是ids对应的原始语料的末尾字节位置，ids的开头是上一次write的position"""
+        # 这段语料的中点过了下一个文件的起点就先换文件，每个文件的边界落在离平均切分点最近的位置
+        while len(self.pieces_info) < self.num_pieces - 1 and \
+                self._position + position >= 2 * self._piece_start(len(self.pieces_info) + 1):
+            self._next_piece()
+        self._writer.write(ids)
+        self._position = position
+
+    def finish(self):
+        while len(self.pieces_info) < self.num_pieces - 1:
+            self._next_piece()
+        self._writer.close()
+        self.pieces_info.append(piece_info(self._writer.length))
+        return self.pieces_info
+
+    def close(self):
+        self._writer.close()
+
+
+def write_tokenized_file(path, ids, dtype):
+    with TokenizedFileWriter(path, dtype) as writer:
+        writer.write(ids)
+
+
+def write_document_index(path, document_lengths):
+    """文章边界索引和tokenized文件用同样的格式，存len(document_lengths) + 1个uint64 offset，第k篇文章是[offsets[k], offsets[k + 1])"""
+    offsets = np.zeros(len(document_lengths) + 1, dtype=np.uint64)
+    np.cumsum(document_lengths, out=offsets[1:])
+    write_tokenized_file(path, offsets, np.uint64)
+
+
+def load_document_index(path):
+    """返回文章边界的offsets，没有索引文件时返回None"""
+    if not os.path.exists(path):
+        return None
+    return np.asarray(load_tokenized_file(path), dtype=np.int64)
+
+
+def document_window_starts(offsets, n_ctx, stride):
+    """每篇文章从开头起每隔stride取一个窗口起点，窗口不会从文章中间的任意位置开始，也不会超出文件末尾"""
+    doc_starts = offsets[:-1]
+    doc_lengths = np.diff(offsets)
+    counts = np.where(doc_lengths > 0, (doc_lengths - 1) // stride + 1, 0)
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    starts = np.repeat(doc_starts, counts) + stride * (np.arange(counts.sum()) - first)
+    return starts[starts < offsets[-1] - n_ctx]
+
+
+def window_starts(num_tokens, n_ctx, stride, start_point=0):
+    """和训练循环里的while start_point < len(tokens) - n_ctx一致，返回一个文件的所有训练窗口起点"""
+    return np.arange(start_point, num_tokens - n_ctx, stride, dtype=np.int64)
+
+
+def num_windows(num_tokens, n_ctx, stride, start_point=0):
+    """和训练循环里的while start_point < len(tokens) - n_ctx一致，返回一个文件能切出多少个训练窗口"""
+    if num_tokens - n_ctx <= start_point:
+        return 0
+    return (num_tokens - n_ctx - start_point - 1) // stride + 1
+
+
+def piece_info(num_tokens, num_documents=None):
+    return {'num_tokens': int(num_tokens), 'num_documents': num_documents}
+
+
+def make_manifest(tokenized_data_path, pieces, dtype, vocab_size=None, vocab_fingerprint=None):
+    """pieces是按顺序排列的piece_info列表"""
+    num_documents = [piece['num_documents'] for piece in pieces]
+    return {
+        'version': MANIFEST_VERSION,
+        'num_pieces': len(pieces),
+        'dtype': np.dtype(dtype).name,
+        'vocab_size': vocab_size,
+        'vocab_fingerprint': vocab_fingerprint,
+        'num_tokens': sum(piece['num_tokens'] for piece in pieces),
+        'num_documents': None if None in num_documents else sum(num_documents),
+        'pieces': [dict(piece, file=os.path.basename(tokenized_file_path(tokenized_data_path, i)))
+                   for i, piece in enumerate(pieces)],
+    }
+
+
+def write_manifest(tokenized_data_path, pieces, dtype, vocab_size=None, vocab_fingerprint=None):
+    manifest = make_manifest(tokenized_data_path, pieces, dtype, vocab_size, vocab_fingerprint)
+    path = os.path.join(tokenized_data_path, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return manifest
+
+
+def load_manifest(tokenized_data_path, num_pieces=None):
+    """读取manifest.json。老的语料没有manifest时只读每个文件的文件头来重建，文章数记为None"""
+    path = os.path.join(tokenized_data_path, MANIFEST_NAME)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+        if manifest['version'] != MANIFEST_VERSION:
+            raise ValueError('{}: unsupported manifest version {}'.format(path, manifest['version']))
+        return manifest
+    if num_pieces is None:
+        raise ValueError('{} not found'.format(path))
+    print('{} not found, reading headers of the tokenized files'.format(path))
+    pieces = []
+    dtype = None
+    for i in range(num_pieces):
+        dtype, length = read_header(tokenized_file_path(tokenized_data_path, i))
+        pieces.append({'num_tokens': length, 'num_documents': None})
+    return make_manifest(tokenized_data_path, pieces, dtype)
+
+
+def check_manifest(manifest, num_pieces, n_ctx, stride, vocab_size=None, vocab_fingerprint=None):
+    """检查语料和当前的训练参数是否匹配，返回用到的pieces的总token数"""
+    if num_pieces > manifest['num_pieces']:
+        raise ValueError('num_pieces is {} but the tokenized data only has {} pieces'.format(
+            num_pieces, manifest['num_pieces']))
+    if vocab_size is not None and manifest['vocab_size'] is not None and manifest['vocab_size'] > vocab_size:
+        raise ValueError('tokenized data was built with a vocab of size {}, larger than the model vocab_size {}'.format(
+            manifest['vocab_size'], vocab_size))
+    if vocab_fingerprint is not None and manifest['vocab_fingerprint'] not in (None, vocab_fingerprint):
+        print('warning: tokenized data was built with a different vocab file')
+    if stride > n_ctx:
+        print('warning: stride {} is larger than n_ctx {}, some tokens will never be trained on'.format(stride, n_ctx))
+    pieces = manifest['pieces'][:num_pieces]
+    empty = [i for i, piece in enumerate(pieces) if num_windows(piece['num_tokens'], n_ctx, stride) == 0]
+    if empty:
+        print('warning: {} pieces are too short for n_ctx {} and will be skipped: {}'.format(len(empty), n_ctx, empty))
+    return sum(piece['num_tokens'] for piece in pieces)
+
+
+def convert_txt_files(tokenized_data_path, num_pieces, remove_txt=False):
+    """把旧的空格分隔的tokenized_train_{i}.txt转成二进制格式"""
+    pieces = []
+    dtypes = []
+    for i in tqdm(range(num_pieces)):
+        txt_path = tokenized_txt_file_path(tokenized_data_path, i)
+        with open(txt_path, 'r') as f:
+            ids = np.array(f.read().split(), dtype=np.int64)
+        dtype = dtype_for_vocab_size(int(ids.max()) + 1 if ids.size else 0)
+        write_tokenized_file(tokenized_file_path(tokenized_data_path, i), ids, dtype)
+        pieces.append(piece_info(len(ids)))
+        dtypes.append(dtype)
+        if remove_txt:
+            os.remove(txt_path)
+    write_manifest(tokenized_data_path, pieces, max(dtypes, key=lambda dtype: np.dtype(dtype).itemsize))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokenized_data_path', default='data/tokenized/', type=str, required=False,
+                        help='tokenized语料存放位置')
+    parser.add_argument('--num_pieces', default=100, type=int, required=False, help='语料被分成了多少份')
+    parser.add_argument('--remove_txt', action='store_true', help='转换完成后删除原来的txt文件')
+
+    args = parser.parse_args()
+    print('args:\n' + args.__repr__())
+
+    convert_txt_files(args.tokenized_data_path, args.num_pieces, remove_txt=args.remove_txt)
+    print('finish')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,108 @@
 import pytorch_transformers
 import torch
 import os
-import json
 import random
 import numpy as np
 import argparse
+import collections
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 from torch.utils.tensorboard import SummaryWriter
 from datetime import datetime
 from tqdm import tqdm
 from torch.nn import DataParallel
+from corpus_reader import FORMATS, count_articles, iter_articles
+from dedup import dedup_report_path, find_duplicates, write_report
+from parallel_utils import imap_in_order, init_tokenizer_worker, tokenize_texts
+from tokenize_cache import TokenizeCache, article_key
+from tokenized_files import check_manifest, document_index_path, document_window_starts, dtype_for_vocab_size, \
+    file_fingerprint, load_document_index, load_manifest, piece_info, tokenized_file_path, window_starts, \
+    write_document_index, write_manifest, write_tokenized_file
+from train_data import WindowBatches, batch_loader, plan_epoch, plan_global_epoch
+from checkpoint import CHECKPOINT_DIR_NAME, CheckpointSaver, latest_checkpoint, load_checkpoint, set_rng_states
 
 
-def build_files(data_path, tokenized_data_path, num_pieces, full_tokenizer, min_length):
+def build_files(data_path, tokenized_data_path, num_pieces, full_tokenizer, min_length, workers=1,
+                tokenizer_path=None, no_wordpiece=False, data_format=None, cache_dir=None, dedup=False,
+                dedup_threshold=0.8, wordpiece_cache_size=0, fast_char_mode=False):
     if not os.path.exists(tokenized_data_path):
         os.mkdir(tokenized_data_path)
-    with open(data_path, 'r', encoding='utf8') as f:
-        print('reading lines')
-        lines = json.load(f)
-        lines = [line.replace('\n', ' [SEP] ') for line in lines]  # 用[SEP]表示换行, 段落之间使用SEP表示段落结束
-        all_len = len(lines)
-    for i in tqdm(range(num_pieces)):
-        sublines = lines[all_len // num_pieces * i: all_len // num_pieces * (i + 1)]
-        if i == num_pieces - 1:
-            sublines.extend(lines[all_len // num_pieces * (i + 1):])  # 把尾部例子添加到最后一个piece
-        sublines = [full_tokenizer.tokenize(line) for line in sublines if
-                    len(line) > min_length]  # 只考虑长度超过min_length的句子
-        sublines = [full_tokenizer.convert_tokens_to_ids(line) for line in sublines]
-        full_line = []
-        for subline in sublines:
-            full_line.append(full_tokenizer.convert_tokens_to_ids('[MASK]'))  # 文章开头添加MASK表示文章开始
-            full_line.extend(subline)
-            full_line.append(full_tokenizer.convert_tokens_to_ids('[CLS]'))  # 文章之间添加CLS表示文章结束
-        with open(tokenized_data_path + 'tokenized_train_{}.txt'.format(i), 'w') as f:
-            for id in full_line:
-                f.write(str(id) + ' ')
+    if (workers > 1 or cache_dir) and tokenizer_path is None:
+        raise ValueError('tokenizer_path is required when using workers or a tokenize cache')
+    keep = None
+    if dedup:
+        print('finding duplicates')
+        keep, report = find_duplicates(data_path, data_format, threshold=dedup_threshold, workers=workers)
+        write_report(dedup_report_path(tokenized_data_path), report)
+        all_len = int(keep.sum())
+    else:
+        print('counting articles')
+        all_len = count_articles(data_path, data_format)
+
+    def pieces():
+        # 流式读取，每次只在内存中保留一个piece的文章
+        articles = iter_articles(data_path, data_format)
+        if keep is not None:
+            articles = itertools.compress(articles, keep)  # 跳过重复的文章
+        lines = (line.replace('\n', ' [SEP] ') for line in articles)  # 用[SEP]表示换行, 段落之间使用SEP表示段落结束
+        for i in range(num_pieces):
+            if i == num_pieces - 1:
+                yield list(lines)  # 把尾部例子添加到最后一个piece
+            else:
+                yield list(itertools.islice(lines, all_len // num_pieces))
+
+    dtype = dtype_for_vocab_size(full_tokenizer.vocab_size)
+    cache = TokenizeCache(cache_dir, tokenizer_path, no_wordpiece, dtype) if cache_dir else None
+    jobs = collections.deque()
+
+    def uncached_lines():
+        # 命中缓存的文章直接复用token id，只把剩下的文章交给tokenizer
+        for sublines in pieces():
+            sublines = [line for line in sublines if len(line) > min_length]  # 只考虑长度超过min_length的句子
+            keys = [article_key(line) for line in sublines] if cache else [None] * len(sublines)
+            cached = [cache.get(key) for key in keys] if cache else [None] * len(sublines)
+            jobs.append((keys, cached))
+            yield [line for line, ids in zip(sublines, cached) if ids is None]
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_tokenizer_worker,
+                                       initargs=(tokenizer_path, no_wordpiece, wordpiece_cache_size, fast_char_mode))
+        results = imap_in_order(executor, tokenize_texts, uncached_lines(), 2 * workers)
+    else:
+        executor = None
+        results = (tokenize_texts(lines, full_tokenizer) for lines in uncached_lines())
+    mask_id = full_tokenizer.convert_tokens_to_ids('[MASK]')
+    cls_id = full_tokenizer.convert_tokens_to_ids('[CLS]')
+    pieces_info = []
+    finished = False
+    try:
+        for i, (new_ids, new_offsets) in enumerate(tqdm(results, total=num_pieces)):
+            keys, cached = jobs.popleft()
+            new_ids = iter(np.split(new_ids, new_offsets[1:-1]))
+            full_line = []
+            document_lengths = []
+            for key, ids in zip(keys, cached):
+                if ids is None:
+                    ids = next(new_ids)
+                    if cache is not None:
+                        cache.put(key, ids)
+                full_line.append([mask_id])  # 文章开头添加MASK表示文章开始
+                full_line.append(ids)
+                full_line.append([cls_id])  # 文章之间添加CLS表示文章结束
+                document_lengths.append(len(ids) + 2)
+            full_line = np.concatenate(full_line) if full_line else []
+            write_tokenized_file(tokenized_file_path(tokenized_data_path, i), full_line, dtype)
+            write_document_index(document_index_path(tokenized_data_path, i), document_lengths)
+            pieces_info.append(piece_info(len(full_line), num_documents=len(keys)))
+        finished = True
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if cache is not None:
+            print('tokenize cache: {} hits, {} misses'.format(cache.hits, cache.misses))
+            cache.close(prune=finished)
+    write_manifest(tokenized_data_path, pieces_info, dtype, vocab_size=full_tokenizer.vocab_size,
+                   vocab_fingerprint=file_fingerprint(tokenizer_path) if tokenizer_path else None)
     print('finish')
 
 
@@ -46,6 +115,8 @@ def main():
     parser.add_argument('--raw_data_path', default='data/train.json', type=str, required=False, help='原始训练语料')
     parser.add_argument('--tokenized_data_path', default='data/tokenized/', type=str, required=False,
                         help='tokenized语料存放位置')
+    parser.add_argument('--raw_data_format', default=None, choices=FORMATS, required=False,
+                        help='原始语料格式，json为一个文章列表，jsonl为每行一篇文章，默认按文件后缀判断')
     parser.add_argument('--raw', action='store_true', help='是否先做tokenize')
     parser.add_argument('--epochs', default=5, type=int, required=False, help='训练循环')
     parser.add_argument('--batch_size', default=8, type=int, required=False, help='训练batch size')
@@ -53,6 +124,8 @@ def main():
     parser.add_argument('--warmup_steps', default=2000, type=int, required=False, help='warm up步数')
     parser.add_argument('--log_step', default=1, type=int, required=False, help='多少步汇报一次loss')
     parser.add_argument('--stride', default=768, type=int, required=False, help='训练时取训练数据的窗口步长')
+    parser.add_argument('--window_mode', default='stride', choices=['stride', 'document'], required=False,
+                        help='stride为从头按步长取窗口，document为从每篇文章开头起按步长取窗口')
     parser.add_argument('--gradient_accumulation', default=1, type=str, required=False, help='梯度积累')
     parser.add_argument('--fp16', action='store_true', help='混合精度')
     parser.add_argument('--fp16_opt_level', default='O1', type=str, required=False)
@@ -61,12 +134,41 @@ def main():
     parser.add_argument('--min_length', default=128, type=int, required=False, help='最短收录文章长度')
     parser.add_argument('--output_dir', default='model/', type=str, required=False, help='模型输出路径')
     parser.add_argument('--pretrained_model', default='', type=str, required=False, help='模型训练起点路径')
+    parser.add_argument('--loader_workers', default=1, type=int, required=False,
+                        help='训练时准备batch的DataLoader进程数，0为在主进程里准备')
+    parser.add_argument('--prefetch_batches', default=4, type=int, required=False,
+                        help='训练时提前准备多少个batch')
+    parser.add_argument('--prefetch_pieces', default=1, type=int, required=False,
+                        help='训练时在后台提前读进内存的文件数，0为不提前读、直接用memmap')
+    parser.add_argument('--shuffle', default='piece', choices=['piece', 'global'], required=False,
+                        help='piece为打乱文件顺序和文件内的窗口，每个batch来自同一个文件；global为所有文件的窗口放在一起打乱')
+    parser.add_argument('--seed', default=None, type=int, required=False, help='随机种子，不设置时随机选一个并打印出来')
+    parser.add_argument('--checkpoint_steps', default=0, type=int, required=False,
+                        help='每隔多少步保存一次可以继续训练的断点，0为不保存')
+    parser.add_argument('--keep_checkpoints', default=3, type=int, required=False, help='最多保留多少个断点，0为全部保留')
+    parser.add_argument('--resume', action='store_true', help='从output_dir下最新的断点继续训练')
     parser.add_argument('--writer_dir', default='tensorboard_summary/', type=str, required=False, help='Tensorboard路径')
     parser.add_argument('--no_wordpiece', action='store_true', help='不做word piece切词')
+    parser.add_argument('--workers', default=1, type=int, required=False, help='预处理语料时使用的进程数')
+    parser.add_argument('--wordpiece_cache_size', default=0, type=int, required=False,
+                        help='预处理时用LRU缓存多少个词的word piece切分结果，0为不缓存')
+    parser.add_argument('--fast_char_mode', action='store_true',
+                        help='预处理时汉字、数字和标点按字直接查表转成id，结果与不加时完全相同')
+    parser.add_argument('--dedup', action='store_true', help='预处理前去掉完全重复和近似重复的文章')
+    parser.add_argument('--dedup_threshold', default=0.8, type=float, required=False,
+                        help='近似重复的相似度阈值（MinHash估计的Jaccard相似度）')
+    parser.add_argument('--tokenize_cache_dir', default='', type=str, required=False,
+                        help='tokenize缓存目录，设置后重新预处理时只tokenize新增或改动的文章')
 
     args = parser.parse_args()
     print('args:\n' + args.__repr__())
 
+    seed = args.seed if args.seed is not None else random.randrange(1 << 31)
+    print('seed: {}'.format(seed))
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
     if args.no_wordpiece:
         import tokenization_bert_without_wordpiece as tokenization_bert
     else:
@@ -78,7 +180,9 @@ def main():
     print('config:\n' + model_config.to_json_string())
 
     n_ctx = model_config.n_ctx
-    full_tokenizer = tokenization_bert.BertTokenizer(vocab_file=args.tokenizer_path)
+    full_tokenizer = tokenization_bert.BertTokenizer(vocab_file=args.tokenizer_path,
+                                                     wordpiece_cache_size=args.wordpiece_cache_size,
+                                                     fast_char_mode=args.fast_char_mode)
     full_tokenizer.max_len = n_ctx
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
     print('using device:', device)
@@ -92,6 +196,7 @@ def main():
     warmup_steps = args.warmup_steps
     log_step = args.log_step
     stride = args.stride
+    window_mode = args.window_mode
     gradient_accumulation = args.gradient_accumulation
     fp16 = args.fp16  # 不支持半精度的显卡请勿打开
     fp16_opt_level = args.fp16_opt_level
@@ -107,7 +212,11 @@ def main():
     if raw:
         print('building files')
         build_files(data_path=raw_data_path, tokenized_data_path=tokenized_data_path, num_pieces=num_pieces,
-                    full_tokenizer=full_tokenizer, min_length=min_length)
+                    full_tokenizer=full_tokenizer, min_length=min_length, workers=args.workers,
+                    tokenizer_path=args.tokenizer_path, no_wordpiece=args.no_wordpiece,
+                    data_format=args.raw_data_format, cache_dir=args.tokenize_cache_dir, dedup=args.dedup,
+                    dedup_threshold=args.dedup_threshold, wordpiece_cache_size=args.wordpiece_cache_size,
+                    fast_char_mode=args.fast_char_mode)
         print('files built')
 
     if not args.pretrained_model:
@@ -124,17 +233,48 @@ def main():
     print('number of parameters: {}'.format(num_parameters))
 
     multi_gpu = False
-    full_len = 0
     print('calculating total steps')
-    for i in tqdm(range(num_pieces)):
-        with open(tokenized_data_path + 'tokenized_train_{}.txt'.format(i), 'r') as f:
-            full_len += len([int(item) for item in f.read().strip().split()])
-    total_steps = int(full_len / stride * epochs / batch_size / gradient_accumulation)
+    manifest = load_manifest(tokenized_data_path, num_pieces)
+    full_len = check_manifest(manifest, num_pieces, n_ctx, stride, vocab_size=model_config.vocab_size,
+                              vocab_fingerprint=file_fingerprint(args.tokenizer_path))
+    if window_mode == 'document':
+        document_indexes = [load_document_index(document_index_path(tokenized_data_path, i))
+                            for i in range(num_pieces)]
+        if any(offsets is None for offsets in document_indexes):
+            raise ValueError('--window_mode document needs the document index, rebuild the data with --raw')
+        document_lengths = np.concatenate([np.diff(offsets) for offsets in document_indexes])
+        print('documents: {}, mean length {:.1f}, median length {}'.format(
+            len(document_lengths), document_lengths.mean() if len(document_lengths) else 0,
+            int(np.median(document_lengths)) if len(document_lengths) else 0))
+        num_samples = sum(len(document_window_starts(offsets, n_ctx, stride)) for offsets in document_indexes)
+        total_steps = int(num_samples * epochs / batch_size / gradient_accumulation)
+    else:
+        total_steps = int(full_len / stride * epochs / batch_size / gradient_accumulation)
     print('total steps = {}'.format(total_steps))
 
     optimizer = pytorch_transformers.AdamW(model.parameters(), lr=lr, correct_bias=True)
     scheduler = pytorch_transformers.WarmupLinearSchedule(optimizer, warmup_steps=warmup_steps,
                                                           t_total=total_steps)
+
+    checkpoint_dir = os.path.join(output_dir, CHECKPOINT_DIR_NAME)
+    plan_args = {'num_pieces': num_pieces, 'batch_size': batch_size, 'stride': stride, 'n_ctx': n_ctx,
+                 'window_mode': window_mode, 'shuffle': args.shuffle}
+    resume_state = None
+    if args.resume:
+        resume_path = latest_checkpoint(checkpoint_dir)
+        if resume_path is None:
+            print('no checkpoint found in {}, starting from scratch'.format(checkpoint_dir))
+        else:
+            print('resuming from {}'.format(resume_path))
+            model_state, optimizer_state, resume_state = load_checkpoint(resume_path)
+            if resume_state['plan_args'] != plan_args:
+                raise ValueError('the checkpoint was saved with {}, but the current arguments are {}'.format(
+                    resume_state['plan_args'], plan_args))
+            model.load_state_dict(model_state)
+            optimizer.load_state_dict(optimizer_state['optimizer'])
+            scheduler.load_state_dict(optimizer_state['scheduler'])
+            seed = resume_state['seed']
+    saver = CheckpointSaver(checkpoint_dir, keep=args.keep_checkpoints) if args.checkpoint_steps > 0 else None
     if fp16:
         try:
             from apex import amp
@@ -146,82 +286,109 @@ def main():
         print("Let's use", torch.cuda.device_count(), "GPUs!")
         model = DataParallel(model)
         multi_gpu = True
+
+    def piece_starts(i):
+        if window_mode == 'document':
+            return document_window_starts(document_indexes[i], n_ctx, stride)  # 窗口只从文章开头开始取
+        return window_starts(manifest['pieces'][i]['num_tokens'], n_ctx, stride)
+
     print('starting training')
     overall_step = 0
-    for epoch in range(epochs):
+    start_epoch = 0
+    if resume_state is not None:
+        overall_step = resume_state['overall_step']
+        start_epoch = resume_state['epoch']
+    for epoch in range(start_epoch, epochs):
         print('epoch {}'.format(epoch + 1))
         now = datetime.now()
         print('time: {}'.format(now))
-        x = np.linspace(0, num_pieces - 1, num_pieces, dtype=np.int32)
-        random.shuffle(x)
-        piece_num = 0
-        for i in x:
-            running_loss = 0
-            with open(tokenized_data_path + 'tokenized_train_{}.txt'.format(i), 'r') as f:
-                line = f.read().strip()
-            tokens = line.split()
-            tokens = [int(token) for token in tokens]
-            start_point = 0
-            samples = []
-            while start_point < len(tokens) - n_ctx:
-                samples.append(tokens[start_point: start_point + n_ctx])
-                start_point += stride
-            start_point -= stride
-            last = tokens[start_point + n_ctx:]
-            last.extend([full_tokenizer.convert_tokens_to_ids(['[PAD]']) * (n_ctx - len(last))])
-            random.shuffle(samples)
-            for step in range(len(samples) // batch_size):  # drop last
-
-                #  prepare data
-                batch = samples[step * batch_size: (step + 1) * batch_size]
-                batch_labels = []
-                batch_inputs = []
-                for ids in batch:
-                    int_ids_for_labels = [int(x) for x in ids]
-                    int_ids_for_inputs = [int(x) for x in ids]
-                    batch_labels.append(int_ids_for_labels)
-                    batch_inputs.append(int_ids_for_inputs)
-                batch_labels = torch.tensor(batch_labels).long().to(device)
-                batch_inputs = torch.tensor(batch_inputs).long().to(device)
-
-                #  forward pass
-                outputs = model.forward(input_ids=batch_inputs, labels=batch_labels)
-                loss, logits = outputs[:2]
-
-                #  get loss
-                if multi_gpu:
-                    loss = loss.mean()
-                if gradient_accumulation > 1:
-                    loss = loss / gradient_accumulation
-
-                #  loss backward
-                if fp16:
-                    with amp.scale_loss(loss, optimizer) as scaled_loss:
-                        scaled_loss.backward()
-                        torch.nn.utils.clip_grad_norm_(amp.master_params(optimizer), max_grad_norm)
-                else:
-                    loss.backward()
-                    torch.nn.utils.clip_grad_norm_(model.parameters(), max_grad_norm)
-
-                #  optimizer step
-                if (step + 1) % gradient_accumulation == 0:
-                    running_loss += loss.item()
-                    scheduler.step()
-                    optimizer.step()
-                    optimizer.zero_grad()
-                    overall_step += 1
-                    if (overall_step + 1) % log_step == 0:
-                        tb_writer.add_scalar('loss', loss.item(), overall_step)
+        resuming = resume_state is not None and epoch == resume_state['epoch']
+        if resuming:
+            random.setstate(resume_state['epoch_rng'])
+        epoch_rng = random.getstate()  # 排batch之前的随机数状态，继续训练时据此重新排出同样的batch
+        if args.shuffle == 'global':
+            x = None
+            batches = plan_global_epoch(num_pieces, piece_starts, batch_size, np.random.default_rng([seed, epoch]))
+        else:
+            x = np.linspace(0, num_pieces - 1, num_pieces, dtype=np.int32)
+            random.shuffle(x)
+            batches = plan_epoch(x, piece_starts, batch_size)
+        start_batch = 0
+        if resuming:
+            if resume_state['shard_order'] != (None if x is None else x.tolist()):
+                raise ValueError('the shard order does not match the checkpoint')
+            start_batch = resume_state['batch']
+            running_loss = resume_state['running_loss']
+            print('skipping the {} batches of epoch {} trained before the checkpoint'.format(start_batch, epoch + 1))
+        # 已经训练过的batch直接跳过，不会再读对应的文件
+        dataset = WindowBatches(tokenized_data_path, batches[start_batch:], n_ctx, order=x,
+                                prefetch_pieces=args.prefetch_pieces)
+        loader = iter(batch_loader(dataset, workers=args.loader_workers, prefetch_batches=args.prefetch_batches,
+                                   pin_memory=device == 'cuda'))
+        if resuming:
+            set_rng_states(resume_state['rng'])  # 在DataLoader取过种子之后再恢复，随机数和没有中断时完全一致
+        for k, batch in enumerate(loader, start_batch):
+            piece_num, i, step, _ = batches[k]
+            if step == 0:
+                running_loss = 0
+
+            #  prepare data
+            batch_inputs = batch.to(device, non_blocking=True)
+            batch_labels = batch_inputs  # 模型内部会把labels错开一位，输入和标签用同一份数据
+
+            #  forward pass
+            outputs = model.forward(input_ids=batch_inputs, labels=batch_labels)
+            loss, logits = outputs[:2]
+
+            #  get loss
+            if multi_gpu:
+                loss = loss.mean()
+            if gradient_accumulation > 1:
+                loss = loss / gradient_accumulation
+
+            #  loss backward
+            if fp16:
+                with amp.scale_loss(loss, optimizer) as scaled_loss:
+                    scaled_loss.backward()
+                    torch.nn.utils.clip_grad_norm_(amp.master_params(optimizer), max_grad_norm)
+            else:
+                loss.backward()
+                torch.nn.utils.clip_grad_norm_(model.parameters(), max_grad_norm)
+
+            #  optimizer step
+            if (step + 1) % gradient_accumulation == 0:
+                running_loss += loss.item()
+                scheduler.step()
+                optimizer.step()
+                optimizer.zero_grad()
+                overall_step += 1
                 if (overall_step + 1) % log_step == 0:
-                    print('now time: {}:{}. Step {} of piece {} of epoch {}, loss {}'.format(
-                        datetime.now().hour,
-                        datetime.now().minute,
-                        (step + 1) // gradient_accumulation,
-                        piece_num,
-                        epoch + 1,
-                        running_loss * gradient_accumulation / log_step))
-                    running_loss = 0
-            piece_num += 1
+                    tb_writer.add_scalar('loss', loss.item(), overall_step)
+            if (overall_step + 1) % log_step == 0:
+                print('now time: {}:{}. Step {} of piece {} of epoch {}, loss {}'.format(
+                    datetime.now().hour,
+                    datetime.now().minute,
+                    (step + 1) // gradient_accumulation,
+                    piece_num,
+                    epoch + 1,
+                    running_loss * gradient_accumulation / log_step))
+                running_loss = 0
+
+            if saver is not None and (step + 1) % gradient_accumulation == 0 and \
+                    overall_step % args.checkpoint_steps == 0:
+                saver.save(overall_step, model, optimizer, scheduler, {
+                    'plan_args': plan_args,
+                    'seed': seed,
+                    'epoch': epoch,
+                    'epoch_rng': epoch_rng,
+                    'shard_order': None if x is None else x.tolist(),
+                    'batch': k + 1,
+                    'piece_num': piece_num,
+                    'step': step + 1,
+                    'overall_step': overall_step,
+                    'running_loss': running_loss,
+                })
+        dataset.close()
 
         print('saving model for epoch {}'.format(epoch + 1))
         if not os.path.exists(output_dir + 'model_epoch{}'.format(epoch + 1)):
@@ -235,6 +402,8 @@ def main():
         then = datetime.now()
         print('time: {}'.format(then))
         print('time for one epoch: {}'.format(then - now))
+    if saver is not None:
+        saver.close()
 
     print('training finished')
     if not os.path.exists(output_dir + 'final_model'):
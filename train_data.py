@@ -0,0 +1,158 @@
+import random
+import collections
+import numpy as np
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from torch.utils.data import DataLoader, Dataset
+from tokenized_files import load_tokenized_file, read_tokenized_file, tokenized_file_path
+
+'''
+训练数据的输入管道
+每个epoch开始时先排好所有batch（每个batch来自哪个文件、用哪些窗口起点），只需要manifest和文章边界索引，不需要打开语料文件
+之后由DataLoader的worker进程按顺序读出窗口、拼成tensor并提前准备好若干个batch，主进程只负责把batch异步拷到显卡上和训练
+每个准备batch的进程还会在后台线程里按文件顺序提前把接下来的几个文件读进内存，换文件时不用等磁盘
+也可以不按文件分组，把所有文件的窗口放在一起全局打乱（plan_global_epoch），这时所有文件都用memmap打开
+'''
+
+
+def plan_epoch(order, piece_starts, batch_size):
+    """按文件顺序order排好一个epoch的batch，返回[(第几个文件, 文件编号, 文件内第几步, 窗口起点), ...]
+
+    piece_starts(i)返回第i个文件的所有窗口起点，文件内的窗口打乱后按batch_size切开，最后不足一个batch的丢掉
+    """
+    batches = []
+    for piece_num, i in enumerate(order):
+        starts = list(piece_starts(i))
+        random.shuffle(starts)
+        for step in range(len(starts) // batch_size):  # drop last
+            batches.append((piece_num, int(i), step,
+                            np.asarray(starts[step * batch_size: (step + 1) * batch_size], dtype=np.int64)))
+    return batches
+
+
+def plan_global_epoch(num_pieces, piece_starts, batch_size, rng):
+    """把所有文件的窗口放在一起用rng打乱后按batch_size切开，返回的格式和plan_epoch相同
+
+    每个batch的文件编号是一个数组，对应每个窗口各自所在的文件；第几个文件总是0，文件内第几步就是epoch内的第几步
+    """
+    starts = [np.asarray(piece_starts(i), dtype=np.int64) for i in range(num_pieces)]
+    pieces = np.repeat(np.arange(num_pieces, dtype=np.int32), [len(piece) for piece in starts])
+    starts = np.concatenate(starts)
+    permutation = rng.permutation(len(starts))
+    permutation = permutation[:len(permutation) // batch_size * batch_size].reshape(-1, batch_size)  # drop last
+    return [(0, pieces[rows], step, starts[rows]) for step, rows in enumerate(permutation)]
+
+
+class PiecePrefetcher(object):
+    """在后台线程里按order的顺序提前把接下来depth个文件整个读进内存，内存里最多同时有depth + 1个文件"""
+
+    def __init__(self, tokenized_data_path, order, depth):
+        self.tokenized_data_path = tokenized_data_path
+        self.order = list(order)
+        self.depth = depth
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._futures = collections.OrderedDict()
+
+    def _read(self, position):
+        return read_tokenized_file(tokenized_file_path(self.tokenized_data_path, self.order[position]))
+
+    def get(self, position):
+        """返回order[position]的token数组，丢掉之前的文件，并在后台开始读之后的depth个文件"""
+        while self._futures and next(iter(self._futures)) < position:
+            self._futures.popitem(last=False)
+        for p in range(position, min(position + self.depth + 1, len(self.order))):
+            if p not in self._futures:
+                self._futures[p] = self._executor.submit(self._read, p)
+        return self._futures[position].result()
+
+    def close(self):
+        self._futures.clear()
+        self._executor.shutdown(wait=False)
+
+
+class WindowBatches(Dataset):
+    """第k项是batches[k]的窗口拼成的(batch_size, n_ctx)的LongTensor，tokenized文件在用到时才用memmap打开
+
+    窗口不单独切出来，取batch时由窗口起点算出每个位置在token数组里的下标，做一次fancy index直接写进预先分配好的缓冲区
+    prefetch_pieces > 0时按batches里的文件顺序order在后台提前读文件，否则直接用memmap
+    batches来自plan_global_epoch时一个batch里的窗口分属不同文件，按文件分组取，所有用到的文件都保持memmap打开
+    """
+
+    def __init__(self, tokenized_data_path, batches, n_ctx, order=None, prefetch_pieces=0):
+        self.tokenized_data_path = tokenized_data_path
+        self.batches = batches
+        self.n_ctx = n_ctx
+        self.order = order
+        self.prefetch_pieces = prefetch_pieces if order is not None else 0
+        self._prefetcher = None
+        self._offsets = np.arange(n_ctx, dtype=np.int64)
+        self._piece = None
+        self._tokens = None
+        self._memmaps = {}
+        self._index = None
+        self._buffer = None
+
+    def __getstate__(self):
+        # 传给worker进程时不带已经打开的memmap
+        state = self.__dict__.copy()
+        state['_prefetcher'] = None
+        state['_piece'] = None
+        state['_tokens'] = None
+        state['_memmaps'] = {}
+        state['_index'] = None
+        state['_buffer'] = None
+        return state
+
+    def __len__(self):
+        return len(self.batches)
+
+    def _piece_tokens(self, piece_num, i):
+        if i != self._piece:
+            if self.prefetch_pieces > 0:
+                if self._prefetcher is None:
+                    self._prefetcher = PiecePrefetcher(self.tokenized_data_path, self.order, self.prefetch_pieces)
+                self._tokens = self._prefetcher.get(piece_num)
+            else:
+                self._tokens = load_tokenized_file(tokenized_file_path(self.tokenized_data_path, i))
+            self._piece = i
+        return self._tokens
+
+    def _memmap(self, i):
+        if i not in self._memmaps:
+            self._memmaps[i] = load_tokenized_file(tokenized_file_path(self.tokenized_data_path, i))
+        return self._memmaps[i]
+
+    def _buffers(self, batch_size, dtype):
+        if self._buffer is None or self._buffer.shape[0] != batch_size or self._buffer.dtype != dtype:
+            self._index = np.empty((batch_size, self.n_ctx), dtype=np.int64)
+            self._buffer = np.empty((batch_size, self.n_ctx), dtype=dtype)
+        return self._index, self._buffer
+
+    def __getitem__(self, k):
+        piece_num, i, _, starts = self.batches[k]
+        if np.ndim(i) == 0:
+            tokens = self._piece_tokens(piece_num, i)
+            index, buffer = self._buffers(len(starts), tokens.dtype)
+            np.add(starts[:, None], self._offsets, out=index)
+            np.take(tokens, index, out=buffer)
+        else:
+            pieces = np.unique(i)
+            index, buffer = self._buffers(len(starts), self._memmap(pieces[0]).dtype)
+            np.add(starts[:, None], self._offsets, out=index)
+            for piece in pieces:
+                rows = i == piece
+                buffer[rows] = np.take(self._memmap(piece), index[rows])
+        return torch.from_numpy(buffer.astype(np.int64))
+
+    def close(self):
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+            self._prefetcher = None
+
+
+def batch_loader(dataset, workers=0, prefetch_batches=2, pin_memory=False):
+    """按顺序返回dataset的每一项。workers > 0时由worker进程准备，一共提前准备约prefetch_batches个batch"""
+    if workers > 0:
+        return DataLoader(dataset, batch_size=None, num_workers=workers, pin_memory=pin_memory,
+                          prefetch_factor=max(1, -(-prefetch_batches // workers)))
+    return DataLoader(dataset, batch_size=None, pin_memory=pin_memory)
@@ -6,33 +6,85 @@ import random
 import tokenization_bert
 import argparse
 import numpy as np
+import collections
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from torch.nn import DataParallel
 from tqdm import tqdm
+from corpus_reader import iter_text_blocks
+from parallel_utils import imap_in_order, init_tokenizer_worker, tokenize_texts
+from tokenized_files import PiecesWriter, check_manifest, dtype_for_vocab_size, file_fingerprint, load_manifest, \
+    piece_chunk_size, window_starts, write_manifest
+from train_data import WindowBatches, batch_loader, plan_epoch, plan_global_epoch
+from checkpoint import CHECKPOINT_DIR_NAME, CheckpointSaver, latest_checkpoint, load_checkpoint, set_rng_states
 
 '''
 如果训练材料是全部堆在一起不分篇章的话用这个文件
 '''
 
 
-def build_files(raw_data_path, tokenized_data_path, full_tokenizer, num_pieces):
+def build_files(raw_data_path, tokenized_data_path, full_tokenizer, num_pieces, tokenizer_path=None, workers=1,
+                no_wordpiece=False, chunk_size=1 << 20, wordpiece_cache_size=0, fast_char_mode=False):
     if not os.path.exists(tokenized_data_path):
         os.mkdir(tokenized_data_path)
-    with open(raw_data_path, 'r', encoding='utf8') as f:
-        print('reading lines')
-        # lines = json.load(f)
-        lines = f.readlines()
-        lines = [line.replace('\n', ' [SEP] ') for line in lines]  # 用[SEP]表示换行
-        single = ''.join(lines)
-        len_single = len(single)
-        for i in tqdm(range(num_pieces)):
-            single_ids = full_tokenizer.convert_tokens_to_ids(
-                full_tokenizer.tokenize(single[len_single // num_pieces * i: len_single // num_pieces * (i + 1)]))
-            with open(tokenized_data_path + 'tokenized_train_{}.txt'.format(i), 'w') as f:
-                for id in single_ids[:-1]:
-                    f.write(str(id) + ' ')
-                f.write(str(single_ids[-1]))
-                f.write('\n')
+    if workers > 1 and tokenizer_path is None:
+        raise ValueError('tokenizer_path is required when workers > 1')
+    file_size = os.path.getsize(raw_data_path)
+    chunk_size = piece_chunk_size(file_size, num_pieces, chunk_size)
+    positions = collections.deque()
+    read_blocks = collections.deque()  # 还没有全部切出去的块：(读到这块末尾时的字数, 块的文本, 块开头和末尾的字节位置)
+
+    def blocks():
+        chars = 0
+        start = 0
+        for text, position in iter_text_blocks(raw_data_path, chunk_size):
+            chars += len(text)
+            read_blocks.append((chars, text, start, position))
+            start = position
+            yield text
+
+    def chunk_end(chars):
+        """切到第chars个字时在原始语料里的字节位置"""
+        while read_blocks[0][0] < chars:
+            read_blocks.popleft()
+        block_end, text, start, position = read_blocks[0]
+        if block_end == chars:
+            return position
+        return min(start + len(text[:chars - block_end + len(text)].encode('utf8')), position)
+
+    def chunks():
+        # 按块流式读取，每次只在内存中保留约一个chunk，由tokenizer挑不会切断词的地方切开，很长的行也不会整行读进内存
+        # 先切块再把换行换成[SEP]，这样每块的末尾正好对应原始语料里的一个位置
+        chars = 0
+        for text in full_tokenizer.iter_chunks(blocks(), chunk_size):
+            chars += len(text)
+            positions.append(chunk_end(chars))
+            yield [text.replace('\n', ' [SEP] ')]  # 用[SEP]表示换行
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_tokenizer_worker,
+                                       initargs=(tokenizer_path, no_wordpiece, wordpiece_cache_size, fast_char_mode))
+        results = imap_in_order(executor, tokenize_texts, chunks(), 2 * workers)
+    else:
+        executor = None
+        results = (tokenize_texts(texts, full_tokenizer) for texts in chunks())
+
+    dtype = dtype_for_vocab_size(full_tokenizer.vocab_size)
+    writer = PiecesWriter(tokenized_data_path, num_pieces, file_size, dtype)
+    try:
+        with tqdm(total=file_size, unit='B', unit_scale=True) as pbar:
+            for single_ids, _ in results:
+                position = positions.popleft()
+                # 按每块末尾的字节位置把语料平均分到num_pieces个文件里
+                writer.write(single_ids, position)
+                pbar.update(position - pbar.n)
+        pieces_info = writer.finish()
+    finally:
+        writer.close()
+        if executor is not None:
+            executor.shutdown()
+    write_manifest(tokenized_data_path, pieces_info, dtype, vocab_size=full_tokenizer.vocab_size,
+                   vocab_fingerprint=file_fingerprint(tokenizer_path) if tokenizer_path else None)
 
     print('finish')
 
@@ -58,11 +110,37 @@ def main():
     parser.add_argument('--num_pieces', default=100, type=int, required=False, help='将训练语料分成多少份')
     parser.add_argument('--output_dir', default='model/', type=str, required=False, help='模型输出路径')
     parser.add_argument('--pretrained_model', default='', type=str, required=False, help='模型训练起点路径')
+    parser.add_argument('--loader_workers', default=1, type=int, required=False,
+                        help='训练时准备batch的DataLoader进程数，0为在主进程里准备')
+    parser.add_argument('--prefetch_batches', default=4, type=int, required=False,
+                        help='训练时提前准备多少个batch')
+    parser.add_argument('--prefetch_pieces', default=1, type=int, required=False,
+                        help='训练时在后台提前读进内存的文件数，0为不提前读、直接用memmap')
+    parser.add_argument('--shuffle', default='piece', choices=['piece', 'global'], required=False,
+                        help='piece为打乱文件顺序和文件内的窗口，每个batch来自同一个文件；global为所有文件的窗口放在一起打乱')
+    parser.add_argument('--seed', default=None, type=int, required=False, help='随机种子，不设置时随机选一个并打印出来')
+    parser.add_argument('--checkpoint_steps', default=0, type=int, required=False,
+                        help='每隔多少步保存一次可以继续训练的断点，0为不保存')
+    parser.add_argument('--keep_checkpoints', default=3, type=int, required=False, help='最多保留多少个断点，0为全部保留')
+    parser.add_argument('--resume', action='store_true', help='从output_dir下最新的断点继续训练')
     parser.add_argument('--no_wordpiece', action='store_true', help='不做word piece切词')
+    parser.add_argument('--workers', default=1, type=int, required=False, help='预处理语料时使用的进程数')
+    parser.add_argument('--wordpiece_cache_size', default=0, type=int, required=False,
+                        help='预处理时用LRU缓存多少个词的word piece切分结果，0为不缓存')
+    parser.add_argument('--fast_char_mode', action='store_true',
+                        help='预处理时汉字、数字和标点按字直接查表转成id，结果与不加时完全相同')
+    parser.add_argument('--chunk_size', default=1 << 20, type=int, required=False,
+                        help='预处理时每次读入并tokenize的字数，在空白或汉字处切开')
 
     args = parser.parse_args()
     print('args:\n' + args.__repr__())
 
+    seed = args.seed if args.seed is not None else random.randrange(1 << 31)
+    print('seed: {}'.format(seed))
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
     if args.no_wordpiece:
         import tokenization_bert_without_wordpiece as tokenization_bert
     else:
@@ -73,7 +151,9 @@ def main():
     print('config:\n' + model_config.to_json_string())
 
     n_ctx = model_config.n_ctx
-    full_tokenizer = tokenization_bert.BertTokenizer(vocab_file=args.tokenizer_path)
+    full_tokenizer = tokenization_bert.BertTokenizer(vocab_file=args.tokenizer_path,
+                                                     wordpiece_cache_size=args.wordpiece_cache_size,
+                                                     fast_char_mode=args.fast_char_mode)
     full_tokenizer.max_len = n_ctx
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
     print('using device:', device)
@@ -97,7 +177,9 @@ def main():
     if raw:
         print('building files')
         build_files(raw_data_path=raw_data_path, tokenized_data_path=tokenized_data_path, full_tokenizer=full_tokenizer,
-                    num_pieces=num_pieces)
+                    num_pieces=num_pieces, tokenizer_path=args.tokenizer_path, workers=args.workers,
+                    no_wordpiece=args.no_wordpiece, chunk_size=args.chunk_size,
+                    wordpiece_cache_size=args.wordpiece_cache_size, fast_char_mode=args.fast_char_mode)
         print('files built')
 
     if not args.pretrained_model:
@@ -107,17 +189,36 @@ def main():
     model.train()
     model.to(device)
     multi_gpu = False
-    full_len = 0
     print('calculating total steps')
-    for i in tqdm(range(num_pieces)):
-        with open(tokenized_data_path + 'tokenized_train_{}.txt'.format(i), 'r') as f:
-            full_len += len([int(item) for item in f.read().strip().split()])
+    manifest = load_manifest(tokenized_data_path, num_pieces)
+    full_len = check_manifest(manifest, num_pieces, n_ctx, stride, vocab_size=model_config.vocab_size,
+                              vocab_fingerprint=file_fingerprint(args.tokenizer_path))
     total_steps = int(full_len / stride * epochs / batch_size / gradient_accumulation)
     print('total steps = {}'.format(total_steps))
 
     optimizer = pytorch_transformers.AdamW(model.parameters(), lr=lr, correct_bias=True)
     scheduler = pytorch_transformers.WarmupLinearSchedule(optimizer, warmup_steps=warmup_steps,
                                                           t_total=total_steps)
+
+    checkpoint_dir = os.path.join(output_dir, CHECKPOINT_DIR_NAME)
+    plan_args = {'num_pieces': num_pieces, 'batch_size': batch_size, 'stride': stride, 'n_ctx': n_ctx,
+                 'shuffle': args.shuffle}
+    resume_state = None
+    if args.resume:
+        resume_path = latest_checkpoint(checkpoint_dir)
+        if resume_path is None:
+            print('no checkpoint found in {}, starting from scratch'.format(checkpoint_dir))
+        else:
+            print('resuming from {}'.format(resume_path))
+            model_state, optimizer_state, resume_state = load_checkpoint(resume_path)
+            if resume_state['plan_args'] != plan_args:
+                raise ValueError('the checkpoint was saved with {}, but the current arguments are {}'.format(
+                    resume_state['plan_args'], plan_args))
+            model.load_state_dict(model_state)
+            optimizer.load_state_dict(optimizer_state['optimizer'])
+            scheduler.load_state_dict(optimizer_state['scheduler'])
+            seed = resume_state['seed']
+    saver = CheckpointSaver(checkpoint_dir, keep=args.keep_checkpoints) if args.checkpoint_steps > 0 else None
     if fp16:
         try:
             from apex import amp
@@ -129,75 +230,105 @@ def main():
         print("Let's use", torch.cuda.device_count(), "GPUs!")
         model = DataParallel(model)
         multi_gpu = True
+
+    def piece_starts(i):
+        return window_starts(manifest['pieces'][i]['num_tokens'], n_ctx, stride)
+
     print('starting training')
-    for epoch in range(epochs):
+    overall_step = 0
+    start_epoch = 0
+    if resume_state is not None:
+        overall_step = resume_state['overall_step']
+        start_epoch = resume_state['epoch']
+    for epoch in range(start_epoch, epochs):
         print('epoch {}'.format(epoch + 1))
         now = datetime.now()
         print('time: {}'.format(now))
-        x = np.linspace(0, num_pieces - 1, num_pieces, dtype=np.int32)
-        random.shuffle(x)
-        piece_num = 0
-        for i in x:
-            running_loss = 0
-            with open(tokenized_data_path + 'tokenized_train_{}.txt'.format(i), 'r') as f:
-                line = f.read().strip()
-            tokens = line.split()
-            tokens = [int(token) for token in tokens]
-            start_point = 0
-            samples = []
-            while start_point < len(tokens) - n_ctx:
-                samples.append(tokens[start_point: start_point + n_ctx])
-                start_point += stride
-            random.shuffle(samples)
-            for step in range(len(samples) // batch_size):
-
-                #  prepare data
-                batch = samples[step * batch_size: (step + 1) * batch_size]
-                batch_labels = []
-                batch_inputs = []
-                for ids in batch:
-                    int_ids_for_labels = [int(x) for x in ids]
-                    int_ids_for_inputs = [int(x) for x in ids]
-                    batch_labels.append(int_ids_for_labels)
-                    batch_inputs.append(int_ids_for_inputs)
-                batch_labels = torch.tensor(batch_labels).long().to(device)
-                batch_inputs = torch.tensor(batch_inputs).long().to(device)
-
-                #  forward pass
-                outputs = model.forward(input_ids=batch_inputs, labels=batch_labels)
-                loss, logits = outputs[:2]
-
-                #  get loss
-                if multi_gpu:
-                    loss = loss.mean()
-                if gradient_accumulation > 1:
-                    loss = loss / gradient_accumulation
-
-                #  loss backward
-                if fp16:
-                    with amp.scale_loss(loss, optimizer) as scaled_loss:
-                        scaled_loss.backward()
-                        torch.nn.utils.clip_grad_norm_(amp.master_params(optimizer), max_grad_norm)
-                else:
-                    loss.backward()
-                    torch.nn.utils.clip_grad_norm_(model.parameters(), max_grad_norm)
-
-                #  optimizer step
-                if (step + 1) % gradient_accumulation == 0:
-                    running_loss += loss.item()
-                    scheduler.step()
-                    optimizer.step()
-                    optimizer.zero_grad()
-                if (step + 1) % log_step == 0:
-                    print('now time: {}:{}. Step {} of piece {} of epoch {}, loss {}'.format(
-                        datetime.now().hour,
-                        datetime.now().minute,
-                        (step + 1) // gradient_accumulation,
-                        piece_num,
-                        epoch + 1,
-                        running_loss * gradient_accumulation / log_step))
-                    running_loss = 0
-            piece_num += 1
+        resuming = resume_state is not None and epoch == resume_state['epoch']
+        if resuming:
+            random.setstate(resume_state['epoch_rng'])
+        epoch_rng = random.getstate()  # 排batch之前的随机数状态，继续训练时据此重新排出同样的batch
+        if args.shuffle == 'global':
+            x = None
+            batches = plan_global_epoch(num_pieces, piece_starts, batch_size, np.random.default_rng([seed, epoch]))
+        else:
+            x = np.linspace(0, num_pieces - 1, num_pieces, dtype=np.int32)
+            random.shuffle(x)
+            batches = plan_epoch(x, piece_starts, batch_size)
+        start_batch = 0
+        if resuming:
+            if resume_state['shard_order'] != (None if x is None else x.tolist()):
+                raise ValueError('the shard order does not match the checkpoint')
+            start_batch = resume_state['batch']
+            running_loss = resume_state['running_loss']
+            print('skipping the {} batches of epoch {} trained before the checkpoint'.format(start_batch, epoch + 1))
+        # 已经训练过的batch直接跳过，不会再读对应的文件
+        dataset = WindowBatches(tokenized_data_path, batches[start_batch:], n_ctx, order=x,
+                                prefetch_pieces=args.prefetch_pieces)
+        loader = iter(batch_loader(dataset, workers=args.loader_workers, prefetch_batches=args.prefetch_batches,
+                                   pin_memory=device == 'cuda'))
+        if resuming:
+            set_rng_states(resume_state['rng'])  # 在DataLoader取过种子之后再恢复，随机数和没有中断时完全一致
+        for k, batch in enumerate(loader, start_batch):
+            piece_num, i, step, _ = batches[k]
+            if step == 0:
+                running_loss = 0
+
+            #  prepare data
+            batch_inputs = batch.to(device, non_blocking=True)
+            batch_labels = batch_inputs  # 模型内部会把labels错开一位，输入和标签用同一份数据
+
+            #  forward pass
+            outputs = model.forward(input_ids=batch_inputs, labels=batch_labels)
+            loss, logits = outputs[:2]
+
+            #  get loss
+            if multi_gpu:
+                loss = loss.mean()
+            if gradient_accumulation > 1:
+                loss = loss / gradient_accumulation
+
+            #  loss backward
+            if fp16:
+                with amp.scale_loss(loss, optimizer) as scaled_loss:
+                    scaled_loss.backward()
+                    torch.nn.utils.clip_grad_norm_(amp.master_params(optimizer), max_grad_norm)
+            else:
+                loss.backward()
+                torch.nn.utils.clip_grad_norm_(model.parameters(), max_grad_norm)
+
+            #  optimizer step
+            if (step + 1) % gradient_accumulation == 0:
+                running_loss += loss.item()
+                scheduler.step()
+                optimizer.step()
+                optimizer.zero_grad()
+                overall_step += 1
+            if (step + 1) % log_step == 0:
+                print('now time: {}:{}. Step {} of piece {} of epoch {}, loss {}'.format(
+                    datetime.now().hour,
+                    datetime.now().minute,
+                    (step + 1) // gradient_accumulation,
+                    piece_num,
+                    epoch + 1,
+                    running_loss * gradient_accumulation / log_step))
+                running_loss = 0
+
+            if saver is not None and (step + 1) % gradient_accumulation == 0 and \
+                    overall_step % args.checkpoint_steps == 0:
+                saver.save(overall_step, model, optimizer, scheduler, {
+                    'plan_args': plan_args,
+                    'seed': seed,
+                    'epoch': epoch,
+                    'epoch_rng': epoch_rng,
+                    'shard_order': None if x is None else x.tolist(),
+                    'batch': k + 1,
+                    'piece_num': piece_num,
+                    'step': step + 1,
+                    'overall_step': overall_step,
+                    'running_loss': running_loss,
+                })
+        dataset.close()
 
         print('saving model for epoch {}'.format(epoch + 1))
         if not os.path.exists(output_dir + 'model_epoch{}'.format(epoch + 1)):
@@ -211,6 +342,8 @@ def main():
         then = datetime.now()
         print('time: {}'.format(then))
         print('time for one epoch: {}'.format(then - now))
+    if saver is not None:
+        saver.close()
 
     print('training finished')
     if not os.path.exists(output_dir + 'final_model'):
@@ -7,7 +7,9 @@ import argparse
 import numpy as np
 from datetime import datetime
 from torch.nn import DataParallel
-from tqdm import tqdm
+from tokenized_files import check_manifest, file_fingerprint, load_manifest, window_starts
+from train_data import WindowBatches, batch_loader, plan_epoch, plan_global_epoch
+from checkpoint import CHECKPOINT_DIR_NAME, CheckpointSaver, latest_checkpoint, load_checkpoint, set_rng_states
 
 '''
 如果训练材料是全部堆在一起不分篇章的话用这个文件
@@ -39,10 +41,29 @@ def main():
     parser.add_argument('--num_pieces', default=100, type=int, required=False, help='将训练语料分成多少份')
     parser.add_argument('--output_dir', default='model-sp/{}/'.format(g_corpus_name), type=str, required=False, help='模型输出路径')
     parser.add_argument('--pretrained_model', default='', type=str, required=False, help='模型训练起点路径')
+    parser.add_argument('--loader_workers', default=1, type=int, required=False,
+                        help='训练时准备batch的DataLoader进程数，0为在主进程里准备')
+    parser.add_argument('--prefetch_batches', default=4, type=int, required=False,
+                        help='训练时提前准备多少个batch')
+    parser.add_argument('--prefetch_pieces', default=1, type=int, required=False,
+                        help='训练时在后台提前读进内存的文件数，0为不提前读、直接用memmap')
+    parser.add_argument('--shuffle', default='piece', choices=['piece', 'global'], required=False,
+                        help='piece为打乱文件顺序和文件内的窗口，每个batch来自同一个文件；global为所有文件的窗口放在一起打乱')
+    parser.add_argument('--seed', default=None, type=int, required=False, help='随机种子，不设置时随机选一个并打印出来')
+    parser.add_argument('--checkpoint_steps', default=0, type=int, required=False,
+                        help='每隔多少步保存一次可以继续训练的断点，0为不保存')
+    parser.add_argument('--keep_checkpoints', default=3, type=int, required=False, help='最多保留多少个断点，0为全部保留')
+    parser.add_argument('--resume', action='store_true', help='从output_dir下最新的断点继续训练')
 
     args = parser.parse_args()
     print('args:\n' + args.__repr__())
 
+    seed = args.seed if args.seed is not None else random.randrange(1 << 31)
+    print('seed: {}'.format(seed))
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
     os.environ["CUDA_VISIBLE_DEVICES"] = args.device  # 此处设置程序使用哪些显卡
     model_config = pytorch_transformers.modeling_gpt2.GPT2Config.from_json_file(args.model_config)
     print('config:\n' + model_config.to_json_string())
@@ -75,17 +96,36 @@ def main():
     model.train()
     model.to(device)
     multi_gpu = False
-    full_len = 0
     print('calculating total steps')
-    for i in tqdm(range(num_pieces)):
-        with open(os.path.join(tokenized_data_path, 'tokenized_train_{}.txt'.format(i)), 'r') as f:
-            full_len += len([int(item) for item in f.read().strip().split()])
+    manifest = load_manifest(tokenized_data_path, num_pieces)
+    full_len = check_manifest(manifest, num_pieces, n_ctx, stride, vocab_size=model_config.vocab_size,
+                              vocab_fingerprint=file_fingerprint(args.sp_model_file))
     total_steps = int(full_len / stride * epochs / batch_size / gradient_accumulation)
     print('total steps = {}'.format(total_steps))
 
     optimizer = pytorch_transformers.AdamW(model.parameters(), lr=lr, correct_bias=True)
     scheduler = pytorch_transformers.WarmupLinearSchedule(optimizer, warmup_steps=warmup_steps,
                                                           t_total=total_steps)
+
+    checkpoint_dir = os.path.join(output_dir, CHECKPOINT_DIR_NAME)
+    plan_args = {'num_pieces': num_pieces, 'batch_size': batch_size, 'stride': stride, 'n_ctx': n_ctx,
+                 'shuffle': args.shuffle}
+    resume_state = None
+    if args.resume:
+        resume_path = latest_checkpoint(checkpoint_dir)
+        if resume_path is None:
+            print('no checkpoint found in {}, starting from scratch'.format(checkpoint_dir))
+        else:
+            print('resuming from {}'.format(resume_path))
+            model_state, optimizer_state, resume_state = load_checkpoint(resume_path)
+            if resume_state['plan_args'] != plan_args:
+                raise ValueError('the checkpoint was saved with {}, but the current arguments are {}'.format(
+                    resume_state['plan_args'], plan_args))
+            model.load_state_dict(model_state)
+            optimizer.load_state_dict(optimizer_state['optimizer'])
+            scheduler.load_state_dict(optimizer_state['scheduler'])
+            seed = resume_state['seed']
+    saver = CheckpointSaver(checkpoint_dir, keep=args.keep_checkpoints) if args.checkpoint_steps > 0 else None
     if fp16:
         try:
             from apex import amp
@@ -97,76 +137,105 @@ def main():
         print("Let's use", torch.cuda.device_count(), "GPUs!")
         model = DataParallel(model)
         multi_gpu = True
+
+    def piece_starts(i):
+        return window_starts(manifest['pieces'][i]['num_tokens'], n_ctx, stride, random.randrange(stride))
+
     print('starting training')
-    for epoch in range(epochs):
+    overall_step = 0
+    start_epoch = 0
+    if resume_state is not None:
+        overall_step = resume_state['overall_step']
+        start_epoch = resume_state['epoch']
+    for epoch in range(start_epoch, epochs):
         print('epoch {}'.format(epoch + 1))
         now = datetime.now()
         print('time: {}'.format(now))
-        x = np.linspace(0, num_pieces - 1, num_pieces, dtype=np.int32)
-        random.shuffle(x)
-        piece_num = 0
-        for i in x:
-            running_loss = 0
-            with open(os.path.join(tokenized_data_path, 'tokenized_train_{}.txt'.format(i)), 'r') as f:
-                line = f.read().strip()
-            tokens = line.split()
-            tokens = [int(token) for token in tokens]
-            rs = np.random.RandomState(seed=None)
-            start_point = rs.randint(0, stride)
-            samples = []
-            while start_point < len(tokens) - n_ctx:
-                samples.append(tokens[start_point: start_point + n_ctx])
-                start_point += stride
-            random.shuffle(samples)
-            for step in range(len(samples) // batch_size):
-
-                #  prepare data
-                batch = samples[step * batch_size: (step + 1) * batch_size]
-                batch_labels = []
-                batch_inputs = []
-                for ids in batch:
-                    int_ids_for_labels = [int(x) for x in ids]
-                    int_ids_for_inputs = [int(x) for x in ids]
-                    batch_labels.append(int_ids_for_labels)
-                    batch_inputs.append(int_ids_for_inputs)
-                batch_labels = torch.tensor(batch_labels).long().to(device)
-                batch_inputs = torch.tensor(batch_inputs).long().to(device)
-
-                #  forward pass
-                outputs = model.forward(input_ids=batch_inputs, labels=batch_labels)
-                loss, logits = outputs[:2]
-
-                #  get loss
-                if multi_gpu:
-                    loss = loss.mean()
-                if gradient_accumulation > 1:
-                    loss = loss / gradient_accumulation
-
-                #  loss backward
-                if fp16:
-                    with amp.scale_loss(loss, optimizer) as scaled_loss:
-                        scaled_loss.backward()
-                        torch.nn.utils.clip_grad_norm_(amp.master_params(optimizer), max_grad_norm)
-                else:
-                    loss.backward()
-                    torch.nn.utils.clip_grad_norm_(model.parameters(), max_grad_norm)
-
-                #  optimizer step
-                if (step + 1) % gradient_accumulation == 0:
-                    running_loss += loss.item()
-                    optimizer.step()
-                    scheduler.step()
-                    optimizer.zero_grad()
-                if (step + 1) % log_step == 0:
-                    print('now time: {}:{}. Step {} of piece {} of epoch {}, loss {}'.format(
-                        datetime.now().hour,
-                        datetime.now().minute,
-                        (step + 1) // gradient_accumulation,
-                        piece_num,
-                        epoch + 1,
-                        running_loss * gradient_accumulation / log_step))
-                    running_loss = 0
-            piece_num += 1
+        resuming = resume_state is not None and epoch == resume_state['epoch']
+        if resuming:
+            random.setstate(resume_state['epoch_rng'])
+        epoch_rng = random.getstate()  # 排batch之前的随机数状态，继续训练时据此重新排出同样的batch
+        if args.shuffle == 'global':
+            x = None
+            batches = plan_global_epoch(num_pieces, piece_starts, batch_size, np.random.default_rng([seed, epoch]))
+        else:
+            x = np.linspace(0, num_pieces - 1, num_pieces, dtype=np.int32)
+            random.shuffle(x)
+            batches = plan_epoch(x, piece_starts, batch_size)
+        start_batch = 0
+        if resuming:
+            if resume_state['shard_order'] != (None if x is None else x.tolist()):
+                raise ValueError('the shard order does not match the checkpoint')
+            start_batch = resume_state['batch']
+            running_loss = resume_state['running_loss']
+            print('skipping the {} batches of epoch {} trained before the checkpoint'.format(start_batch, epoch + 1))
+        # 已经训练过的batch直接跳过，不会再读对应的文件
+        dataset = WindowBatches(tokenized_data_path, batches[start_batch:], n_ctx, order=x,
+                                prefetch_pieces=args.prefetch_pieces)
+        loader = iter(batch_loader(dataset, workers=args.loader_workers, prefetch_batches=args.prefetch_batches,
+                                   pin_memory=device == 'cuda'))
+        if resuming:
+            set_rng_states(resume_state['rng'])  # 在DataLoader取过种子之后再恢复，随机数和没有中断时完全一致
+        for k, batch in enumerate(loader, start_batch):
+            piece_num, i, step, _ = batches[k]
+            if step == 0:
+                running_loss = 0
+
+            #  prepare data
+            batch_inputs = batch.to(device, non_blocking=True)
+            batch_labels = batch_inputs  # 模型内部会把labels错开一位，输入和标签用同一份数据
+
+            #  forward pass
+            outputs = model.forward(input_ids=batch_inputs, labels=batch_labels)
+            loss, logits = outputs[:2]
+
+            #  get loss
+            if multi_gpu:
+                loss = loss.mean()
+            if gradient_accumulation > 1:
+                loss = loss / gradient_accumulation
+
+            #  loss backward
+            if fp16:
+                with amp.scale_loss(loss, optimizer) as scaled_loss:
+                    scaled_loss.backward()
+                    torch.nn.utils.clip_grad_norm_(amp.master_params(optimizer), max_grad_norm)
+            else:
+                loss.backward()
+                torch.nn.utils.clip_grad_norm_(model.parameters(), max_grad_norm)
+
+            #  optimizer step
+            if (step + 1) % gradient_accumulation == 0:
+                running_loss += loss.item()
+                optimizer.step()
+                scheduler.step()
+                optimizer.zero_grad()
+                overall_step += 1
+            if (step + 1) % log_step == 0:
+                print('now time: {}:{}. Step {} of piece {} of epoch {}, loss {}'.format(
+                    datetime.now().hour,
+                    datetime.now().minute,
+                    (step + 1) // gradient_accumulation,
+                    piece_num,
+                    epoch + 1,
+                    running_loss * gradient_accumulation / log_step))
+                running_loss = 0
+
+            if saver is not None and (step + 1) % gradient_accumulation == 0 and \
+                    overall_step % args.checkpoint_steps == 0:
+                saver.save(overall_step, model, optimizer, scheduler, {
+                    'plan_args': plan_args,
+                    'seed': seed,
+                    'epoch': epoch,
+                    'epoch_rng': epoch_rng,
+                    'shard_order': None if x is None else x.tolist(),
+                    'batch': k + 1,
+                    'piece_num': piece_num,
+                    'step': step + 1,
+                    'overall_step': overall_step,
+                    'running_loss': running_loss,
+                })
+        dataset.close()
 
         print('saving model for epoch {}'.format(epoch + 1))
         if not os.path.exists(output_dir + 'model_epoch{}'.format(epoch + 1)):
@@ -180,6 +249,8 @@ def main():
         then = datetime.now()
         print('time: {}'.format(then))
         print('time for one epoch: {}'.format(then - now))
+    if saver is not None:
+        saver.close()
 
     print('training finished')
     if not os.path.exists(output_dir + 'final_model'):